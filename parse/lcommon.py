@@ -1,35 +1,165 @@
 # AST classes shared in different parsers
 
+import io
+import sys
+import weakref
 from abc import ABC
-from vhlex import VhdlLexer
 
-class FileLocation():
-    def __init__(self, sline, scol, eline=-1, ecol=-1):
-        self.sline = sline
-        self.scol = scol
-        if eline >= 0:
-            self.eline = eline
-        if ecol >= 0:
-            self.ecol = ecol
+
+# escaped names, character literals, and string literals use case-sensitive lookup,
+# identifier names use case-insensitive lookup
+def symbol_key(name):
+    if name[0] != '"' and name[0] != "'" and name[0] != '\\':
+        return sys.intern(name.lower())
+    return sys.intern(str(name))
+
+class Ident(str):
+    """An identifier, character literal or string literal spelling with its precomputed
+       symbol table key.  The lexers intern them, so each distinct spelling is a single
+       object and each key is folded once.  A str subclass can't have slots of its own,
+       the keys that differ from the spelling are kept in identKeys rather than in a
+       __dict__ per Ident."""
+    __slots__ = ()
+
+    def __new__(cls, spelling):
+        ident = super().__new__(cls, spelling)
+        key = symbol_key(spelling)
+        if key != spelling:
+            identKeys[ident] = key      # lower case spellings are their own key
+        return ident
+
+    @property
+    def key(self):
+        return identKeys.get(self, self)
+
+    def __reduce__(self):
+        return (intern_ident, (str(self),))
+
+# the global identifier intern table: spelling -> Ident, and the keys of the Idents
+# that aren't lower case
+identTable = {}
+identKeys = {}
+
+def intern_ident(spelling):
+    ident = identTable.get(spelling)
+    if ident is None:
+        ident = Ident(spelling)
+        identTable[ident] = ident       # an equal key, the spelling itself isn't kept
+    return ident
+
+def name_key(name):
+    try:
+        return name.key      # an Ident (or a Symbol)
+    except AttributeError:
+        return symbol_key(name)
+
+class Location():
+    """The place of a name in the source, lines start at 1 and columns at 0, -1 if
+       unknown.  fileid is the SourceManager id of the file, -1 if the source didn't come
+       from one."""
+    __slots__ = ()
+
+    lineTable = None        # the LineTable of the source, if the location keeps one
 
     def __repr__(self):
         return self.dumpInternals()
     
     def dumpInternals(self):
         result = f"FileLocation(sline={self.sline}, scol={self.scol}"
-        if hasattr(self, 'eline') and self.eline >= 0:
+        if self.eline >= 0:
             result += f", eline={self.eline}"
-        if hasattr(self, 'ecol') and self.ecol >= 0:
+        if self.ecol >= 0:
             result += f", ecol={self.ecol}"
+        if self.fileid >= 0:
+            result += f", fileid={self.fileid}"
         result += ")"
         return result
 
-class Symbol():
-    def __init__(self, name, fLoc=None):
+class FileLocation(Location):
+    __slots__ = ('sline', 'scol', 'eline', 'ecol', 'fileid')
+
+    def __init__(self, sline, scol, eline=-1, ecol=-1, fileid=-1):
+        self.sline = sline
+        self.scol = scol
+        self.eline = eline
+        self.ecol = ecol
+        self.fileid = fileid
+
+class LocationView(Location):
+    """A location of a LocationTable (lsource), made when it is asked for.  The lines
+       and columns are computed from the LineTable of the source."""
+    __slots__ = ('table', 'handle')
+
+    def __init__(self, table, handle):
+        self.table = table
+        self.handle = handle
+
+    @property
+    def lineTable(self):
+        return self.table.lineTable(self.handle)
+
+    @property
+    def fileid(self):
+        return self.table.fileids[self.handle]
+
+    @property
+    def spos(self):
+        return self.table.starts[self.handle]
+
+    @property
+    def epos(self):
+        # the offset just past the end, -1 if the location has no end
+        return self.table.ends[self.handle]
+
+    @property
+    def sline(self):
+        return self.lineTable.line(self.spos)
+
+    @property
+    def scol(self):
+        return self.lineTable.column(self.spos)
+
+    @property
+    def eline(self):
+        epos = self.epos
+        return self.lineTable.line(epos - 1) if epos >= 0 else -1
+
+    @property
+    def ecol(self):
+        epos = self.epos
+        return self.lineTable.column(epos - 1) if epos >= 0 else -1
+
+class Located():
+    """Base of the classes that keep their source location as a handle into the
+       LocationTable of their parse, loc is the LocationView, None if there is none"""
+    __slots__ = ('locs', 'handle')
+
+    def __init__(self):
+        self.locs = None
+        self.handle = -1
+
+    @property
+    def loc(self):
+        if self.locs is None:
+            return None
+        return LocationView(self.locs, self.handle)
+
+    def setLoc(self, p, sidx, eidx=-1):
+        """The location of tokens sidx to eidx of the production"""
+        epos = end_offset(p, eidx) if eidx != -1 else -1
+        self.locs = p.lexer.locations
+        self.handle = self.locs.add(line_table(p, sidx), p.lexpos(sidx), epos, file_id(p, sidx))
+
+class Symbol(Located):
+    __slots__ = ('name', 'key', 'ast', 'defn', 'value')
+
+    def __init__(self, name):
+        super().__init__()
         self.name = name
-        self.loc = fLoc
+        self.key = name_key(name)
         self.ast = None  # the defining object: design units, declarations
         self.defn = None
+        self.value = None   # the folded value of a constant, enumeration literal or unit
 
     def __str__(self):
         return self.decompile()
@@ -51,37 +181,101 @@ class Symbol():
         result += ")"
         return result
 
-    def setLoc(self, p, sidx, eidx=-1):
-        eline = -1
-        ecol = -1
-        sline = p.lineno(sidx)
-        scol = start_column(p, sidx)
-        if eidx != -1:
-            eline = p.lineno(eidx)
-            ecol = end_column(p, eidx) 
-        self.loc = FileLocation(sline, scol, eline, ecol)
+
+class Emitter():
+    """Base of the AST nodes that write their source text to a file like object.  A
+       node overrides emit(out, indent), writing its pieces and having its children
+       write theirs to the same out, or only decompile(indent) when its text is short.
+       Either one gives the other, so str() of a node and writing a whole design file
+       to a file give the same text, the file without holding it in memory."""
+    __slots__ = ()
+
+    def emit(self, out, indent=0):
+        out.write(self.decompile(indent))
+
+    def decompile(self, indent=0):
+        if type(self).emit is Emitter.emit:
+            raise NotImplementedError(f"{type(self).__name__} has no source text")
+        out = io.StringIO()
+        self.emit(out, indent)
+        return out.getvalue()
 
 
 class SymbolTable():     # does this need to be concrete?  are there unnamed scopes in Vhdl?
+    __slots__ = ('outer', 'symbols', 'overloads', 'visible', 'dependents', 'readers', '__weakref__')
+
     def __init__(self, outer=None):
         # outer is a single SymbolTable or a vhContextClause
         self.outer = outer
         self.symbols = {}
-    
+        self.overloads = None   # key -> the OverloadSet of the subprograms declared here
+        # the visibility index: key -> the symbols searchKey() finds, filled as keys are
+        # searched, and key -> weak references to the tables whose index entry for key was
+        # found through this one, dropped with the entry.  A change of key here drops
+        # the entry of each of those tables, the changes that can move any key (new
+        # subscopes, use clauses, a new outer) drop them all.  readers are the scopes
+        # which make the symbols of this table visible as a public subscope or a used
+        # scope, a change of key here is a change of key there.
+        self.visible = {}
+        self.dependents = {}
+        self.readers = None
+
+    def __getstate__(self):
+        # the visibility index isn't pickled, it fills again as keys are searched
+        state = { name: getattr(self, name) for cls in type(self).__mro__
+                  for name in cls.__dict__.get('__slots__', ()) }
+        del state['visible'], state['dependents'], state['readers'], state['__weakref__']
+        return None, state
+
+    def __setstate__(self, state):
+        for name, value in state[1].items():
+            setattr(self, name, value)
+        self.visible = {}
+        self.dependents = {}
+        if not hasattr(self, 'readers'):     # a reader unpickled first has registered
+            self.readers = None
+        for scope in getattr(self, 'public_subscopes', ()) + getattr(self, 'used', ()):
+            scope.addReader(self)
+
     def add(self, sym):
-        key = str(sym)  # escaped names, character literals, and string literals use case-sensitive lookup
-        if key[0] != '"' and key[0] != "'" and key[0] != '\\':
-            # identifier names use case-insensitive lookup
-            key = key.lower()
-        self.symbols[key] = sym
+        self.symbols[sym.key] = sym
+        self.changed(sym.key)
+
+    def remove(self, sym):
+        if self.symbols.get(sym.key) is sym:
+            del self.symbols[sym.key]
+            self.changed(sym.key)
+
+    def changed(self, key=None):
+        """What the table makes visible changed, for key or for any key if None"""
+        if key is None:
+            dependents, self.dependents = self.dependents, {}
+            for key, tables in dependents.items():
+                drop_entries(tables, key)
+            self.visible = {}
+        else:
+            self.dropKey(key)
+
+    def dropKey(self, key):
+        # the index entries of key found through the table
+        drop_entries(self.dependents.pop(key, ()), key)
+        self.visible.pop(key, None)
+        if self.readers:
+            for scope in self.readers:
+                scope.dropKey(key)
+
+    def addReader(self, scope):
+        # scope makes the symbols of the table visible
+        if getattr(self, 'readers', None) is None:
+            self.readers = weakref.WeakSet()
+        self.readers.add(scope)
+
+    def setOuter(self, outer):
+        self.outer = outer
+        self.changed()
 
     def find(self, name):
-        key = name  # escaped names, character literals, and string literals use case-sensitive lookup
-        if key[0] != '"' and key[0] != "'" and key[0] != '\\':
-            # identifier names use case-insensitive lookup
-            key = key.lower()
-        sym = self.symbols.get(key, None)  # dict.get() not SymbolTable.get()
-        return sym
+        return self.symbols.get(name_key(name), None)  # dict.get() not SymbolTable.get()
     
     def get(self, name):
         sym = self.find(name)
@@ -96,27 +290,137 @@ class SymbolTable():     # does this need to be concrete?  are there unnamed sco
         sym = self.find(p[idx])
         if sym:
             return sym   
-        sym = Symbol(p[idx], FileLocation(p.lineno(idx), start_column(p, idx)))
+        sym = Symbol(p[idx])
+        sym.setLoc(p, idx)
         self.add(sym)
         return sym
 
     def search(self, name):
+        return self.searchKey(name_key(name))
+
+    def searchKey(self, key):
+        """The symbols of key visible from the table, nearest first.  The list is shared
+           with the index, don't change it."""
+        syms = self.visible.get(key)
+        if syms is None:
+            syms = self.indexKey(key)
+        return syms
+
+    def indexKey(self, key):
+        # walk the tables for key, each one keeps this table as a dependent of key
         syms = []
-        sym = self.find(name)
-        if sym:
-            syms.append(sym)
+        ref = weakref.ref(self)
+        table = self
+        while table:
+            add_new(syms, table.localKey(key))
+            tables = table.dependents.get(key)
+            if tables is None:
+                tables = table.dependents[key] = set()
+            tables.add(ref)
+            table = table.outer
+        self.visible[key] = syms
+        return syms
+
+    def localKey(self, key):
+        # the symbols of key the table itself makes visible, without the outer tables
+        sym = self.symbols.get(key)
+        return [ sym ] if sym else []
+
+    def walkKey(self, key):
+        """searchKey() without the index, every table is searched again"""
+        syms = self.localKey(key)
         if self.outer:
-            syms += self.outer.search(name)
+            add_new(syms, self.outer.walkKey(key))
         return syms
 
+    def overload(self, decl):
+        """Add the subprogram decl to the overload set of its designator.  Returns the
+           earlier declaration with the same signature, None if there is none."""
+        if self.overloads is None:
+            self.overloads = {}
+        overloads = self.overloads.get(decl.name.key)
+        if overloads is None:
+            overloads = self.overloads[decl.name.key] = OverloadSet()
+        return overloads.add(decl)
+
+    def localOverloads(self, key):
+        overloads = self.overloads.get(key) if self.overloads else None
+        return [ overloads ] if overloads else []
+
+    def searchOverloads(self, key):
+        """The overload sets of key visible from the table, nearest first"""
+        sets = self.localOverloads(key)
+        if self.outer:
+            sets += self.outer.searchOverloads(key)
+        return sets
+
+    def resolve(self, name, arity=None, params=None, result=None):
+        """The visible subprograms name can call, see OverloadSet.candidates()"""
+        decls = []
+        for overloads in self.searchOverloads(name_key(name)):
+            decls += overloads.candidates(arity, params, result)
+        return decls
+
+
+class OverloadSet():
+    """The subprograms declared with one designator in a table.  The members are
+       indexed by their signature, by their parameter types alone and by the number of
+       arguments a call to them can have, so resolving a call doesn't look at every
+       declaration.  A member has signature() -> (parameter type keys, result type key)
+       and required(), the number of parameters without a default."""
+    __slots__ = ('members', 'signatures', 'profiles', 'arities')
+
+    def __init__(self):
+        self.members = []
+        self.signatures = {}    # (parameter type keys, result type key) -> [ the member ]
+        self.profiles = {}      # parameter type keys -> members, whatever their result
+        self.arities = {}       # number of arguments -> the members a call with that many can be
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return f"OverloadSet({', '.join(str(decl.name) for decl in self.members[:1])}, members={len(self.members)})"
+
+    def add(self, decl):
+        """Add decl, unless a member has the same signature: a homograph isn't added,
+           the earlier member is returned for it to be reported"""
+        params, result = signature = decl.signature()
+        earlier = self.signatures.get(signature)
+        if earlier:
+            return earlier[0]
+        self.signatures[signature] = [ decl ]
+        self.members.append(decl)
+        self.profiles.setdefault(params, []).append(decl)
+        for arity in range(decl.required(), len(params) + 1):
+            self.arities.setdefault(arity, []).append(decl)
+        return None
+
+    def candidates(self, arity=None, params=None, result=None):
+        """The members a call can be: those with the parameter type keys params, else
+           those that take arity arguments, else all of them.  result, the key of the
+           type the call must return, narrows them further."""
+        if params is not None:
+            params = tuple(params)
+            if result is not None:
+                return self.signatures.get((params, result), [])
+            return self.profiles.get(params, [])
+        decls = self.members if arity is None else self.arities.get(arity, [])
+        if result is not None:
+            decls = [ decl for decl in decls if decl.signature()[1] == result ]
+        return decls
+
 
 # a Scope is named symbol table.  The name is represented by the symbol of the 
 # the design_unit name, subprogram name, or record name which introduces the scope
 class Scope(SymbolTable):
+    __slots__ = ('name', 'public_subscopes', 'used')
+
     def __init__(self, nameSym, outer=None):
         super().__init__(outer)
         self.name = nameSym
         self.public_subscopes = []
+        self.used = []      # scopes made visible by use clauses, searched but not exported
      
     # the next two are for simple form (name only) internal dumping
     def __str__(self):
@@ -140,32 +444,162 @@ class Scope(SymbolTable):
         result += "])"
         return result
     
-    # override SymbolTable.search()
-    def search(self, name):
+    def addSubscopes(self, scopes):
+        """Make the symbols of scopes visible in this scope and exported with it"""
+        self.public_subscopes.extend(scopes)
+        for scope in scopes:
+            scope.addReader(self)
+        self.changed()
+
+    def use(self, scopes):
+        """Make the symbols of scopes visible in this scope (a use clause).  A symbol
+           added to one of the scopes later is visible too."""
+        self.used.extend(scopes)
+        for scope in scopes:
+            scope.addReader(self)
+        self.changed()
+
+    # override SymbolTable.localKey()
+    def localKey(self, key):
         syms = []
-        sym = self.find(name)
+        sym = self.symbols.get(key)
         if sym:
             syms.append(sym)
         for scope in self.public_subscopes:
-            sym = scope.find(name)
+            sym = scope.symbols.get(key)
+            if sym:
+                syms.append(sym)
+        for scope in self.used:
+            sym = scope.symbols.get(key)
             if sym:
                 syms.append(sym)
-        if self.outer:
-            syms += self.outer.search(name)
         return syms
 
+    # override SymbolTable.localOverloads()
+    def localOverloads(self, key):
+        sets = []
+        for scope in [ self ] + self.public_subscopes + self.used:
+            overloads = scope.overloads.get(key) if scope.overloads else None
+            if overloads:
+                sets.append(overloads)
+        return sets
+
     
 # utility functions
+def drop_entries(refs, key):
+    # drop the index entries of key of the tables still alive
+    for ref in refs:
+        table = ref()
+        if table is not None:
+            table.visible.pop(key, None)
+
+def add_new(syms, more):
+    # a public subscope is searched both from within and from its declaring scope,
+    # the same symbol found twice is not ambiguous
+    for sym in more:
+        if sym not in syms:
+            syms.append(sym)
+
+def line_table(p, idx):
+    """The LineTable of the source of a token in the production"""
+    return token_line_table(p.lexer, p.slice[idx])
+
+def token_line_table(lexer, tok):
+    fileid = getattr(tok, 'fileid', -1)
+    if fileid >= 0 and hasattr(lexer, 'lineTableOf'):
+        return lexer.lineTableOf(fileid)
+    return getattr(lexer, 'lineTable', None)
+
+def end_offset(p, idx):
+    # the offset just past the token
+    return p.lexpos(idx) + line_table(p, idx).size(p[idx])
+
 def end_column(p, idx):
-    return p.lexpos(idx) - p.lexer.lineStart - 1
+    """Column of the last character of the token"""
+    return line_table(p, idx).column(end_offset(p, idx) - 1)
 
 def start_column(p, idx):
-    """Compute column given the current line start (saved in the lexer)
-       and the token lexical position"""
-    return end_column(p, idx) - len(p[idx]) + 1   
+    """Compute column from the token lexical position and the line table of its source"""
+    return line_table(p, idx).column(p.lexpos(idx))
+
+def file_id(p, idx):
+    """The SourceManager file id of a token in the production, -1 if unknown"""
+    return getattr(p.slice[idx], 'fileid', -1)
+
+INDENT = "    "
+indents = [ INDENT * ii for ii in range(16) ]     # the prefixes of the usual depths
 
 def indentPrefix(indent):
-    result = ""
-    for ii in range(0,indent):
-        result += "    "
-    return result
+    if 0 <= indent < len(indents):
+        return indents[indent]
+    return INDENT * indent
+
+
+# benchmarks
+
+def visibility_scopes(ntypes, nliterals):
+    # root <- package that uses all of a package of ntypes enum types of nliterals
+    # literals each <- subprogram interface, and the keys the subprogram refers to
+    import random
+    types = Scope(Symbol("types"))
+    for ii in range(ntypes):
+        enum = Scope(Symbol(f"t{ii}"), types)
+        types.add(enum.name)
+        types.addSubscopes([ enum ])
+        for jj in range(nliterals):
+            enum.add(Symbol(f"t{ii}_{jj}"))
+    root = Scope(Symbol("_root"))
+    pkg = Scope(Symbol("pkg"), root)
+    pkg.use([ types ] + types.public_subscopes)
+    for ii in range(ntypes):
+        pkg.add(Symbol(f"c{ii}"))
+    inner = SymbolTable(pkg)
+    keys = [ key for scope in [ pkg, types ] + types.public_subscopes for key in scope.symbols ]
+    keys += [ f"missing{ii}" for ii in range(ntypes) ]
+    random.Random(1).shuffle(keys)
+    return inner, keys
+
+def visibility_bench(types=(10, 100, 1000), literals=8, repeat=5, runs=3):
+    """Print the searchKey lookups per second, indexed and walking the scopes, after
+       checking that both find the same symbols.  Returns 1 if they don't."""
+    import time
+    print(f"{'types':>6} {'literals':>8} {'walk/s':>12} {'indexed/s':>12} {'speedup':>8}")
+    for ntypes in types:
+        inner, keys = visibility_scopes(ntypes, literals)
+        # the index is filled, then symbols added at each level, to the used scopes, and a
+        # use clause must drop its entries
+        agree = all(inner.searchKey(key) == inner.walkKey(key) for key in keys)
+        pkg = inner.outer
+        used = pkg.used[0]
+        for table, key in ((pkg.outer, keys[0]), (pkg, keys[1]), (pkg, "missing0"), (used, "missing1"),
+                           (used.public_subscopes[-1], "missing2")):
+            table.add(Symbol(key))
+        agree = agree and all(inner.searchKey(key) == inner.walkKey(key) for key in keys)
+        late = Scope(Symbol("late"))
+        late.add(Symbol("missing3"))
+        pkg.use([ late ])
+        late.add(Symbol("missing4"))
+        agree = agree and all(inner.searchKey(key) == inner.walkKey(key) for key in keys)
+        # the tables the index keeps as dependents are not kept alive by it
+        temporary = SymbolTable(pkg)
+        for key in keys:
+            temporary.searchKey(key)
+        gone = weakref.ref(temporary)
+        del temporary
+        agree = agree and gone() is None
+        if not agree:
+            print(f"{ntypes} types: the index and the walk disagree")
+            return 1
+        rates = []
+        for search in (inner.walkKey, inner.searchKey):
+            best = None
+            for ii in range(runs):
+                start = time.perf_counter()
+                for jj in range(repeat):
+                    for key in keys:
+                        search(key)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            rates.append(len(keys) * repeat / best)
+        print(f"{ntypes:6} {literals:8} {rates[0]:12,.0f} {rates[1]:12,.0f} {rates[1] / rates[0]:7.1f}x")
+    return 0
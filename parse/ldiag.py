@@ -0,0 +1,106 @@
+# diagnostics shared by the different parsers
+#
+# The lexers and parsers report diagnostics to a DiagnosticSink as compact records:
+# a message code, the severity, the source offset and the message arguments.  The
+# messages are only formatted when the records are consumed, and a sink can drop
+# records by severity, limit the number recorded per code, or only count them.
+
+import sys
+from collections import namedtuple
+
+# severities, ordered like the logging levels
+NOTE = 10
+WARNING = 20
+ERROR = 30
+
+severityNames = { NOTE: "note", WARNING: "warning", ERROR: "error" }
+
+# lines is the LineTable of the source, None if the offset is unknown
+Diagnostic = namedtuple('Diagnostic', 'code severity offset lines args')
+
+
+class DiagnosticSink():
+    """Collects the diagnostics of a parse.
+
+       messages maps each code to (severity, format).  The format is a str.format()
+       string, {0}, {1}, .. are the arguments given to report(), {line} and {col} the
+       position of the offset.
+
+       severity is the lowest severity kept, anything below is dropped before any
+       other work.  limit is the most records kept per code (None for no limit),
+       limits overrides it for single codes.  With countOnly nothing is recorded,
+       the sink only counts the diagnostics of each code."""
+
+    def __init__(self, messages, severity=NOTE, limit=None, limits=None, countOnly=False):
+        self.messages = messages
+        self.limit = limit
+        self.limits = dict(limits or {})
+        self.countOnly = countOnly
+        self.counts = {}        # code -> number reported, including the ones not recorded
+        self.records = []
+        self.setSeverity(severity)
+
+    def setSeverity(self, severity):
+        self.severity = severity
+        # the codes that pass the severity filter
+        self.active = frozenset(code for code, (sev, fmt) in self.messages.items() if sev >= severity)
+
+    def enabled(self, code):
+        """False if a report of code would be dropped, callers can skip preparing
+           the arguments"""
+        return code in self.active
+
+    def report(self, code, offset=-1, lines=None, *args):
+        if code not in self.active:
+            return
+        count = self.counts.get(code, 0) + 1
+        self.counts[code] = count
+        if self.countOnly:
+            return
+        limit = self.limits.get(code, self.limit)
+        if limit is not None and count > limit:
+            return
+        self.records.append(Diagnostic(code, self.messages[code][0], offset, lines, args))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def count(self, severity=NOTE):
+        """Number of diagnostics reported at or above severity, recorded or not"""
+        return sum(n for code, n in self.counts.items() if self.messages[code][0] >= severity)
+
+    def suppressed(self):
+        """code -> number of diagnostics counted but not recorded"""
+        recorded = {}
+        for record in self.records:
+            recorded[record.code] = recorded.get(record.code, 0) + 1
+        return { code: n - recorded.get(code, 0) for code, n in self.counts.items()
+                 if n > recorded.get(code, 0) }
+
+    def format(self, record):
+        line = col = -1
+        prefix = ""
+        if record.lines is not None:
+            if record.offset >= 0:
+                line, col = record.lines.position(record.offset)
+            if record.lines.path:
+                prefix = f"{record.lines.path}: "
+        return prefix + self.messages[record.code][1].format(*record.args, line=line, col=col)
+
+    def formatted(self):
+        for record in self.records:
+            yield self.format(record)
+
+    def dump(self, file=None):
+        file = file or sys.stdout
+        for message in self.formatted():
+            print(message, file=file)
+        for code, n in sorted(self.suppressed().items()):
+            print(f"{n} more '{code}' diagnostics not shown", file=file)
+
+    def clear(self):
+        self.counts = {}
+        self.records = []
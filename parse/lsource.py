@@ -0,0 +1,254 @@
+# source files shared by the different parsers
+#
+# The SourceManager memory maps each input file and gives it a small integer id.
+# Lexers that accept bytes-like input (VhdlScanner) scan the mapped buffers in place,
+# so the sources are neither decoded nor concatenated before parsing.
+
+import mmap
+import re
+from array import array
+from bisect import bisect_right
+
+
+NEWLINE_RE = re.compile("\n")
+NEWLINE_BYTES_RE = re.compile(b"\n")
+
+class LineTable():
+    """The offsets where the lines of a source buffer (str or bytes-like) start.
+       The offsets are found with one scan for newlines, the first time a position
+       is asked for, and any offset (lexpos) maps to its line by binary search.
+       Lines are numbered from 1, columns from 0 like the lexer offsets.  Columns
+       of bytes-like sources count characters, not bytes.
+
+       data may be a part of a larger source, origin is then the line and column in
+       the larger source where data starts.  Offsets stay relative to data,
+       lines and columns are those of the larger source."""
+
+    def __init__(self, data, path=None, origin=(1, 0)):
+        self.data = data
+        self.path = path        # for diagnostics, None if the data didn't come from a file
+        self.encoded = not isinstance(data, str)
+        self.starts = None      # array('q') of line start offsets, built on first use
+        self.setOrigin(*origin)
+
+    def setOrigin(self, firstLine, firstColumn):
+        # moving the part within the larger source moves every position computed from it
+        self.firstLine = firstLine
+        self.firstColumn = firstColumn
+
+    def build(self):
+        newline = NEWLINE_BYTES_RE if self.encoded else NEWLINE_RE
+        self.starts = array('q', [0])
+        self.starts.extend(m.end() for m in newline.finditer(self.data))
+        return self.starts
+
+    def __len__(self):
+        return len(self.starts or self.build())
+
+    def line(self, pos):
+        return bisect_right(self.starts or self.build(), pos) + self.firstLine - 1
+
+    def lineStart(self, line):
+        return (self.starts or self.build())[line - self.firstLine]
+
+    def column(self, pos):
+        return self.position(pos)[1]
+
+    def position(self, pos):
+        """(line, column) of an offset"""
+        index = bisect_right(self.starts or self.build(), pos)
+        start = self.starts[index - 1]
+        if self.encoded and self.data is not None:
+            column = len(self.data[start:pos].decode('utf-8', errors='ignore'))
+        else:
+            column = pos - start
+        if index == 1:
+            column += self.firstColumn
+        return index + self.firstLine - 1, column
+
+    def __getstate__(self):
+        # pickled like a detached table, mapped buffers can't be pickled
+        if self.starts is None:
+            self.build()
+        state = self.__dict__.copy()
+        state['data'] = None
+        return state
+
+    def detach(self):
+        """Keep the line starts but drop the data, for a source that is closed while
+           locations or diagnostics still refer to it.  Columns then count bytes."""
+        if self.starts is None:
+            self.build()
+        self.data = None
+
+    def size(self, text):
+        # the size of token text in offsets, bytes for bytes-like sources
+        return len(text.encode('utf-8')) if self.encoded else len(text)
+
+
+class LocationTable():
+    """The source locations of a parse, in columns: for each location the LineTable it
+       is in (an index into lineTables), the SourceManager file id and the start and
+       end offsets.  Symbols and AST nodes keep an int handle into the table rather
+       than a location object each, lcommon.LocationView computes the lines and columns
+       when they are asked for."""
+
+    def __init__(self):
+        self.lineTables = []
+        self.indexes = {}       # id(LineTable) -> index in lineTables
+        self.tables = array('i')
+        self.fileids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')  # offset just past the end, -1 if the location has no end
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return f"LocationTable(locations={len(self.starts)}, lineTables={len(self.lineTables)})"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['indexes']    # ids don't survive pickling
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.indexes = { id(lines): index for index, lines in enumerate(self.lineTables) }
+
+    def add(self, lines, spos, epos=-1, fileid=-1):
+        """The handle of a new location at offsets spos to epos of the LineTable lines"""
+        index = self.indexes.get(id(lines))
+        if index is None:
+            index = self.indexes[id(lines)] = len(self.lineTables)
+            self.lineTables.append(lines)
+        self.tables.append(index)
+        self.fileids.append(fileid)
+        self.starts.append(spos)
+        self.ends.append(epos)
+        return len(self.starts) - 1
+
+    def lineTable(self, handle):
+        return self.lineTables[self.tables[handle]]
+
+
+class SourceFile():
+    def __init__(self, fileid, path, buffer):
+        self.fileid = fileid
+        self.path = path
+        self.buffer = buffer    # an mmap, or bytes for empty files which can't be mapped
+        self.lineTable = LineTable(buffer, path)
+
+    def __repr__(self):
+        return f"SourceFile(fileid={self.fileid}, path={self.path}, size={len(self.buffer)})"
+
+    def text(self, encoding='utf-8'):
+        # decoded copy for lexers that only accept str
+        return bytes(self.buffer).decode(encoding, errors='ignore')
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.lineTable.detach()
+            self.buffer.close()
+
+
+class SourceManager():
+    def __init__(self, paths=()):
+        self.files = []
+        self.ids = {}       # path -> fileid
+        for path in paths:
+            self.add(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def add(self, path):
+        """Map the file at path and return its file id.  Adding a path twice returns the same id."""
+        fileid = self.ids.get(path)
+        if fileid is not None:
+            return fileid
+        with open(path, 'rb') as src:
+            try:
+                buffer = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                buffer = b""
+        fileid = len(self.files)
+        self.files.append(SourceFile(fileid, path, buffer))
+        self.ids[path] = fileid
+        return fileid
+
+    def get(self, fileid):
+        return self.files[fileid]
+
+    def path(self, fileid):
+        if 0 <= fileid < len(self.files):
+            return self.files[fileid].path
+        return None
+
+    def close(self):
+        for src in self.files:
+            src.close()
+
+
+class SourceLexer():
+    """Presents the files of a SourceManager to the parser as a single token stream.
+       Each file is lexed separately, so line numbers restart at 1, and every token
+       carries the id of the file it came from in tok.fileid (see lineTableOf()).  Lexers that accept
+       bytes-like input get the mapped buffers, other lexers get decoded text."""
+
+    def __init__(self, lexer, sources, inplace=True):
+        self.lexer = lexer          # the ply lexer or a VhdlScanner
+        self.sources = sources
+        self.inplace = inplace
+        self.pending = iter(sources)
+        self.fileid = -1
+        self.lineTables = {}    # fileid -> LineTable of the data given to the lexer
+
+    def __getattr__(self, name):
+        # lineno, lexpos, ... of the file being lexed
+        return getattr(self.lexer, name)
+
+    def input(self, data):
+        raise TypeError("SourceLexer reads its input from the SourceManager")
+
+    def lineTableOf(self, fileid):
+        return self.lineTables[fileid]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t
+
+    def token(self):
+        while True:
+            if self.fileid >= 0:
+                tok = self.lexer.token()
+                if tok:
+                    tok.fileid = self.fileid
+                    return tok
+            src = next(self.pending, None)
+            if not src:
+                return None
+            self.fileid = src.fileid
+            self.lexer.lineno = 1
+            if self.inplace:
+                data = src.buffer
+                self.lineTables[src.fileid] = src.lineTable
+            else:
+                data = src.text()
+                self.lineTables[src.fileid] = LineTable(data, src.path)
+            self.lexer.input(data)
+            self.lexer.lineTable = self.lineTables[src.fileid]
@@ -0,0 +1,84 @@
+# cached ply tables shared by the lexers and parsers
+#
+# ply can write the lexer master regexes and the LALR automaton to python
+# modules and reload them on later runs.  The table modules are versioned by a
+# fingerprint of the rules that produced them, so a table module is only
+# rebuilt when the token rules or the grammar change.
+
+import glob
+import hashlib
+import importlib.util
+import os
+import sys
+
+import ply
+
+# default location of the generated table modules
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_tables")
+
+
+def rules_fingerprint(obj, prefix):
+    """Hash the ply rules (attributes named prefix*) of obj along with everything
+       else ply uses to build its tables.  Function rules are hashed in source order
+       because ply orders them that way."""
+    sha = hashlib.sha256()
+    sha.update(ply.__version__.encode())
+    for attr in ('tokens', 'literals', 'precedence', 'start'):
+        sha.update(repr(getattr(obj, attr, None)).encode())
+
+    funcs = []
+    strs = []
+    for name in dir(obj):
+        if not name.startswith(prefix):
+            continue
+        item = getattr(obj, name)
+        if callable(item):
+            code = item.__code__
+            funcs.append((code.co_firstlineno, name, item.__doc__))
+        else:
+            strs.append((name, item))
+    for rule in sorted(funcs):
+        sha.update(repr(rule[1:]).encode())
+    for rule in sorted(strs):
+        sha.update(repr(rule).encode())
+    return sha.hexdigest()[:16]
+
+
+def table_name(basename, fingerprint):
+    return f"{basename}_{fingerprint}"
+
+
+def load_table(name, tabdir=None):
+    """Load a previously generated table module from tabdir.  Returns None if it
+       does not exist yet."""
+    tabdir = tabdir or TABLE_DIR
+    module = sys.modules.get(name)
+    if module:
+        return module
+    path = os.path.join(tabdir, name + ".py")
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        return None     # a partially written or corrupt table, it will be rebuilt
+    sys.modules[name] = module
+    return module
+
+
+def prepare_dir(basename, keep, tabdir=None):
+    """Make sure tabdir exists and remove stale table versions of basename"""
+    tabdir = tabdir or TABLE_DIR
+    try:
+        os.makedirs(tabdir, exist_ok=True)
+    except OSError:
+        return tabdir   # ply warns and continues if it can't write the tables
+    for path in glob.glob(os.path.join(tabdir, basename + "_*.py")):
+        if os.path.splitext(os.path.basename(path))[0] != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return tabdir
@@ -0,0 +1,284 @@
+# parallel analysis of a vhdl design library
+#
+# Parses every file of a library in a pool of worker processes and merges the design
+# units into one LibraryView.  Run from the parse directory:
+#
+#   python vhanalyze.py <files or directories> [--workers N] [--chunk-bytes N] [--timing]
+#                       [--library name=directory ..] [--work name] [--no-std]
+
+import argparse
+import concurrent.futures
+import os
+import pickle
+import sys
+import time
+import traceback
+
+import ldiag
+from lcommon import symbol_key
+
+VHDL_EXTENSIONS = ('.vhd', '.vhdl')
+
+
+class FileResult():
+    """What a worker returns for one file: the design file pickled, the unit names,
+       the formatted diagnostics and the parse time.  The design file is only
+       unpickled when it is asked for."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.seconds = 0.0
+        self.unitNames = []
+        self.payload = None     # pickled vhDesignFile
+        self.messages = []      # formatted diagnostics
+        self.errors = 0         # number of error diagnostics
+        self.failure = None     # traceback of an exception raised by the parse
+        self.loaded = None
+
+    def __repr__(self):
+        return f"FileResult(path={self.path}, units={self.unitNames}, seconds={self.seconds:.3f})"
+
+    def designFile(self):
+        if self.loaded is None and self.payload is not None:
+            self.loaded = pickle.loads(self.payload)
+        return self.loaded
+
+
+class LibraryView():
+    """The design units of all the analyzed files, by (case folded) unit name"""
+
+    def __init__(self, results=()):
+        self.files = []
+        self.units = {}         # unit key -> FileResult
+        self.duplicates = {}    # unit key -> the paths of the other files that declare it
+        for result in results:
+            self.add(result)
+
+    def add(self, result):
+        self.files.append(result)
+        for name in result.unitNames:
+            key = symbol_key(name)
+            if key in self.units:
+                self.duplicates.setdefault(key, []).append(result.path)
+                continue
+            self.units[key] = result
+
+    def __len__(self):
+        return len(self.units)
+
+    def names(self):
+        return [ name for result in self.files for name in result.unitNames ]
+
+    def unit(self, name):
+        """The design unit named name, loading the file that declares it"""
+        result = self.units.get(symbol_key(name))
+        if result is None:
+            return None
+        key = symbol_key(name)
+        for unit in result.designFile().units:
+            if unit.sym.key == key:
+                return unit
+        return None
+
+    def messages(self):
+        for result in self.files:
+            yield from result.messages
+            if result.failure:
+                yield f"{result.path}: parse failed\n{result.failure}"
+
+
+def library_files(paths):
+    """The vhdl files in paths, directories are searched recursively"""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(VHDL_EXTENSIONS):
+                    files.append(os.path.join(root, name))
+    return files
+
+def chunk_files(files, chunkBytes):
+    """Group files into chunks of about chunkBytes of source each, largest chunks first.
+       A file larger than chunkBytes is a chunk of its own, so the large files are
+       spread over the workers instead of queued behind each other."""
+    sized = sorted(((os.path.getsize(path), path) for path in files), reverse=True)
+    chunks = []
+    current = []
+    currentSize = 0
+    for size, path in sized:
+        if size >= chunkBytes:
+            chunks.append((size, [ path ]))
+            continue
+        if current and currentSize + size > chunkBytes:
+            chunks.append((currentSize, current))
+            current = []
+            currentSize = 0
+        current.append(path)
+        currentSize += size
+    if current:
+        chunks.append((currentSize, current))
+    chunks.sort(key=lambda chunk: chunk[0], reverse=True)
+    return [ paths for size, paths in chunks ]
+
+
+# one parser per setup in each worker process, the LALR tables and the libraries are
+# loaded once
+workerParsers = {}
+
+def analyze_file(parser, path):
+    with open(path, 'rb') as src:
+        data = src.read()
+    result = FileResult(path, len(data))
+    start = time.perf_counter()
+    try:
+        ctx = parser.parse(data, path=path)
+    except Exception:
+        result.failure = traceback.format_exc()
+        result.seconds = time.perf_counter() - start
+        return result
+    result.seconds = time.perf_counter() - start
+    result.unitNames = [ str(unit.sym.name) for unit in ctx.designFile.units if unit ]
+    result.payload = pickle.dumps(ctx.designFile, protocol=pickle.HIGHEST_PROTOCOL)
+    result.messages = list(ctx.diag.formatted())
+    result.errors = ctx.diag.count(ldiag.ERROR)
+    return result
+
+def worker_parser(setup):
+    """The parser of a setup: (backend, std, mapping items, work library name).  It sees
+       the libraries of a LibraryManager of the mapping, std unless std is false, and
+       'work' is the library named by work if there is one."""
+    parser = workerParsers.get(setup)
+    if parser is None:
+        from vhlibrary import LibraryManager, WorkLibrary
+        from vhparse import VhdlParser
+        backend, std, mapping, work = setup
+        manager = LibraryManager(dict(mapping), backend=backend)
+        libraries = [ WorkLibrary(manager.library(work)) ] if work else []
+        libraries += [ library for library in manager if std or library.name != 'std' ]
+        parser = workerParsers[setup] = VhdlParser(backend=backend, libraries=libraries)
+    return parser
+
+def analyze_chunk(paths, setup):
+    parser = worker_parser(setup)
+    return [ analyze_file(parser, path) for path in paths ]
+
+def analyze_library(paths, workers=None, chunkBytes=256 * 1024, backend='scanner', std=True, mapping=None,
+                    work=None):
+    """Parse the vhdl files in paths (files or directories) in workers processes and
+       return a LibraryView.  workers=0 parses in this process.  The files see std (but
+       std itself, std=False) and the libraries of mapping (name -> directory), work
+       names the library the files use as work."""
+    chunks = chunk_files(library_files(paths), chunkBytes)
+    setup = (backend, bool(std), tuple(sorted((mapping or {}).items())), work)
+    results = []
+    if workers == 0:
+        for chunk in chunks:
+            results += analyze_chunk(chunk, setup)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [ pool.submit(analyze_chunk, chunk, setup) for chunk in chunks ]
+            for future in concurrent.futures.as_completed(futures):
+                results += future.result()
+    results.sort(key=lambda result: result.path)
+    return LibraryView(results)
+
+
+def report_timing(view, elapsed, file=None):
+    file = file or sys.stdout
+    print(f"{'seconds':>8} {'KB':>8} {'units':>5}  file", file=file)
+    for result in sorted(view.files, key=lambda result: result.seconds, reverse=True):
+        status = "  (failed)" if result.failure else ""
+        print(f"{result.seconds:8.3f} {result.size / 1024:8.1f} {len(result.unitNames):5}  {result.path}{status}",
+              file=file)
+    busy = sum(result.seconds for result in view.files)
+    # the parse times of workers sharing cpus add up to more than the wall time, their
+    # sum is no measure of a speedup
+    print(f"{len(view.files)} files, {len(view)} units, {busy:.2f} s of parsing in {elapsed:.2f} s", file=file)
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description="parse a vhdl library in parallel")
+    argp.add_argument("paths", nargs="+", help="vhdl files or directories")
+    argp.add_argument("--workers", type=int, default=None,
+                      help="worker processes, default the number of cpus, 0 parses in this process")
+    argp.add_argument("--chunk-bytes", type=int, default=256 * 1024,
+                      help="source bytes per worker task, larger files are a task of their own")
+    argp.add_argument("--backend", default="scanner")
+    argp.add_argument("--library", nargs="+", default=[], metavar="NAME=DIRECTORY",
+                      help="libraries the files can use, besides std")
+    argp.add_argument("--work", help="the library of the files, as named by --library")
+    argp.add_argument("--no-std", dest="std", action="store_false", help="the files are the std library")
+    argp.add_argument("--timing", action="store_true", help="report the parse time of each file")
+    argp.add_argument("--quiet", action="store_true", help="don't print the diagnostics")
+    args = argp.parse_args(argv)
+    mapping = dict(library.split('=', 1) for library in args.library)
+
+    start = time.perf_counter()
+    view = analyze_library(args.paths, args.workers, args.chunk_bytes, args.backend, args.std, mapping, args.work)
+    elapsed = time.perf_counter() - start
+    if not args.quiet:
+        for message in view.messages():
+            print(message)
+    for key, paths in sorted(view.duplicates.items()):
+        print(f"design unit '{key}' of {view.units[key].path} is also declared in {', '.join(paths)}")
+    if args.timing:
+        report_timing(view, elapsed)
+    else:
+        print(f"{len(view.files)} files, {len(view)} units in {elapsed:.2f} s")
+    return 1 if any(result.failure or result.errors for result in view.files) else 0
+
+
+# tests
+
+def same_results(view, serial):
+    # the units, diagnostics and decompiled design files of two views of the same files
+    def results(view):
+        return [ (result.path, result.unitNames, result.messages, str(result.designFile())) for result in view.files ]
+    return results(view) == results(serial)
+
+def analyze_test(paths=("../lib/vhdl/std",)):
+    """Analyze the std library with both backends, in this process and in 2 workers, the
+       files are read as bytes which the ply backend gets decoded.  Then analyze a vendor
+       library which uses std and work in 2 workers.  The workers must give the same
+       results as this process."""
+    import shutil
+    import tempfile
+    import vhlibrary
+    ok = True
+    units = None
+    for backend in ('ply', 'scanner'):
+        view = analyze_library(paths, workers=0, backend=backend, std=False)
+        parallel = analyze_library(paths, workers=2, backend=backend, std=False)
+        failed = [ result.path for result in view.files if result.failure or result.errors ]
+        names = [ result.unitNames for result in view.files ]
+        same = same_results(parallel, view)
+        print(f"{backend}: {len(view.files)} files, {len(view)} units, failed: {failed}, 2 workers the same: {same}")
+        ok = ok and view.files and not failed and names == (units or names) and same
+        units = names
+
+    libdir = tempfile.mkdtemp(suffix="vendor")
+    try:
+        vhlibrary.vendor_library(libdir, 4, 5)
+        mapping = { 'vendor': libdir }
+        view = analyze_library([ libdir ], workers=0, mapping=mapping, work='vendor')
+        parallel = analyze_library([ libdir ], workers=2, mapping=mapping, work='vendor')
+        messages = list(parallel.messages())
+        same = same_results(parallel, view)
+        print(f"vendor: {len(parallel.files)} files, {len(parallel)} units, diagnostics {messages[:3]}, "
+              f"2 workers the same: {same}")
+        ok = ok and len(parallel) == 20 and not messages and same
+    finally:
+        shutil.rmtree(libdir)
+        if os.path.exists(vhlibrary.index_path(libdir)):
+            os.remove(vhlibrary.index_path(libdir))
+    print(f"analyze: both backends analyze the library, workers with their libraries as in process: {ok}")
+    return ok
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    analyze_test()
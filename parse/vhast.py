@@ -2,49 +2,83 @@
 
 # Symbols begin life during parsing as simple name strings
 # The strings get converted to Symbols during semantic processing
+#
+# The classes have __slots__, a fixed layout without a __dict__ per node.  __init__
+# sets every slot, None for what isn't known yet, and subclasses only list the slots
+# they add.
 
 from abc import ABC
 from lcommon import *
 
-class vhDesignFile():
+def type_key(mark):
+    """The key of a type mark, a Symbol or the suffix of a selected name"""
+    while isinstance(mark, list) and mark:
+        mark = mark[-1]
+    return mark.key if isinstance(mark, Symbol) else name_key(str(mark))
+
+
+class vhDesignFile(Emitter):
+    __slots__ = ('filepath', 'scope', 'units', 'sources')
     def __init__(self, scope, filepath=""): # designUnits expects a list
         self.filepath = filepath
         self.scope = scope
         self.units = []
+        self.sources = None     # the SourceManager when the units come from several files
 
     def __str__(self):
         return self.decompile()
     
-    def decompile(self):
-        result = f"\n-- file: {self.filepath}\n\n"
+    def emit(self, out, indent=0):
+        if not self.sources:
+            out.write(f"\n-- file: {self.filepath}\n\n")
+            for unit in self.units:
+                unit.emit(out)
+                out.write("\n\n")
+            return
+
+        filepath = None
         for unit in self.units:
-            result += unit.decompile() + "\n\n"
-        return result
+            path = self.sourcePath(unit.sym.loc.fileid)
+            if path != filepath:
+                out.write(f"\n-- file: {path}\n\n")
+                filepath = path
+            unit.emit(out)
+            out.write("\n\n")
+
+    def write(self, path):
+        """Write the source text of the design file to path, a unit at a time"""
+        with open(path, 'w', encoding='utf-8') as out:
+            self.emit(out)
+
+    def sourcePath(self, fileid):
+        if self.sources and fileid >= 0:
+            return self.sources.path(fileid)
+        return None
 
     def __repr__(self):
         return self.dumpInternals()
     
     def dumpInternals(self):
-        result = f"vhDesignFile(filepath={self.filepath},\n "
-        result += "\tscope=" + self.scope.dumpInternals() + ", "
+        parts = [ f"vhDesignFile(filepath={self.filepath},\n ", "\tscope=", self.scope.dumpInternals(), ", units=" ]
         first = '[ '
-        result += "units="
         for unit in self.units:
-            result += first
+            parts += [ first, unit.dumpInternals(1) ]
             first = ", "
-            result += unit.dumpInternals(1)
-        result += " ])"
-        return result
+        parts.append(" ])")
+        return "".join(parts)
 
 # base class for primary and secondary units
-class vhDesignUnit(ABC):
+class vhDesignUnit(Emitter, ABC):
+    __slots__ = ('name', 'sym', 'context', 'scope')
     def __init__(self, name, outerScope, context=None):
         self.name = name
+        self.sym = None         # the name Symbol once the unit is parsed
         self.context = context
         self.scope = Scope(name, outerScope)
 
 
 class vhPackageDecl(vhDesignUnit):
+    __slots__ = ('decls',)
     def __init__(self, name, outerScope):
         super().__init__(name, outerScope)
         self.decls = []
@@ -55,29 +89,27 @@ class vhPackageDecl(vhDesignUnit):
     def __repr(self):
         return self.dumpInternals()
     
-    def decompile(self, indent=0):
-        result = ""
+    def emit(self, out, indent=0):
         if self.context:
-            result += str(self.context) + "\n\n"
-        result += f"package {str(self.name)} is\n"
+            self.context.emit(out)
+            out.write("\n\n")
+        out.write(f"package {str(self.name)} is\n")
         for decl in self.decls:
-            result += decl.decompile(indent+1)     # design units are always indent 0, these decls are always indent 1
-        result += f"end package {str(self.name)};\n\n"
-        return result
+            decl.emit(out, indent+1)     # design units are always indent 0, these decls are always indent 1
+        out.write(f"end package {str(self.name)};\n\n")
     
     def dumpInternals(self, indent=0):
-        result = "vhPackageDecl(sym=" + repr(self.sym)
-        result += ", context=" + repr(self.context)
-        result += ", scope=" + repr(self.scope)
+        parts = [ "vhPackageDecl(sym=", repr(self.sym), ", context=", repr(self.context), ", scope=", repr(self.scope) ]
         pfx = ", decls=[ "
         for decl in self.decls:
-            result += pfx + repr(decl)
+            parts += [ pfx, repr(decl) ]
             pfx = ", "
-        result += " ])"
-        return result
+        parts.append(" ])")
+        return "".join(parts)
 
 
-class vhContextClause():
+class vhContextClause(Emitter):
+    __slots__ = ('libs', 'uses', 'loc')
     def __init__(self):
         self.libs = {}
         self.uses = {}
@@ -89,13 +121,11 @@ class vhContextClause():
     def __repr__(self):
         return self.dumpInternals()
     
-    def decompile(self):
-        result = ""
+    def emit(self, out, indent=0):
         for lib in self.libs.values():
-            result += str(lib)
+            lib.emit(out)
         for use in self.uses.values():
-            result += str(use)
-        return result
+            use.emit(out)
     
     def dumpInternals(self):
         result = "vhContextClause(libs="
@@ -126,8 +156,10 @@ class vhContextClause():
         if not key in self.libs:
             self.libs[key] = lib
 
-class vhUse():
+class vhUse(Located, Emitter):
+    __slots__ = ('selected',)
     def __init__(self, selected):
+        super().__init__()          # the location of the use clause
         self.selected = selected    # for now a list of symbols
     
     def __str__(self):
@@ -136,7 +168,7 @@ class vhUse():
     def __repr__(self):
         return self.dumpInternals()
     
-    def decompile(self):
+    def decompile(self, indent=0):
         names = list(str(sym) for sym in self.selected[0])
         names.append(str(self.selected[1]))
         result = "USE " + '.'.join(names) + ";\n"
@@ -146,11 +178,24 @@ class vhUse():
         result = f"Use(selected={str(self.selected)})"
         return result
 
+    def names(self):
+        """The symbol keys of the selected name from the left: library, unit, item"""
+        names = []
+        parts = [ self.selected ]
+        while parts:
+            part = parts.pop()
+            if isinstance(part, list):
+                parts.extend(reversed(part))
+            else:
+                names.append(name_key(part))
+        return names
+
     def addToContext(self, context):
         context.addUse(self)
 
 
-class vhLibrary():
+class vhLibrary(Emitter):
+    __slots__ = ('logical', 'physical')
     def __init__(self, sym):
         self.logical = sym       # a symbol or 'ALL'
         self.physical = None     # a string, the path to the library folder
@@ -161,7 +206,7 @@ class vhLibrary():
     def __repr__(self):
         return self.dumpInternals()
     
-    def decompile(self):
+    def decompile(self, indent=0):
         result = f"LIBRARY {str(self.logical)};\n"
         return result
     
@@ -173,7 +218,8 @@ class vhLibrary():
         context.addLibrary(self)
 
 
-class vhExpr(ABC):
+class vhExpr(Emitter, ABC):
+    __slots__ = ()
     def __init__(self):
         pass
 
@@ -182,6 +228,7 @@ class vhExpr(ABC):
 
 
 class vhRange(vhExpr):
+    __slots__ = ('left', 'dir', 'right')
     def __init__(self, left, dir, right):
         self.left = left
         self.dir = dir
@@ -198,6 +245,7 @@ class vhRange(vhExpr):
 
 
 class vhUnconstrainedRange(vhExpr):
+    __slots__ = ('bounds_subtype',)
     def __init__(self, bounds_subtype):
         self.bounds_subtype = bounds_subtype
     
@@ -208,6 +256,7 @@ class vhUnconstrainedRange(vhExpr):
         return f"{str(self.bounds_subtype)} range <>"
 
 class vhUnaryExpr(vhExpr):
+    __slots__ = ('op', 'operand')
     def __init__(self, op, operand):
         self.op = op
         self.operand = operand
@@ -216,10 +265,13 @@ class vhUnaryExpr(vhExpr):
         return self.decompile()
     
     def decompile(self, indent=0):
+        if str(self.op).isalpha():
+            return f"{self.op} {self.operand}"     # ABS, NOT
         return f"{self.op}{self.operand}"
 
     
 class vhBinaryExpr(vhExpr):
+    __slots__ = ('operands', 'precedence_level')
     precedence = { 'AND' : 0, 'OR' : 0, 'NAND' : 0, 'NOR' : 0, 'XOR' : 0, 'XNOR' : 0,
                    '=' : 1, '/=' : 1, '<' : 1, '<=' : 1, '>' : 1, '>=' : 1,
                    'SLL' : 2, 'SRL' : 2, 'SLA' : 2, 'SRA' : 2, 'ROL' : 2, 'ROR' : 2,
@@ -232,7 +284,14 @@ class vhBinaryExpr(vhExpr):
         super().__init__()
         self.operands = [ left ]
         self.precedence_level = -1
-        assert not (op ^ right), "both op and right must be set or neither"
+        assert (op is None) == (right is None), "both op and right must be set or neither"
+        if op is not None:
+            self.addOperand(op, right)
+
+    @staticmethod
+    def level(op):
+        # the operators are keys as written, mod or MOD
+        return vhBinaryExpr.precedence.get(str(op).upper(), -1)
 
     def __str__(self):
         return self.decompile()
@@ -242,18 +301,19 @@ class vhBinaryExpr(vhExpr):
         for opn in self.operands[1:]:
             result += f" {opn[0]} {opn[1]}"
         result += ")"
-        return
+        return result
 
 
     def addOperand(self, op, operand):
         if self.precedence_level == -1:
-            self.precedence_level = vhBinaryExpr.precedence[op]
+            self.precedence_level = vhBinaryExpr.level(op)
         else:
-            assert self.precedence_level == vhBinaryExpr.precedence.get(op, -1), "Unexpected precedence level in vgBinaryExpr"
+            assert self.precedence_level == vhBinaryExpr.level(op), "Unexpected precedence level in vgBinaryExpr"
         self.operands.append( (op, operand) )
 
 
 class vhAbstractLiteral(vhExpr):
+    __slots__ = ('literal',)
     def __init__(self, lit):
         self.literal = lit
 
@@ -265,18 +325,41 @@ class vhAbstractLiteral(vhExpr):
 
 
 class vhPhysicalLiteral(vhAbstractLiteral):
+    __slots__ = ('unit',)
     def __init__(self, lit, unit):
         super().__init__(lit)
         self.unit = unit
 
+    def decompile(self, indent=0):
+        return f"{str(self.literal)} {str(self.unit)}"
+
+
+class vhBitStrLiteral(vhAbstractLiteral):
+    __slots__ = ()
+    # literal is the lexer's Literal, its value a BitVector
+
+
+class vhCharLiteral(vhExpr):
+    __slots__ = ('literal',)
+    def __init__(self, lit):
+        self.literal = lit
+
+    def __str__(self):
+        return self.decompile()
+
+    def decompile(self, indent=0):
+        return str(self.literal)
+
 
 class vhQualifiedExpr(vhExpr):
+    __slots__ = ('type', 'expr')
     def __init__(self, type, expr):
         self.type = type
         self.expr = expr
 
 
 class vhAttributeExpr(vhExpr):
+    __slots__ = ('pfx_name', 'pfx_sig', 'attr_name', 'arg')
     def __init__(self, pfx_name, pfx_sig, attr_name, arg=None):
         self.pfx_name = pfx_name
         self.pfx_sig = pfx_sig
@@ -301,11 +384,13 @@ class vhAttributeExpr(vhExpr):
 
 
 class vhAllocator(vhExpr):
+    __slots__ = ('subtype',)
     def __init__(self, subtype):
         self.subtype = subtype
 
 
 class vhSubtypeIndication(vhExpr):
+    __slots__ = ('type_mark', 'res_func', 'constraints')
     def __init__(self, type_mark, constraints=None, res_func=None):
         self.type_mark = type_mark
         self.res_func = res_func
@@ -324,19 +409,15 @@ class vhSubtypeIndication(vhExpr):
             return result
         
         if type(self.constraints) is list:  # index constraint
-            pfx = "("
-            for constraint in self.constraints:
-                result += pfx + str(constraint)
-                pfx = ", "
-            result += ")"
-            return result
+            return result + "(" + ", ".join(str(constraint) for constraint in self.constraints) + ")"
         
         if self.constraints.isRange():
             result += " range " + str(self.constraints)
         return result
 
 
-class vhDecl(ABC):
+class vhDecl(Emitter, ABC):
+    __slots__ = ('name',)
     def __init__(self, sym=None):
         self.name = sym
         if sym:
@@ -344,8 +425,7 @@ class vhDecl(ABC):
         
     def setName(self, sym):
         if self.name and sym != self.name:
-            msg = f"start and end names don't match ({self.name} at {self.name.loc.sline}) "
-            msg += f"and ({sym.name } at {sym.name.loc.sline})"
+            # start and end names don't match
             return False
         self.name = sym
         sym.ast = self
@@ -353,6 +433,7 @@ class vhDecl(ABC):
 
 
 class vhSubtypeDecl(vhDecl):
+    __slots__ = ('subtype',)
     def __init__(self, sym, subtype):
         super().__init__(sym)
         self.subtype = subtype
@@ -365,6 +446,7 @@ class vhSubtypeDecl(vhDecl):
 
 
 class vhConstrainedType(vhDecl):
+    __slots__ = ('range',)
     def __init__(self, sym=None, range=None):
         super().__init__(sym)
         self.range = range
@@ -392,6 +474,7 @@ class vhConstrainedType(vhDecl):
 
 
 class vhIncompleteType(vhDecl):
+    __slots__ = ()
     def __init__(self, sym):
         super().__init__(sym)
 
@@ -404,6 +487,7 @@ class vhIncompleteType(vhDecl):
 
 # base class for decls that have their own symbol set
 class vhScopeDecl(vhDecl):
+    __slots__ = ('scope',)
     def __init__(self, sym=None, scope=None):
         super().__init__(sym)
         self.scope = scope
@@ -411,29 +495,31 @@ class vhScopeDecl(vhDecl):
     def setScope(self, scope, override=False):
         assert override or not self.scope, "Scope is already set in vhScopeDecl"
         if override or not self.scope:
-            scope.outer = self.ifc_symbols
+            scope.setOuter(self.ifc_symbols)
             self.scope = scope
 
 
 class vhEnumType(vhScopeDecl):
+    __slots__ = ('literals',)
     def __init__(self, sym, outer):
         # EnumScope is specialized scope that is both a LocalScope (it does not search the outer scopes)
         # and that uses case        scope = 
         super().__init__(sym, Scope(sym, outer))
         # enumerants are visible at declaration scppe 
-        outer.public_subscopes.append(self.scope)
+        outer.addSubscopes([ self.scope ])
+        self.literals = None
 
     def __str__(self):
         return self.decompile()
 
-    def decompile(self, indent=0):
-        result = f"{indentPrefix(indent)}type {str(self.name)} is "
+    def emit(self, out, indent=0):
+        out.write(f"{indentPrefix(indent)}type {str(self.name)} is ")
         pfx = "( "
         for sym in self.scope.symbols.values():
-            result += pfx + str(sym)
+            out.write(pfx)
+            out.write(str(sym))
             pfx = ", "
-        result += " );\n"
-        return result
+        out.write(" );\n")
     
     def __repr__(self):
         return self.dumpInternals()
@@ -446,10 +532,15 @@ class vhEnumType(vhScopeDecl):
 
     def addLiterals(self, lits):
         self.literals = lits
+        # the value of an enumeration literal is its position
+        for pos, sym in enumerate(lits):
+            sym.value = pos
 
 
 class vhPhysicalUnit(vhDecl):
+    __slots__ = ('unit', 'multiplier', 'ref_unit')
     def __init__(self, unit, ref_unit=None, multiplier=1):
+        super().__init__()
         unit.ast = self
         self.unit = unit
         self.multiplier = multiplier
@@ -467,23 +558,23 @@ class vhPhysicalUnit(vhDecl):
 
 
 class vhPhysicalType(vhScopeDecl):
+    __slots__ = ('constraint', 'units')
     def __init__(self, outer, constraint=None, units=None):
         super().__init__(None, Scope(None, outer))
         # units are visible at declaration scope
-        outer.public_subscopes.append(self.scope)
+        outer.addSubscopes([ self.scope ])
         self.constraint = constraint
         self.units = units
 
     def __str__(self):
         return self.decompile()
     
-    def decompile(self, indent=0):
-        result = f"{indentPrefix(indent)}type {str(self.name)} is range {str(self.constraint)}\n"
-        result += f"{indentPrefix(indent+1)}units\n"
+    def emit(self, out, indent=0):
+        out.write(f"{indentPrefix(indent)}type {str(self.name)} is range {str(self.constraint)}\n")
+        out.write(f"{indentPrefix(indent+1)}units\n")
         for unit in self.units:
-            result += unit.decompile(indent+2)
-        result += f"{indentPrefix(indent+1)}end units {str(self.name)};\n"
-        return result
+            unit.emit(out, indent+2)
+        out.write(f"{indentPrefix(indent+1)}end units {str(self.name)};\n")
 
     def setName(self, sym):
         error = super().setName(sym)
@@ -497,6 +588,7 @@ class vhPhysicalType(vhScopeDecl):
 
 
 class vhArrayType(vhDecl):
+    __slots__ = ('ranges', 'elem_type')
     def __init__(self, ranges, elem_type):
         super().__init__()
         self.ranges = ranges
@@ -505,27 +597,42 @@ class vhArrayType(vhDecl):
     def __str__(self):
         return self.decompile()
     
-    def decompile(self, indent=0):
-        result = f"{indentPrefix(indent)}type {str(self.name)} is array ("
+    def emit(self, out, indent=0):
+        out.write(f"{indentPrefix(indent)}type {str(self.name)} is array (")
         for range in self.ranges:
-            result += range.decompile(indent)
-        result += f") of {str(self.elem_type)};\n"
-        return result
+            range.emit(out, indent)
+        out.write(f") of {str(self.elem_type)};\n")
 
 
 class vhRecordType(vhScopeDecl):
+    __slots__ = ('elements',)
     def __init__(self, sym, outer):
         super().__init__(sym, Scope(sym, outer))
         # do not add to outer.public_subscopes, fields are only visible in the context of a record object
+        self.elements = None
+
+    def __str__(self):
+        return self.decompile()
+
+    def emit(self, out, indent=0):
+        out.write(f"{indentPrefix(indent)}type {str(self.name)} is\n")
+        out.write(f"{indentPrefix(indent+1)}record\n")
+        for syms, subtype in self.elements:
+            out.write(indentPrefix(indent+2) + ", ".join(str(sym) for sym in syms))
+            out.write(" : " + str(subtype) + ";\n")
+        out.write(f"{indentPrefix(indent+1)}end record {str(self.name)};\n")
 
     def addElements(self, elements):
         self.elements = elements
 
 
 class vhProtectedType(vhScopeDecl):
+    __slots__ = ('decls', 'body')
     def __init__(self, sym, outer):
         super().__init__(sym, Scope(sym, outer))
         # do not add to outer.public_subscopes, protected subprograms and attributes are only visible in the context of a protected object
+        self.decls = None
+        self.body = None
 
     def addDecls(self, decls):
         self.decls = decls
@@ -535,6 +642,7 @@ class vhProtectedType(vhScopeDecl):
 
 
 class vhAttributeDecl(vhDecl):
+    __slots__ = ('type_mark',)
     def __init__(self, sym, type_mark):
         super().__init__(sym)
         self.type_mark = type_mark
@@ -547,6 +655,7 @@ class vhAttributeDecl(vhDecl):
 
 
 class vhAccessType(vhDecl):
+    __slots__ = ('subtype',)
     def __init__(self, subtype, sym=None):
         super().__init__(sym)
         self.subtype = subtype
@@ -559,18 +668,56 @@ class vhAccessType(vhDecl):
     
 
 class vhFileDecl(vhDecl):
+    __slots__ = ('subtype',)
     def __init__(self, subtype, sym=None):
         super().__init__(sym)
         self.subtype = subtype
 
     def __str__(self):
-        return self.decompie()
+        return self.decompile()
     
     def decompile(self, indent=0):
-        return f"{indentPrefix(index)}type {str(self.name)} is file of {str(self.subtype)};\n"
+        return f"{indentPrefix(indent)}type {str(self.name)} is file of {str(self.subtype)};\n"
+
+
+class vhObjectDecl(vhDecl):
+    __slots__ = ('syms', 'obj_class', 'subtype', 'default', 'kind', 'shared', 'open_info')
+    # constant, signal, variable and file declarations, of one or more names
+    def __init__(self, obj_class, syms, subtype, default=None, kind=None, shared=None, open_info=None):
+        super().__init__(syms[0])
+        self.syms = syms
+        for sym in syms:
+            sym.ast = self
+        self.obj_class = obj_class
+        self.subtype = subtype
+        self.default = default          # the initial value expression
+        self.kind = kind                # signal kind, REGISTER or BUS
+        self.shared = shared            # SHARED for shared variables
+        self.open_info = open_info      # file open information, [ file name expr, open kind expr ]
+
+    def __str__(self):
+        return self.decompile()
+
+    def emit(self, out, indent=0):
+        out.write(indentPrefix(indent))
+        if self.shared:
+            out.write(str(self.shared).lower() + " ")
+        out.write(str(self.obj_class).lower() + " ")
+        out.write(", ".join(str(sym) for sym in self.syms))
+        out.write(" : " + str(self.subtype))
+        if self.kind:
+            out.write(" " + str(self.kind).lower())
+        if self.open_info:
+            if self.open_info[1]:
+                out.write(" open " + str(self.open_info[1]))
+            out.write(" is " + str(self.open_info[0]))
+        if self.default:
+            out.write(" := " + str(self.default))
+        out.write(";\n")
 
 
 class vhIfcElem(vhDecl):
+    __slots__ = ('subtype', 'default', 'obj_class', 'mode', 'bus')
     def __init__(self, sym, subtype, default=None, obj_class='CONSTANT', mode='IN', bus=None):
         super().__init__(sym)
         self.subtype = subtype
@@ -598,6 +745,7 @@ class vhIfcElem(vhDecl):
         
 
 class vhSubprogram(vhScopeDecl):
+    __slots__ = ('ifc_symbols', 'ifc', 'body')
     def __init__(self, sym, outer):
         super().__init__(sym, SymbolTable(outer))
         self.ifc_symbols = self.scope
@@ -612,7 +760,32 @@ class vhSubprogram(vhScopeDecl):
     def setBody(self, body):
         self.body = body
 
+    def emitInterface(self, out):
+        if self.ifc:
+            pfx = '('
+            for formal in self.ifc:
+                out.write(pfx)
+                formal.emit(out)
+                pfx = '; '
+            out.write(")")
+
+    def emitBody(self, out, indent, kind):
+        if self.body:
+            out.write(f"\n{indentPrefix(indent)}begin\n")
+            for stmt in self.body:
+                stmt.emit(out, indent+1)
+            out.write(f"{indentPrefix(indent)}end {kind} {str(self.name)}")
+
+    def signature(self):
+        # the type keys of the parameters and of the result, what tells overloads apart
+        return tuple(type_key(elem.subtype.type_mark) for elem in self.ifc or ()), None
+
+    def required(self):
+        # the parameters a call must give, those without a default
+        return sum(1 for elem in self.ifc or () if elem.default is None)
+
 class vhFunction(vhSubprogram):
+    __slots__ = ('purity', 'return_type')
     def __init__(self, sym, outer, purity='PURE'):
         super().__init__(sym, outer)
         self.purity = purity
@@ -621,34 +794,117 @@ class vhFunction(vhSubprogram):
     def __str__(self):
         return self.decompile()
     
-    def decompile(self, indent=0):
-        result = indentPrefix(indent)
+    def emit(self, out, indent=0):
+        out.write(indentPrefix(indent))
         if self.purity == 'IMPURE':
-            result += "impure "
-        result += f"function {str(self.name)}"
-        if self.ifc:
-            pfx = '('
-            for formal in self.ifc:
-                result += pfx + str(formal)
-                pfx = '; '
-            result += ")"
-
-        result += " returns " + str(self.return_type)
-        if self.body:
-            result += f"\n{indentPrefix(indent)}begin\n"
-            for stmt in self.body:
-                result += stmt.decompile(indent+1)
-            result += f"{indentPrefix(indent)}end function {str(self.sym)}"
-        result += ";\n"
-        return result
+            out.write("impure ")
+        out.write(f"function {str(self.name)}")
+        self.emitInterface(out)
+        out.write(" returns " + str(self.return_type))
+        self.emitBody(out, indent, "function")
+        out.write(";\n")
 
     def setReturnType(self, rtype):
         self.return_type = rtype  # rtype is expected to be a symbol, can it be an anonymous subtype?
 
+    def signature(self):
+        params, result = super().signature()
+        return params, type_key(self.return_type) if self.return_type is not None else None
+
 
 class vhProcedure(vhSubprogram):
+    __slots__ = ()
     def __init__(self, sym, outer):
         super().__init__(sym, outer)
 
-    
+    def __str__(self):
+        return self.decompile()
 
+    def emit(self, out, indent=0):
+        out.write(indentPrefix(indent) + f"procedure {str(self.name)}")
+        self.emitInterface(out)
+        self.emitBody(out, indent, "procedure")
+        out.write(";\n")
+
+
+# benchmarks
+
+def ast_objects():
+    """The number of AST, Symbol, location and scope objects alive, by class name"""
+    import gc
+    import lcommon
+    modules = (lcommon.__name__, __name__)
+    counts = {}
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if cls.__module__ in modules and cls is not lcommon.Ident and not isinstance(obj, type):
+            counts[cls.__name__] = counts.get(cls.__name__, 0) + 1
+    return counts
+
+def memory_bench(size="2M", seed=1):
+    """Print the objects a parse of a corpus of size bytes keeps, the bytes they retain
+       and the time to pickle and unpickle the design file"""
+    # traced bytes rather than sys.getsizeof(), which can't see the attribute values an
+    # object without slots keeps inline until its __dict__ is asked for
+    import gc
+    import pickle
+    import time
+    import tracemalloc
+    import vhcorpus
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    data = vhcorpus.corpus_text(vhcorpus.parse_size(size), seed)
+    print(f"corpus of {len(data) / 1e6:.1f} MB")
+
+    gc.collect()
+    before = ast_objects()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    ctx = parser.parse(data)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    counts = { name: count - before.get(name, 0) for name, count in ast_objects().items() }
+    counts = sorted(((count, name) for name, count in counts.items() if count > 0), reverse=True)
+    nodes = sum(count for count, name in counts)
+
+    print(", ".join(f"{name} {count}" for count, name in counts))
+    print(f"{nodes} nodes, retained by the parse: {retained / 1e6:.1f} MB, {retained / nodes:.1f} bytes per node "
+          f"with the lists, dicts and identifiers they refer to")
+    start = time.perf_counter()
+    payload = pickle.dumps(ctx.designFile, protocol=pickle.HIGHEST_PROTOCOL)
+    dumped = time.perf_counter() - start
+    start = time.perf_counter()
+    pickle.loads(payload)
+    loaded = time.perf_counter() - start
+    print(f"pickled design file: {len(payload) / 1e6:.1f} MB, dump {dumped * 1000.0:.0f} ms, load {loaded * 1000.0:.0f} ms")
+    del ctx
+
+def emit_bench(size="4M", seed=1):
+    """Print the time and the traced peak memory to decompile a parsed corpus of size
+       bytes to a file, the text built in memory by str() against written by emit()"""
+    import gc
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+    import vhcorpus
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    data = vhcorpus.corpus_text(vhcorpus.parse_size(size), seed)
+    design = parser.parse(data).designFile
+    print(f"corpus of {len(data) / 1e6:.1f} MB")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "out.vhd")
+        def joined():
+            with open(path, 'w', encoding='utf-8') as out:
+                out.write(str(design))
+        for name, write in (("str()", joined), ("emit()", lambda: design.write(path))):
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            write()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name:8} {elapsed * 1000.0:8.0f} ms, peak {peak / 1e6:8.2f} MB, {os.path.getsize(path) / 1e6:.1f} MB written")
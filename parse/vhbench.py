@@ -0,0 +1,222 @@
+# vhdl front end benchmarks
+#
+# The scaling benchmark of the whole front end is here, the benchmark of each module is
+# next to its tests (vhlex.lex_bench, vhast.memory_bench, ..) and run from here.  Run
+# from the parse directory:
+#
+#   python vhbench.py <benchmark> [options]
+
+import argparse
+import glob
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import lcommon
+import vhast
+import vhcorpus
+import vhexport
+import vhfold
+import vhlex
+import vhlibcache
+import vhlibrary
+import vhparse
+import vhprofile
+import vhunits
+import vhvisit
+
+PARSE_DIR = os.path.dirname(os.path.abspath(__file__))
+STD_DIR = os.path.join(PARSE_DIR, "../lib/vhdl/std")
+
+
+def read_sources(paths):
+    data = ""
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as src:
+            data += src.read()
+    return data
+
+def std_sources():
+    return sorted(glob.glob(os.path.join(STD_DIR, "*.vhd")))
+
+
+# one corpus size in a fresh interpreter, so the peak rss is that of the size alone
+SCALING_SCRIPT = r'''
+import json, resource, sys, time
+from vhparse import VhdlParser
+parser = VhdlParser(backend={backend!r}, std=True)
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+result = {{}}
+t0 = time.perf_counter()
+with open({path!r}, 'r', encoding='utf-8') as src:
+    data = src.read()
+t1 = time.perf_counter()
+result['tokens'] = len(parser.lexer.tokenize(data))
+t2 = time.perf_counter()
+ctx = parser.parse(data)
+t3 = time.perf_counter()
+result['decompiled'] = len(str(ctx.designFile))
+t4 = time.perf_counter()
+result.update(read=t1 - t0, lex=t2 - t1, parse=t3 - t2, decompile=t4 - t3,
+              base=base * 1024, peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+print(json.dumps(result))
+'''
+
+SCALING_PHASES = ('lex', 'parse', 'decompile')
+
+def scaling_run(path, backend):
+    script = SCALING_SCRIPT.format(path=path, backend=backend)
+    out = subprocess.run([sys.executable, "-c", script], cwd=PARSE_DIR,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def scaling_exponent(sizes, times):
+    """The exponent k of time ~ size**k, a least squares fit of the logs, about 1 for
+       a linear phase"""
+    xs = [ math.log(size) for size in sizes ]
+    ys = [ math.log(max(elapsed, 1e-9)) for elapsed in times ]
+    mx, my = statistics.mean(xs), statistics.mean(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+
+def report_scaling(args):
+    workdir = tempfile.mkdtemp(prefix="vhcorpus")
+    try:
+        sizes, results = [], []
+        print(f"{'size':>8} {'tokens':>10} {'lex MB/s':>9} {'parse MB/s':>10} {'decomp MB/s':>11} "
+              f"{'parse s':>8} {'peak MB':>8} {'rss/source':>10}")
+        for size in [ vhcorpus.parse_size(size) for size in args.sizes ]:
+            path = os.path.join(workdir, f"corpus{size}.vhd")
+            vhcorpus.write_corpus(path, size, args.seed)
+            size = os.path.getsize(path)
+            result = scaling_run(path, args.backend)
+            os.remove(path)
+            sizes.append(size)
+            results.append(result)
+            mb = size / 1e6
+            growth = (result['peak'] - result['base']) / size
+            print(f"{size / 1024:7.0f}K {result['tokens']:10} {mb / result['lex']:9.2f} {mb / result['parse']:10.2f} "
+                  f"{mb / result['decompile']:11.2f} {result['parse']:8.2f} {result['peak'] / 1e6:8.1f} {growth:10.1f}")
+        if len(sizes) > 1:
+            for phase in SCALING_PHASES:
+                exponent = scaling_exponent(sizes, [ result[phase] for result in results ])
+                verdict = "super-linear" if exponent > args.threshold else "linear"
+                print(f"{phase:10} time ~ size^{exponent:.2f}  {verdict}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description="vhdl front end benchmarks")
+    sub = argp.add_subparsers(dest="bench", required=True)
+
+    cmd = sub.add_parser("coldstart", help="milliseconds from import to the first token")
+    cmd.add_argument("--runs", type=int, default=5)
+    cmd.add_argument("--fresh", action="store_true", help="start from an empty table directory")
+    cmd.set_defaults(func=lambda args: vhparse.cold_start_bench(args.runs, args.fresh))
+
+    cmd = sub.add_parser("lex", help="tokens per second for each lexer backend and for tokenize()")
+    cmd.add_argument("files", nargs="*", help="vhdl sources, default the std library")
+    cmd.add_argument("--repeat", type=int, default=200, help="concatenate the sources this many times")
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.add_argument("--backends", nargs="+", default=["ply", "scanner", "columns"])
+    cmd.set_defaults(func=lambda args: vhlex.lex_bench(read_sources(args.files or std_sources()) * args.repeat,
+                                                     args.backends, args.runs))
+
+    cmd = sub.add_parser("idents", help="identifier lookups per second and token value memory")
+    cmd.add_argument("--refs", type=int, default=1000000, help="number of identifier references")
+    cmd.add_argument("--names", type=int, default=5000, help="number of distinct identifiers")
+    cmd.add_argument("--backend", default="ply")
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.add_argument("--baseline", action="store_true", help="lex without interning, the values are plain strings")
+    cmd.set_defaults(func=lambda args: vhlex.idents_bench(args.refs, args.names, args.backend, args.runs,
+                                                        not args.baseline))
+
+    cmd = sub.add_parser("visibility", help="Scope.searchKey lookups per second, indexed and walking the scopes")
+    cmd.add_argument("--types", type=int, nargs="+", default=[ 10, 100, 1000 ], help="enum types made visible by a use clause")
+    cmd.add_argument("--literals", type=int, default=8, help="literals of each type")
+    cmd.add_argument("--repeat", type=int, default=5, help="lookups of each key per run")
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.set_defaults(func=lambda args: lcommon.visibility_bench(args.types, args.literals, args.repeat, args.runs))
+
+    cmd = sub.add_parser("diag", help="parse time with the different diagnostic sink modes")
+    cmd.add_argument("files", nargs="*", help="vhdl sources, default std/standard.vhd")
+    cmd.add_argument("--repeat", type=int, default=20, help="concatenate the sources this many times")
+    cmd.add_argument("--limit", type=int, default=10, help="per code limit for the limit mode")
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.set_defaults(func=lambda args: vhparse.diag_bench(
+        read_sources(args.files or [ os.path.join(STD_DIR, "standard.vhd") ]) * args.repeat, args.limit, args.runs))
+
+    cmd = sub.add_parser("std", help="analysis time with the std library parsed from source or cached")
+    cmd.add_argument("files", nargs="*", help="vhdl sources, default a small package")
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.set_defaults(func=lambda args: vhlibcache.std_bench(
+        read_sources(args.files) if args.files else vhlibcache.STD_USER_SOURCE, args.runs))
+
+    cmd = sub.add_parser("incremental", help="full parse against an incremental update after editing one unit")
+    cmd.add_argument("--packages", type=int, default=2500, help="number of packages in the file")
+    cmd.add_argument("--backend", default="scanner")
+    cmd.set_defaults(func=lambda args: vhunits.incremental_bench(args.packages, args.backend))
+
+    cmd = sub.add_parser("library", help="parsing a whole library against loading the used units from its index")
+    cmd.add_argument("--files", type=int, default=20, help="number of library files")
+    cmd.add_argument("--packages", type=int, default=100, help="packages per file")
+    cmd.set_defaults(func=lambda args: vhlibrary.library_bench(args.files, args.packages))
+
+    cmd = sub.add_parser("stream", help="time to the first unit and peak memory, full parse against streaming")
+    cmd.add_argument("--packages", type=int, default=5000, help="number of packages in the file")
+    cmd.add_argument("--window", type=int, default=1 << 16, help="streaming window in bytes")
+    cmd.add_argument("--backend", default="scanner")
+    cmd.set_defaults(func=lambda args: vhunits.stream_bench(args.packages, args.window, args.backend))
+
+    cmd = sub.add_parser("profile", help="parse time without and with a ParseProfile, and the profile")
+    cmd.add_argument("--packages", type=int, default=500, help="number of packages in the file")
+    cmd.add_argument("--backend", default="scanner")
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.add_argument("--top", type=int, default=10, help="print this many productions and token types")
+    cmd.set_defaults(func=lambda args: vhprofile.profile_bench(args.packages, args.backend, args.runs, args.top))
+
+    cmd = sub.add_parser("scaling", help="lex, parse and decompile throughput and peak rss over corpus sizes")
+    cmd.add_argument("--sizes", nargs="+", default=["64K", "256K", "1M", "4M"],
+                     help="corpus sizes, with an optional K, M or G suffix (up to 1G)")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.add_argument("--backend", default="scanner")
+    cmd.add_argument("--threshold", type=float, default=1.15,
+                     help="a phase whose fitted exponent is above this is reported as super-linear")
+    cmd.set_defaults(func=report_scaling)
+
+    cmd = sub.add_parser("memory", help="bytes per AST node, Symbol, location and scope of a parsed corpus")
+    cmd.add_argument("--size", default="2M", help="corpus size, with an optional K, M or G suffix")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.set_defaults(func=lambda args: vhast.memory_bench(args.size, args.seed))
+
+    cmd = sub.add_parser("emit", help="decompiling a parsed corpus to a file, with str() and with emit()")
+    cmd.add_argument("--size", default="4M", help="corpus size, with an optional K, M or G suffix")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.set_defaults(func=lambda args: vhast.emit_bench(args.size, args.seed))
+
+    cmd = sub.add_parser("export", help="the columnar export of a parsed corpus against a pickle")
+    cmd.add_argument("--size", default="4M", help="corpus bytes, with an optional K, M or G suffix")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.set_defaults(func=lambda args: vhexport.export_bench(args.size, args.seed))
+
+    cmd = sub.add_parser("visit", help="walking a parsed corpus with a Visitor against a recursive walk")
+    cmd.add_argument("--size", default="4M", help="corpus bytes, with an optional K, M or G suffix")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.add_argument("--runs", type=int, default=3)
+    cmd.set_defaults(func=lambda args: vhvisit.visit_bench(args.size, args.seed, args.runs))
+
+    cmd = sub.add_parser("fold", help="folding the constants of a parsed corpus, then again memoized")
+    cmd.add_argument("--size", default="4M", help="corpus bytes, with an optional K, M or G suffix")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.set_defaults(func=lambda args: vhfold.fold_bench(args.size, args.seed))
+
+    args = argp.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# synthetic vhdl corpus
+#
+# Generates packages of random declarations, from a seed, up to a size: enum, integer,
+# physical, array, record and access types, subtypes, constants with literal and binary
+# expressions, and function and procedure declarations.  The same seed always gives the
+# same packages, a smaller size is a prefix of a larger one.  Run from the parse
+# directory:
+#
+#   python vhcorpus.py <output file> [--size 10M] [--seed 1] [--without record binary ..]
+
+import argparse
+import random
+import sys
+
+# the declarations the generator can produce, with their weight among the declarations
+DECLARATIONS = { 'enum': 3, 'integer': 2, 'physical': 1, 'array': 2, 'record': 2, 'access': 1,
+                 'subtype': 2, 'constant': 6, 'function': 3, 'procedure': 2 }
+# the constructs of the constant expressions besides literals, names and 'HIGH.  The
+# expressions avoid what the parser doesn't handle: a parenthesized name, attributes
+# other than 'HIGH (only HIGH is a name it finds).
+EXPRESSIONS = ('binary',)
+CONSTRUCTS = tuple(DECLARATIONS) + EXPRESSIONS
+
+SIZE_SUFFIXES = { 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30 }
+
+# the std types the declarations use besides their own
+STD_TYPES = ('INTEGER', 'NATURAL', 'BOOLEAN', 'BIT', 'CHARACTER', 'REAL', 'TIME')
+BINARY_OPERATORS = ('+', '-', '*', 'mod', 'rem')
+
+
+def parse_size(text):
+    """Bytes of a size like 4096, 64K, 10M or 1G"""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+class CorpusGenerator():
+    """Generates the packages of a corpus one at a time, each declaration refers only to
+       the std library and to the declarations before it in its package"""
+
+    def __init__(self, seed=1, constructs=CONSTRUCTS):
+        self.random = random.Random(seed)
+        self.constructs = [ name for name in constructs if name in DECLARATIONS ]
+        self.weights = [ DECLARATIONS[name] for name in self.constructs ]
+        self.binary = 'binary' in constructs
+        self.npackages = 0
+
+    def __iter__(self):
+        while True:
+            yield self.package()
+
+    def package(self):
+        index = self.npackages
+        self.npackages += 1
+        # the types declared so far in the package by kind, and the constants by type
+        self.types = { 'integer': [ 'INTEGER', 'NATURAL' ], 'enum': [ 'BOOLEAN', 'BIT', 'CHARACTER' ],
+                       'physical': [ 'TIME' ], 'other': [ 'REAL' ] }
+        self.units = { 'TIME': [ 'fs', 'ps', 'ns', 'us', 'ms' ] }
+        self.constants = {}
+        self.prefix = f"{index}_"
+        lines = [ f"-- generated package {index}", f"package gen{index} is" ]
+        for ii in range(self.random.randint(4, 12)):
+            construct = self.random.choices(self.constructs, self.weights)[0]
+            lines.append("    " + getattr(self, construct)(f"{self.prefix}{ii}"))
+        lines.append(f"end package gen{index};\n\n")
+        return "\n".join(lines)
+
+    def anyType(self):
+        kind = self.random.choice(list(self.types))
+        return self.random.choice(self.types[kind])
+
+    def enum(self, name):
+        literals = ", ".join(f"S{name}_{ii}" for ii in range(self.random.randint(2, 8)))
+        self.types['enum'].append(f"state{name}")
+        return f"type state{name} is ({literals});"
+
+    def integer(self, name):
+        high = self.random.choice((1, 7, 255, 65535, 1000000))
+        self.types['integer'].append(f"int{name}")
+        if self.random.random() < 0.3:
+            return f"type int{name} is range {high} downto 0;"
+        return f"type int{name} is range 0 to {high};"
+
+    def physical(self, name):
+        units = [ f"u{name}_{ii}" for ii in range(self.random.randint(1, 4)) ]
+        secondary = "".join(f" {unit} = 1000 {units[ii]};" for ii, unit in enumerate(units[1:]))
+        self.types['physical'].append(f"phys{name}")
+        self.units[f"phys{name}"] = units
+        return f"type phys{name} is range 0 to 1000000000 units {units[0]};{secondary} end units;"
+
+    def array(self, name):
+        element = self.anyType()
+        self.types['other'].append(f"arr{name}")
+        return f"type arr{name} is array (NATURAL range <>) of {element};"
+
+    def record(self, name):
+        fields = " ".join(f"f{ii} : {self.anyType()};" for ii in range(self.random.randint(1, 5)))
+        self.types['other'].append(f"rec{name}")
+        return f"type rec{name} is record {fields} end record;"
+
+    def access(self, name):
+        target = self.anyType()
+        return f"type acc{name} is access {target};"
+
+    def subtype(self, name):
+        base = self.random.choice(self.types['integer'])
+        self.types['integer'].append(f"sub{name}")
+        return f"subtype sub{name} is {base} range 0 to {self.random.randint(1, 100)};"
+
+    def constant(self, name):
+        kind = self.random.choice(('integer', 'integer', 'enum', 'physical', 'other'))
+        typename = self.random.choice(self.types[kind])
+        if typename in self.types['other'] and typename != 'REAL':
+            typename = 'REAL'       # arrays and records have no literal
+        value = self.expr(kind if typename != 'REAL' else 'real', typename, 2)
+        self.constants.setdefault(typename, []).append(f"C{name}")
+        return f"constant C{name} : {typename} := {value};"
+
+    def expr(self, kind, typename, depth):
+        rnd = self.random
+        earlier = self.constants.get(typename)
+        if earlier and rnd.random() < 0.3:
+            return rnd.choice(earlier)
+        if kind == 'integer':
+            if depth and self.binary and rnd.random() < 0.4:
+                return f"{self.expr(kind, typename, depth - 1)} {rnd.choice(BINARY_OPERATORS)} {self.expr(kind, typename, depth - 1)}"
+            literal = rnd.choice((str(rnd.randint(0, 1)), "16#1#", "2#1#"))
+            if depth and rnd.random() < 0.15:
+                return f"({literal})"
+            return rnd.choice((literal, literal, f"{typename}'HIGH"))
+        if kind == 'enum':
+            return f"{typename}'HIGH"
+        if kind == 'physical':
+            return f"{rnd.randint(1, 999)} {rnd.choice(self.units[typename])}"
+        return rnd.choice(("1.5", "0.25", "1.0e3", "REAL'HIGH"))
+
+    def parameters(self, modes, least=0):
+        params = [ f"x{ii} : {self.random.choice(modes)}{self.anyType()}" for ii in range(self.random.randint(least, 3)) ]
+        return f"({'; '.join(params)})" if params else ""
+
+    def function(self, name):
+        return f"function f{name}{self.parameters(('',))} return {self.anyType()};"
+
+    def procedure(self, name):
+        return f"procedure p{name}{self.parameters(('in ', 'out ', 'inout '))};"
+
+
+def generate(size, seed=1, constructs=CONSTRUCTS):
+    """Yields the text of whole packages until size characters have been produced"""
+    produced = 0
+    for text in CorpusGenerator(seed, constructs):
+        yield text
+        produced += len(text)
+        if produced >= size:
+            return
+
+def corpus_text(size, seed=1, constructs=CONSTRUCTS):
+    return "".join(generate(size, seed, constructs))
+
+def write_corpus(path, size, seed=1, constructs=CONSTRUCTS):
+    """Write a corpus of size bytes to path, a package at a time.  Returns the number of
+       packages."""
+    npackages = 0
+    with open(path, 'w', encoding='utf-8') as dst:
+        for text in generate(size, seed, constructs):
+            dst.write(text)
+            npackages += 1
+    return npackages
+
+
+# tests
+
+def corpus_test(seeds=(1, 2, 3), size=32 * 1024):
+    """Parse and decompile corpora of several seeds with both backends and check that
+       they parse with no diagnostics, and that a seed always gives the same packages"""
+    from vhparse import VhdlParser
+    ok = True
+    for backend in ('ply', 'scanner'):
+        parser = VhdlParser(backend=backend, std=True)
+        for seed in seeds:
+            text = corpus_text(size, seed)
+            ctx = parser.parse(text, path=f"corpus{seed}.vhd")
+            unexpected = [ ctx.diag.format(record) for record in ctx.diag ]
+            units = len([ unit for unit in ctx.designFile.units if unit ])
+            str(ctx.designFile)
+            if unexpected or units != text.count("\npackage gen"):
+                print(f"{backend} seed {seed}: {units} units, {unexpected[:3]}")
+                ok = False
+    stable = corpus_text(size, 1) == corpus_text(size, 1) and corpus_text(4 * size, 1).startswith(corpus_text(size, 1))
+    print(f"corpus: seeds {list(seeds)} parse and decompile without diagnostics: {ok}, reproducible: {stable}")
+    return ok and stable
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description="generate a synthetic vhdl corpus")
+    argp.add_argument("path", help="the vhdl file to write")
+    argp.add_argument("--size", default="1M", help="bytes to generate, with an optional K, M or G suffix")
+    argp.add_argument("--seed", type=int, default=1)
+    argp.add_argument("--without", nargs="+", default=[], choices=CONSTRUCTS,
+                      help="constructs not to generate")
+    args = argp.parse_args(argv)
+    constructs = tuple(name for name in CONSTRUCTS if name not in args.without)
+    npackages = write_corpus(args.path, parse_size(args.size), args.seed, constructs)
+    print(f"{args.path}: {npackages} packages")
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    corpus_test()
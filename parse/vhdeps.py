@@ -0,0 +1,385 @@
+# design unit dependencies
+#
+# The use clauses in the context clause of a design unit name the units it depends on.
+# A DependencyGraph collects them, finds the dependency cycles, orders the units into
+# analysis waves, and is exported for build systems, which rebuild the transitive
+# dependents of a changed unit.  schedule() analyzes the units of each wave concurrently.
+# Run from the parse directory:
+#
+#   python vhdeps.py <files or directories> [--library NAME] [--json FILE] [--dot FILE] [--changed UNIT ..]
+
+import argparse
+import concurrent.futures
+import json
+import sys
+from collections import namedtuple
+
+import vhdiag
+from ldiag import DiagnosticSink
+from lcommon import name_key
+
+# a use clause of the unit source naming the unit target, loc is the location of the use clause
+Dependency = namedtuple('Dependency', 'source target loc')
+
+
+def unit_key(library, name):
+    return f"{name_key(library)}.{name_key(name)}"
+
+def location(loc):
+    """(path, line) of a location, the path is None if the source wasn't a file"""
+    if loc is None:
+        return None, -1
+    lines = getattr(loc, 'lineTable', None)
+    return (lines.path if lines is not None else None), loc.sline
+
+
+class DependencyGraph():
+    """The design units and the units their use clauses name, keyed 'library.unit'
+       (case folded).  A use clause naming a unit that isn't in the graph, from another
+       library or not analyzed, is an external dependency and doesn't order anything."""
+
+    def __init__(self):
+        self.units = {}     # key -> design unit
+        self.uses = {}      # key -> [ Dependency ], one per target
+
+    def __len__(self):
+        return len(self.units)
+
+    def add(self, unit, library='work'):
+        """Add a design unit of library, 'work' in its use clauses is library"""
+        key = unit_key(library, unit.sym.name)
+        self.units[key] = unit
+        deps = {}
+        uses = unit.context.uses.values() if unit.context else ()
+        for use in uses:
+            names = use.names()
+            if len(names) < 2 or names[1] == 'all':
+                continue        # use lib.all names no single unit
+            lib = name_key(library) if names[0] == 'work' else names[0]
+            target = f"{lib}.{names[1]}"
+            if target not in deps:
+                deps[target] = Dependency(key, target, use.loc)
+        self.uses[key] = list(deps.values())
+        return key
+
+    def dependencies(self, key):
+        """The keys of the units in the graph that key uses"""
+        return [ dep.target for dep in self.uses.get(key, ()) if dep.target in self.units ]
+
+    def external(self):
+        return sorted({ dep.target for deps in self.uses.values() for dep in deps if dep.target not in self.units })
+
+    def dependents(self):
+        """key -> the keys of the units that use it"""
+        usedBy = { key: [] for key in self.units }
+        for key in self.units:
+            for target in self.dependencies(key):
+                usedBy[target].append(key)
+        return usedBy
+
+    def affected(self, keys):
+        """The units to redo when the units keys change: keys and their transitive
+           dependents, in analysis order"""
+        usedBy = self.dependents()
+        found = set()
+        todo = [ key for key in keys if key in self.units ]
+        while todo:
+            key = todo.pop()
+            if key in found:
+                continue
+            found.add(key)
+            todo.extend(usedBy[key])
+        waves, blocked = self.waves()
+        return [ key for wave in waves for key in wave if key in found ] + sorted(found & blocked)
+
+    def cycles(self):
+        """The dependency cycles, each a list of the Dependency that make it up.  One
+           cycle is reported for each strongly connected set of units."""
+        cycles = []
+        for component in self.cyclic():
+            members = set(component)
+            start = min(component)
+            # the shortest way around from start, breadth first within the component
+            via = { start: None }
+            queue = [ start ]
+            closing = None
+            while queue and closing is None:
+                key = queue.pop(0)
+                for dep in self.uses[key]:
+                    if dep.target == start:
+                        closing = dep
+                        break
+                    if dep.target in members and dep.target not in via:
+                        via[dep.target] = dep
+                        queue.append(dep.target)
+            cycle = [ closing ]
+            while cycle[0].source != start:
+                cycle.insert(0, via[cycle[0].source])
+            cycles.append(cycle)
+        return cycles
+
+    def cyclic(self):
+        """The strongly connected components that have a cycle"""
+        return [ component for component in self.components()
+                 if len(component) > 1 or component[0] in self.dependencies(component[0]) ]
+
+    def components(self):
+        """The strongly connected components (Tarjan's algorithm, without recursion)"""
+        index = {}
+        low = {}
+        stack = []
+        onStack = set()
+        components = []
+        for root in sorted(self.units):
+            if root in index:
+                continue
+            work = [ (root, iter(self.dependencies(root))) ]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            onStack.add(root)
+            while work:
+                key, targets = work[-1]
+                target = next(targets, None)
+                if target is not None:
+                    if target not in index:
+                        index[target] = low[target] = len(index)
+                        stack.append(target)
+                        onStack.add(target)
+                        work.append((target, iter(self.dependencies(target))))
+                    elif target in onStack:
+                        low[key] = min(low[key], index[target])
+                    continue
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[key])
+                if low[key] == index[key]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onStack.discard(member)
+                        component.append(member)
+                        if member == key:
+                            break
+                    components.append(sorted(component))
+        return components
+
+    def waves(self):
+        """(waves, blocked): waves is a list of lists of unit keys, the units of a wave
+           only use units of earlier waves.  blocked are the units in a cycle or using
+           one, they are in no wave."""
+        blocked = set()
+        for component in self.cyclic():
+            blocked.update(component)
+        usedBy = self.dependents()
+        todo = list(blocked)
+        while todo:
+            for user in usedBy[todo.pop()]:
+                if user not in blocked:
+                    blocked.add(user)
+                    todo.append(user)
+
+        waiting = { key: len(set(self.dependencies(key))) for key in self.units if key not in blocked }
+        wave = sorted(key for key, count in waiting.items() if count == 0)
+        waves = []
+        while wave:
+            waves.append(wave)
+            following = []
+            for key in wave:
+                for user in set(usedBy[key]):
+                    if user in waiting:
+                        waiting[user] -= 1
+                        if waiting[user] == 0:
+                            following.append(user)
+            wave = sorted(following)
+        return waves, blocked
+
+    def reportCycles(self, diag):
+        """Report every use clause of each cycle to a DiagnosticSink, returns the cycles"""
+        cycles = self.cycles()
+        for cycle in cycles:
+            path = " -> ".join([ dep.source for dep in cycle ] + [ cycle[0].source ])
+            for dep in cycle:
+                loc = dep.loc
+                diag.report(vhdiag.DEPENDENCY_CYCLE, loc.spos if loc else -1,
+                            getattr(loc, 'lineTable', None), dep.source, path)
+        return cycles
+
+    def export(self):
+        """The graph as a dict for json: the units with where they are declared, what
+           they use and what uses them, the external units, the waves and the cycles"""
+        usedBy = self.dependents()
+        waves, blocked = self.waves()
+        units = {}
+        for key, unit in sorted(self.units.items()):
+            path, line = location(unit.sym.loc)
+            units[key] = { 'path': path, 'line': line, 'uses': sorted(set(self.dependencies(key))),
+                           'external': sorted(dep.target for dep in self.uses[key] if dep.target not in self.units),
+                           'usedBy': sorted(usedBy[key]) }
+        cycles = []
+        for cycle in self.cycles():
+            cycles.append([ dict(zip(('source', 'target', 'path', 'line'), (dep.source, dep.target) + location(dep.loc)))
+                            for dep in cycle ])
+        return { 'units': units, 'external': self.external(), 'waves': waves,
+                 'blocked': sorted(blocked), 'cycles': cycles }
+
+    def dot(self):
+        """The graph in graphviz dot, an edge from each unit to the units it uses"""
+        lines = [ "digraph dependencies {" ]
+        for key in sorted(self.units):
+            lines.append(f'    "{key}";')
+            for target in sorted(set(self.dependencies(key))):
+                lines.append(f'    "{key}" -> "{target}";')
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+
+class Schedule():
+    """What schedule() did: the analysis result of each unit, the exception of the units
+       whose analysis failed, and why the other units were skipped"""
+
+    def __init__(self, waves):
+        self.waves = waves
+        self.results = {}   # key -> what analyze returned
+        self.failed = {}    # key -> exception
+        self.skipped = {}   # key -> reason
+
+    def __repr__(self):
+        return (f"Schedule(waves={len(self.waves)}, analyzed={len(self.results)}, "
+                f"failed={sorted(self.failed)}, skipped={sorted(self.skipped)})")
+
+def schedule(graph, analyze, executor=None):
+    """Call analyze(key, unit) for the units of the graph, wave by wave.  The units of a
+       wave run concurrently on executor (a concurrent.futures.Executor, a thread pool if
+       None), a wave starts when the one before it is done.  Units in a cycle, and the
+       units using a unit whose analysis failed, are skipped."""
+    waves, blocked = graph.waves()
+    outcome = Schedule(waves)
+    for key in blocked:
+        outcome.skipped[key] = "in or using a dependency cycle"
+    pool = executor or concurrent.futures.ThreadPoolExecutor()
+    try:
+        for wave in waves:
+            futures = {}
+            for key in wave:
+                failed = [ dep for dep in graph.dependencies(key) if dep in outcome.failed or dep in outcome.skipped ]
+                if failed:
+                    outcome.skipped[key] = f"uses {', '.join(failed)}"
+                    continue
+                futures[pool.submit(analyze, key, graph.units[key])] = key
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                try:
+                    outcome.results[key] = future.result()
+                except Exception as exc:
+                    outcome.failed[key] = exc
+    finally:
+        if executor is None:
+            pool.shutdown()
+    return outcome
+
+
+def library_graph(view, library='work'):
+    """The DependencyGraph of the units of a vhanalyze.LibraryView"""
+    graph = DependencyGraph()
+    for result in view.files:
+        designFile = result.designFile()
+        for unit in (designFile.units if designFile else ()):
+            if unit:
+                graph.add(unit, library)
+    return graph
+
+def main(argv=None):
+    import vhanalyze
+    argp = argparse.ArgumentParser(description="design unit dependencies of a vhdl library")
+    argp.add_argument("paths", nargs="+", help="vhdl files or directories")
+    argp.add_argument("--library", default="work", help="logical name of the library")
+    argp.add_argument("--workers", type=int, default=None, help="parse worker processes, 0 parses in this process")
+    argp.add_argument("--json", help="write the graph to this file as json")
+    argp.add_argument("--dot", help="write the graph to this file in graphviz dot")
+    argp.add_argument("--changed", nargs="+", default=[],
+                      help="print the units to reanalyze when these units change")
+    args = argp.parse_args(argv)
+
+    graph = library_graph(vhanalyze.analyze_library(args.paths, args.workers), args.library)
+    diag = DiagnosticSink(vhdiag.vh_messages)
+    cycles = graph.reportCycles(diag)
+    diag.dump()
+    waves, blocked = graph.waves()
+    for ii, wave in enumerate(waves):
+        print(f"wave {ii}: {' '.join(wave)}")
+    if blocked:
+        print(f"blocked: {' '.join(sorted(blocked))}")
+    if args.changed:
+        changed = [ name if '.' in name else unit_key(args.library, name) for name in args.changed ]
+        print(f"affected: {' '.join(graph.affected(changed))}")
+    if args.json:
+        with open(args.json, 'w') as dst:
+            json.dump(graph.export(), dst, indent=2)
+    if args.dot:
+        with open(args.dot, 'w') as dst:
+            dst.write(graph.dot())
+    return 1 if cycles else 0
+
+
+# tests
+
+DEPS_SOURCE = """
+package a is constant CA : INTEGER := 1; end package a;
+use work.a.all;
+package b is constant CB : INTEGER := 2; end package b;
+use work.a.CA;
+package c is constant CC : INTEGER := 3; end package c;
+library ieee;
+use work.b.all, work.c.all, ieee.std_logic_1164.all;
+package d is constant CD : INTEGER := 4; end package d;
+use work.d.all;
+package e is constant CE : INTEGER := 5; end package e;
+use work.g.all;
+package f is constant CF : INTEGER := 6; end package f;
+use work.f.all;
+package g is constant CG : INTEGER := 7; end package g;
+use work.g.all, work.a.all;
+package h is constant CH : INTEGER := 8; end package h;
+"""
+
+def deps_test():
+    """The waves, cycles and affected units of DEPS_SOURCE, and a schedule that runs
+       every unit after the units it uses"""
+    import threading
+    import time
+    from vhparse import VhdlParser
+    ctx = VhdlParser(std=True).parse(DEPS_SOURCE, path="deps.vhd")
+    graph = DependencyGraph()
+    for unit in ctx.designFile.units:
+        graph.add(unit)
+    waves, blocked = graph.waves()
+    diag = DiagnosticSink(vhdiag.vh_messages)
+    cycles = graph.reportCycles(diag)
+    diag.dump()
+    print(f"waves: {waves}, blocked: {sorted(blocked)}")
+    print(f"affected by work.a: {graph.affected(['work.a'])}")
+    ok = (waves == [ ['work.a'], ['work.b', 'work.c'], ['work.d'], ['work.e'] ]
+          and blocked == { 'work.f', 'work.g', 'work.h' } and len(cycles) == 1
+          and graph.affected([ 'work.a' ]) == [ 'work.a', 'work.b', 'work.c', 'work.d', 'work.e', 'work.h' ]
+          and graph.external() == [ 'ieee.std_logic_1164' ]
+          and [ line for path, line in (location(dep.loc) for dep in cycles[0]) ] == [ 12, 14 ])
+
+    lock = threading.Lock()
+    done = set()
+    late = []
+    def analyze(key, unit):
+        with lock:
+            late.extend(dep for dep in graph.dependencies(key) if dep not in done)
+        time.sleep(0.01)
+        with lock:
+            done.add(key)
+        return str(unit.sym.name)
+    outcome = schedule(graph, analyze)
+    print(outcome)
+    json.dumps(graph.export())
+    return ok and not late and len(outcome.results) == 5 and len(outcome.skipped) == 3
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    deps_test()
@@ -0,0 +1,27 @@
+# vhdl diagnostic messages
+#
+# code: (severity, message) for ldiag.DiagnosticSink.  {0}, {1}, .. are the report
+# arguments, {line} and {col} the position of the report offset.
+
+from ldiag import WARNING, ERROR
+
+ILLEGAL_CHAR = 'illegal-char'
+SYMBOL_EXISTS = 'symbol-exists'
+SYMBOL_NOT_FOUND = 'symbol-not-found'
+SYMBOL_AMBIGUOUS = 'symbol-ambiguous'
+SYNTAX_ERROR = 'syntax-error'
+SYNTAX_ERROR_EOF = 'syntax-error-eof'
+DEPENDENCY_CYCLE = 'dependency-cycle'
+UNIT_NOT_FOUND = 'unit-not-found'
+
+vh_messages = {
+    ILLEGAL_CHAR:       (ERROR, "Illegal character '{0}'"),
+    SYMBOL_EXISTS:      (WARNING, "Symbol '{0}' already exists in {1}, continuing.."),
+    SYMBOL_NOT_FOUND:   (WARNING, "Symbol '{0}' at line {line}(column {col}) not found, creating and continuing.. "),
+    SYMBOL_AMBIGUOUS:   (WARNING, "Ambiguous Symbol '{0}' at line {line}(column {col}), "
+                                  "using the Symbol from the nearest scope.  This will error during semantic analysis."),
+    SYNTAX_ERROR:       (ERROR, "there was an error with '{0}' at {line}"),
+    SYNTAX_ERROR_EOF:   (ERROR, "There was a syntax error at the end of the file"),
+    UNIT_NOT_FOUND:     (WARNING, "Design unit '{0}' at line {line}(column {col}) not found in library '{1}'"),
+    DEPENDENCY_CYCLE:   (ERROR, "The use clause at line {line}(column {col}) of '{0}' is part of a dependency cycle: {1}"),
+}
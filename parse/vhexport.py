@@ -0,0 +1,568 @@
+# binary AST export
+#
+# A parsed vhDesignFile written as columns of numbers that other tools map and read
+# without parsing vhdl or unpickling: the code generator, the indexers.  Every object
+# of the AST (nodes, Symbols, scopes, lists) is a node with a kind and a run of fields,
+# a field is a tag and a 32 bit value:
+#
+#   NONE        no value
+#   NODE        the index of another node
+#   STRING      an index into the string table, each distinct string is stored once
+#   LITERAL     the string index of the spelling of a literal the lexer decoded, the
+#               reader interns it again so its value is decoded once
+#   BOOL        the value
+#   INT, FLOAT  an index into the ints or the floats column, an int beyond 64 bits is NONE
+#   LOCATION    an index into the location table, for a FileLocation
+#
+# The kinds table names the class of each kind and its fields, so a reader matches
+# fields by name.  Symbols and use clauses keep their location as a location index
+# in the node's own column.  list, tuple and dict are kinds whose fields are the
+# items (key and value for a dict) without names.
+#
+# file layout:  MAGIC, header size (4 bytes little endian), json header, the columns
+# at 8 byte aligned offsets, little endian.  The header has the format version, the
+# root node and for each column its array typecode, offset and length.  Run from the
+# parse directory:
+#
+#   python vhexport.py <vhdl files> --output design.vhast
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import vhast
+from lcommon import FileLocation, Located, Scope, Symbol, SymbolTable, name_key
+from vhlex import Literal, intern_literal
+
+MAGIC = b"VHAST\0"
+EXPORT_FORMAT = 2
+EXPORT_EXTENSION = ".vhast"
+
+NONE, NODE, STRING, INT, FLOAT, BOOL, LOCATION, LITERAL = range(8)
+
+# the columns in file order: name -> array typecode
+COLUMNS = { 'stringOffsets': 'Q',   # start of each string in stringData, and the end
+            'stringData': 'B',      # the strings, utf-8
+            'kindNames': 'I',       # string index of the class name of each kind
+            'kindFieldStarts': 'I', # start of the field names of each kind, and the end
+            'kindFieldNames': 'I',  # string indexes
+            'files': 'i',           # string index of the path of each fileid, -1 if unknown
+            'nodeKinds': 'H',
+            'nodeStarts': 'Q',      # first field of each node
+            'nodeCounts': 'I',      # number of fields
+            'nodeLocations': 'i',   # location index of a Located node, -1 if none
+            'fieldTags': 'B',
+            'fieldValues': 'i',
+            'ints': 'q',
+            'floats': 'd',
+            'locationFileids': 'i',
+            'locationStarts': 'i',  # source offsets, -1 if unknown
+            'locationEnds': 'i',
+            'locationLines': 'i',   # start line and column, end line and column
+            'locationColumns': 'i',
+            'locationEndLines': 'i',
+            'locationEndColumns': 'i' }
+
+# the kinds of the containers, their fields are the items
+CONTAINERS = ('list', 'tuple', 'dict')
+
+# the fields exported of the classes that aren't only AST: the tables keep only their
+# symbols (not the outer tables, subscopes and the index), the design file not its
+# SourceManager (its paths are the files column).  The other classes export their slots.
+EXPORTED_FIELDS = { Symbol: ('name', 'ast', 'value'),
+                    SymbolTable: ('symbols',),
+                    Scope: ('name', 'symbols'),
+                    vhast.vhDesignFile: ('filepath', 'scope', 'units') }
+
+
+def class_fields(cls):
+    if cls in EXPORTED_FIELDS:
+        return EXPORTED_FIELDS[cls]
+    fields = []
+    for base in reversed(cls.__mro__):
+        fields += [ name for name in base.__dict__.get('__slots__', ()) if name not in ('locs', 'handle') ]
+    return tuple(fields)
+
+def exported(value):
+    # AST objects are exported, what a Symbol.ast refers to outside the AST (a
+    # library) is not
+    return isinstance(value, (vhast.Emitter, Symbol, SymbolTable))
+
+
+class AstWriter():
+    """Collects the nodes of a design file into columns, breadth first from the root"""
+
+    def __init__(self):
+        self.strings = {}       # str -> index
+        self.kinds = {}         # class name -> (kind, field names)
+        self.nodes = {}         # id(object) -> node index
+        self.objects = []       # the object of each node, in index order
+        self.locations = {}     # (fileid, spos, epos, lines) -> location index
+        self.columns = { name: array(code) for name, code in COLUMNS.items() }
+        self.columns['stringOffsets'].append(0)
+        self.columns['kindFieldStarts'].append(0)
+
+    def string(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+            data = str(text).encode('utf-8')
+            self.columns['stringData'].frombytes(data)
+            self.columns['stringOffsets'].append(len(self.columns['stringData']))
+        return index
+
+    def kind(self, obj):
+        name = type(obj).__name__
+        kind = self.kinds.get(name)
+        if kind is None:
+            fields = () if name in CONTAINERS else class_fields(type(obj))
+            kind = self.kinds[name] = (len(self.kinds), fields)
+            self.columns['kindNames'].append(self.string(name))
+            self.columns['kindFieldNames'].extend(self.string(field) for field in fields)
+            self.columns['kindFieldStarts'].append(len(self.columns['kindFieldNames']))
+        return kind
+
+    def node(self, obj):
+        index = self.nodes.get(id(obj))
+        if index is None:
+            index = self.nodes[id(obj)] = len(self.objects)
+            self.objects.append(obj)
+        return index
+
+    def location(self, fileid, spos, epos, sline, scol, eline, ecol):
+        entry = (fileid, spos, epos, sline, scol, eline, ecol)
+        index = self.locations.get(entry)
+        if index is None:
+            index = self.locations[entry] = len(self.locations)
+            for name, value in zip(('locationFileids', 'locationStarts', 'locationEnds', 'locationLines',
+                                    'locationColumns', 'locationEndLines', 'locationEndColumns'), entry):
+                self.columns[name].append(value)
+        return index
+
+    def value(self, value):
+        """The tag and value of a field"""
+        if value is None:
+            return NONE, 0
+        if isinstance(value, bool):
+            return BOOL, int(value)
+        if isinstance(value, int):
+            if not -1 << 63 <= value < 1 << 63:
+                return NONE, 0
+            self.columns['ints'].append(value)
+            return INT, len(self.columns['ints']) - 1
+        if isinstance(value, float):
+            self.columns['floats'].append(value)
+            return FLOAT, len(self.columns['floats']) - 1
+        if isinstance(value, Literal):
+            return LITERAL, self.string(value)
+        if isinstance(value, str):
+            return STRING, self.string(value)
+        if isinstance(value, FileLocation):
+            return LOCATION, self.location(value.fileid, -1, -1, value.sline, value.scol, value.eline, value.ecol)
+        if isinstance(value, (list, tuple, dict)) or exported(value):
+            return NODE, self.node(value)
+        raise TypeError(f"can't export a {type(value).__name__}")
+
+    def add(self, root):
+        """Add root and everything it refers to, returns the index of root"""
+        columns = self.columns
+        tags, values = columns['fieldTags'], columns['fieldValues']
+        rootIndex = self.node(root)
+        ii = rootIndex
+        while ii < len(self.objects):
+            obj = self.objects[ii]
+            kind, fields = self.kind(obj)
+            if isinstance(obj, dict):
+                items = [ item for pair in obj.items() for item in pair ]
+            elif isinstance(obj, (list, tuple)):
+                items = obj
+            else:
+                items = [ getattr(obj, field, None) for field in fields ]
+                if isinstance(obj, Symbol) and not exported(obj.ast):
+                    items[fields.index('ast')] = None
+            columns['nodeKinds'].append(kind)
+            columns['nodeStarts'].append(len(tags))
+            columns['nodeCounts'].append(len(items))
+            loc = obj.loc if isinstance(obj, Located) else None
+            if loc is not None:
+                columns['nodeLocations'].append(self.location(loc.fileid, loc.spos, loc.epos, loc.sline,
+                                                              loc.scol, loc.eline, loc.ecol))
+            else:
+                columns['nodeLocations'].append(-1)
+            for item in items:
+                tag, value = self.value(item)
+                tags.append(tag)
+                values.append(value)
+            ii += 1
+        return rootIndex
+
+    def write(self, path, root, files=()):
+        """Write the columns to path, root is the index of the root node and files the
+           path of each fileid"""
+        self.columns['files'].extend(self.string(name) if name is not None else -1 for name in files)
+        offset = 0
+        sections = {}
+        for name, column in self.columns.items():
+            sections[name] = [ column.typecode, offset, len(column) ]
+            offset += (len(column) * column.itemsize + 7) & ~7
+        header = json.dumps({ 'format': EXPORT_FORMAT, 'root': root, 'sections': sections }).encode('utf-8')
+        start = (len(MAGIC) + 4 + len(header) + 7) & ~7
+        header += b" " * (start - len(MAGIC) - 4 - len(header))     # the columns start aligned
+        with open(path, 'wb') as dst:
+            dst.write(MAGIC)
+            dst.write(struct.pack('<I', len(header)))
+            dst.write(header)
+            for name, column in self.columns.items():
+                if sys.byteorder != 'little':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                data = column.tobytes()
+                dst.write(data)
+                dst.write(b"\0" * (-len(data) & 7))
+
+def export_design(design, path):
+    """Write the design file to path, returns the number of nodes"""
+    writer = AstWriter()
+    root = writer.add(design)
+    sources = design.sources
+    files = [ sources.path(fileid) for fileid in range(len(sources)) ] if sources else ()
+    writer.write(path, root, files)
+    return len(writer.objects)
+
+
+class NodeRef(int):
+    """The index of a node, as AstReader.fields() gives a NODE field"""
+    def __repr__(self):
+        return f"NodeRef({int(self)})"
+
+class ExportedLines():
+    # the LineTable a LocationView of an exported location asks for its lines and
+    # columns, it only knows the start and the end of its location
+    __slots__ = ('reader', 'handle')
+
+    def __init__(self, reader, handle):
+        self.reader = reader
+        self.handle = handle
+
+    def line(self, pos):
+        reader = self.reader
+        if pos == reader.locationStarts[self.handle]:
+            return reader.locationLines[self.handle]
+        return reader.locationEndLines[self.handle]
+
+    def column(self, pos):
+        reader = self.reader
+        if pos == reader.locationStarts[self.handle]:
+            return reader.locationColumns[self.handle]
+        return reader.locationEndColumns[self.handle]
+
+class AstReader():
+    """An exported design file, mapped.  The columns are memoryviews of the mapping,
+       nothing is decoded until it is asked for: kind() and fields() read a node in
+       place, node() builds the AST object of a node and of the nodes it refers to the
+       first time it is asked for.  The objects refer to the mapping, close the reader
+       when they are no longer used."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as src:
+            if src.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not an exported design file")
+            size = struct.unpack('<I', src.read(4))[0]
+            header = json.loads(src.read(size).decode('utf-8'))
+            if header['format'] != EXPORT_FORMAT:
+                raise ValueError(f"{path}: export format {header['format']}, this reader reads {EXPORT_FORMAT}")
+            self.map = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        start = len(MAGIC) + 4 + size
+        for name, (code, offset, count) in header['sections'].items():
+            column = self.view[start + offset:start + offset + count * array(code).itemsize].cast(code)
+            if sys.byteorder != 'little':
+                column = array(code, column)    # a copy, in native order
+                column.byteswap()
+            setattr(self, name, column)
+        self.root = header['root']
+        self.strings = {}       # string index -> str, the strings decoded so far
+        self.objects = {}       # node index -> the AST object built for it
+        self.kindFields = [ tuple(self.string(self.kindFieldNames[jj])
+                                  for jj in range(self.kindFieldStarts[ii], self.kindFieldStarts[ii + 1]))
+                            for ii in range(len(self.kindNames)) ]
+        # the class of each kind, the name of a container kind
+        self.kindClasses = [ name if name in CONTAINERS else getattr(vhast, name)
+                             for name in (self.string(index) for index in self.kindNames) ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.nodeKinds)
+
+    def __repr__(self):
+        return f"AstReader(nodes={len(self.nodeKinds)}, strings={len(self.stringOffsets) - 1}, built={len(self.objects)})"
+
+    def close(self):
+        for name in COLUMNS:
+            column = getattr(self, name)
+            if isinstance(column, memoryview):
+                column.release()
+        self.view.release()
+        self.map.close()
+
+    def string(self, index):
+        text = self.strings.get(index)
+        if text is None:
+            text = self.strings[index] = str(self.stringData[self.stringOffsets[index]:self.stringOffsets[index + 1]], 'utf-8')
+        return text
+
+    def kind(self, index):
+        """The class name of node index"""
+        return self.string(self.kindNames[self.nodeKinds[index]])
+
+    def fieldValue(self, tag, value):
+        if tag == NODE:
+            return NodeRef(value)
+        if tag == STRING:
+            return self.string(value)
+        if tag == LITERAL:
+            return intern_literal(self.string(value))
+        if tag == INT:
+            return self.ints[value]
+        if tag == BOOL:
+            return bool(value)
+        if tag == FLOAT:
+            return self.floats[value]
+        if tag == LOCATION:
+            return FileLocation(self.locationLines[value], self.locationColumns[value], self.locationEndLines[value],
+                                self.locationEndColumns[value], self.locationFileids[value])
+        return None
+
+    def items(self, index):
+        start = self.nodeStarts[index]
+        end = start + self.nodeCounts[index]
+        return [ self.fieldValue(tag, value)
+                 for tag, value in zip(self.fieldTags[start:end].tolist(), self.fieldValues[start:end].tolist()) ]
+
+    def fields(self, index):
+        """The fields of node index by name, a list of the items for a container.
+           A node field is its NodeRef."""
+        items = self.items(index)
+        names = self.kindFields[self.nodeKinds[index]]
+        return dict(zip(names, items)) if names else items
+
+    def node(self, index):
+        """The AST object of node index"""
+        obj = self.objects.get(index)
+        if obj is not None:
+            return obj
+        kind = self.nodeKinds[index]
+        cls = self.kindClasses[kind]
+        if cls in CONTAINERS:
+            # a list or dict is registered before its items are built, an item may refer
+            # back to it
+            if cls == 'tuple':
+                obj = self.objects[index] = tuple(self.node(item) if type(item) is NodeRef else item
+                                                  for item in self.items(index))
+                return obj
+            obj = self.objects[index] = {} if cls == 'dict' else []
+            values = [ self.node(item) if type(item) is NodeRef else item for item in self.items(index) ]
+            if cls == 'dict':
+                obj.update(zip(values[::2], values[1::2]))
+            else:
+                obj.extend(values)
+            return obj
+
+        obj = self.objects[index] = cls.__new__(cls)
+        if issubclass(cls, SymbolTable):
+            # a table has its symbols, the rest is what a new table has
+            state = { 'outer': None, 'symbols': {}, 'overloads': None }
+            if issubclass(cls, Scope):
+                state.update(name=None, public_subscopes=[], used=[])
+            obj.__setstate__((None, state))
+        elif cls is Symbol:
+            obj.key = None
+            obj.defn = None
+            obj.value = None
+        elif cls is vhast.vhDesignFile:
+            obj.sources = self if len(self.files) else None
+        if isinstance(obj, Located):
+            handle = self.nodeLocations[index]
+            obj.locs = self if handle >= 0 else None
+            obj.handle = handle
+        for name, item in zip(self.kindFields[kind], self.items(index)):
+            setattr(obj, name, self.node(item) if type(item) is NodeRef else item)
+        if cls is Symbol:
+            obj.key = name_key(obj.name)
+        return obj
+
+    def design(self):
+        """The vhDesignFile, every node built"""
+        return self.node(self.root)
+
+    def units(self):
+        """The node indexes of the design units, none of them built"""
+        return list(self.fields(self.fields(self.root)['units']))
+
+    # the reader stands in for the SourceManager of a built design file and for the
+    # LocationTable of its Symbols
+    def path(self, fileid):
+        index = self.files[fileid] if 0 <= fileid < len(self.files) else -1
+        return self.string(index) if index >= 0 else None
+
+    @property
+    def fileids(self):
+        return self.locationFileids
+
+    @property
+    def starts(self):
+        return self.locationStarts
+
+    @property
+    def ends(self):
+        return self.locationEnds
+
+    def lineTable(self, handle):
+        return ExportedLines(self, handle)
+
+
+def read_design(path):
+    """The vhDesignFile exported to path, built whole, and the reader it came from"""
+    reader = AstReader(path)
+    return reader.design(), reader
+
+
+# tests
+
+LITERAL_SOURCE = """
+package lits is
+    constant A : INTEGER := 16#FF#;
+    constant B : BIT_VECTOR := x"F0";
+end package lits;
+"""
+
+def export_test():
+    """Export std and a corpus, read them back and check that the text and the symbol
+       locations of what is read are those of the parse, that a reader builds only the
+       nodes asked for, that literals are read back decoded, that an int beyond 64 bits
+       is exported as no value, and that another format version is refused"""
+    import tempfile
+    import vhcorpus
+    from vhlex import BitVector
+    from vhparse import STD_SOURCES, SourceManager, VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "design" + EXPORT_EXTENSION)
+        with SourceManager(STD_SOURCES) as sources:
+            std = VhdlParser(backend='scanner').parseSources(sources).designFile
+            designs = [ ('std', std, str(std)) ]
+        corpus = parser.parse(vhcorpus.corpus_text(64 * 1024), path="corpus.vhd").designFile
+        designs.append(('corpus', corpus, str(corpus)))
+        for name, design, text in designs:
+            nodes = export_design(design, path)
+            with AstReader(path) as reader:
+                units = reader.units()
+                first = reader.node(units[0])
+                partial = len(reader.objects)
+                restored = reader.design()
+                same = str(restored) == text
+                locations = [ repr(sym.loc) for sym in restored.scope.symbols.values() ]
+                expected = [ repr(sym.loc) for sym in design.scope.symbols.values() ]
+                print(f"{name}: {nodes} nodes, {os.path.getsize(path) / 1e3:.1f} KB, first unit built from "
+                      f"{partial} nodes, same text: {same}, same locations: {locations == expected}")
+                ok = ok and same and locations == expected and partial < nodes and first is restored.units[0]
+                del first, restored
+        # the literals are read back as the lexer's Literals
+        literals = parser.parse(LITERAL_SOURCE).designFile
+        export_design(literals, path)
+        with AstReader(path) as reader:
+            scope = reader.design().units[0].scope
+            read = [ scope.find(name).ast.default.literal for name in ('A', 'B') ]
+        decoded = all(type(literal) is Literal for literal in read) and \
+            [ literal.value for literal in read ] == [ 255, BitVector(b"\xf0", 8) ]
+        print(f"literals: {', '.join(f'{literal} = {literal.value!r}' for literal in read)}, decoded: {decoded}")
+        ok = ok and decoded
+
+        # the value of a Symbol may be an int of any size
+        syms = list(corpus.units[0].scope.symbols.values())[-2:]
+        for sym, value in zip(syms, (2 ** 70, -2 ** 63)):
+            sym.value = value
+        export_design(corpus, path)
+        with AstReader(path) as reader:
+            scope = reader.design().units[0].scope
+            values = [ scope.symbols[sym.key].value for sym in syms ]
+        print(f"values: 2 ** 70 read back as {values[0]}, -2 ** 63 as {values[1]}")
+        ok = ok and values == [ None, -2 ** 63 ]
+        with open(path, 'r+b') as dst:
+            dst.seek(len(MAGIC) + 4)
+            header = dst.read(64).replace(b'"format": 2', b'"format": 9')
+            dst.seek(len(MAGIC) + 4)
+            dst.write(header)
+        try:
+            AstReader(path).close()
+            ok = False
+        except ValueError as error:
+            print(f"refused: {error}")
+    print(f"export: read back the same as the parse: {ok}")
+    return ok
+
+def export_bench(size="4M", seed=1):
+    """Print the columnar export of a parsed corpus of size bytes against a pickle of the
+       same design file: writing, the size, opening and building the first unit, and
+       building everything"""
+    import pickle
+    import tempfile
+    import time
+    import vhcorpus
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    data = vhcorpus.corpus_text(vhcorpus.parse_size(size), seed)
+    design = parser.parse(data, path="corpus.vhd").designFile
+    print(f"corpus of {len(data) / 1e6:.1f} MB")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "corpus" + EXPORT_EXTENSION)
+        start = time.perf_counter()
+        nodes = export_design(design, path)
+        written = time.perf_counter() - start
+        start = time.perf_counter()
+        payload = pickle.dumps(design, protocol=pickle.HIGHEST_PROTOCOL)
+        dumped = time.perf_counter() - start
+        print(f"export {written * 1000.0:8.0f} ms, {os.path.getsize(path) / 1e6:6.1f} MB, {nodes} nodes")
+        print(f"pickle {dumped * 1000.0:8.0f} ms, {len(payload) / 1e6:6.1f} MB")
+
+        start = time.perf_counter()
+        with AstReader(path) as reader:
+            reader.node(reader.units()[0])
+            first = time.perf_counter() - start
+            reader.design()
+            built = time.perf_counter() - start
+        start = time.perf_counter()
+        pickle.loads(payload)
+        loaded = time.perf_counter() - start
+        print(f"open and build the first unit {first * 1000.0:8.1f} ms")
+        print(f"build every node              {built * 1000.0:8.0f} ms, unpickle {loaded * 1000.0:.0f} ms")
+
+
+def main(argv=None):
+    from vhparse import SourceManager, VhdlParser
+    argp = argparse.ArgumentParser(description="parse vhdl sources and export the design file")
+    argp.add_argument("paths", nargs="+", help="vhdl files")
+    argp.add_argument("--output", required=True, help="the file to write, " + EXPORT_EXTENSION)
+    argp.add_argument("--backend", default="scanner")
+    args = argp.parse_args(argv)
+
+    with SourceManager(args.paths) as sources:
+        ctx = VhdlParser(backend=args.backend, std=True).parseSources(sources)
+        nodes = export_design(ctx.designFile, args.output)
+    print(f"{args.output}: {nodes} nodes, {os.path.getsize(args.output)} bytes")
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    export_test()
@@ -0,0 +1,421 @@
+# constant folding
+#
+# A ConstantFolder evaluates the locally static expressions of an AST to python values:
+#
+#   integer     int
+#   physical    int, the value in the primary unit
+#   real        float
+#   enumeration int, the position of the literal; relations and the logical operators
+#               give a bool, whose int is the position of FALSE or TRUE
+#   range       a StaticRange
+#   bit string  the BitVector the lexer decoded
+#
+# An expression that isn't static (an object other than a constant, a function call, a
+# name that isn't resolved, a division by zero) folds to None, so do an integer beyond
+# universal_integer and a constant out of the range of its subtype.  The folder keeps
+# the value of each node it folds and the range of each type; the value of a constant or
+# a physical unit is attached to its Symbol, as the parser attaches the position of an
+# enumeration literal.  A binary expression folds its operands left to right, the parser
+# already grouped them by the levels of vhBinaryExpr.precedence.
+#
+# Walking a design file folds its declarations in order, so a constant finds the
+# constants it refers to already folded.  Folding one expression on its own folds the
+# constants it names as it meets them.  Run from the parse directory:
+#
+#   python vhfold.py <vhdl files>
+
+import argparse
+import operator
+import re
+import sys
+
+import vhast
+from lcommon import Emitter, Symbol
+from vhlex import intern_literal
+from vhvisit import SKIP, Visitor
+
+
+class StaticRange():
+    """The folded bounds of a range"""
+    __slots__ = ('left', 'dir', 'right')
+
+    def __init__(self, left, dir, right):
+        self.left = left
+        self.dir = dir.lower()  # 'to' or 'downto'
+        self.right = right
+
+    @property
+    def ascending(self):
+        return self.dir == 'to'
+
+    @property
+    def low(self):
+        return self.left if self.ascending else self.right
+
+    @property
+    def high(self):
+        return self.right if self.ascending else self.left
+
+    @property
+    def length(self):
+        # the number of values of a discrete range
+        return max(0, self.high - self.low + 1)
+
+    def __contains__(self, value):
+        return self.low <= value <= self.high
+
+    def reversed(self):
+        return StaticRange(self.right, 'downto' if self.ascending else 'to', self.left)
+
+    def __eq__(self, other):
+        return isinstance(other, StaticRange) and \
+            (self.left, self.dir, self.right) == (other.left, other.dir, other.right)
+
+    def __hash__(self):
+        return hash((self.left, self.dir, self.right))
+
+    def __repr__(self):
+        return f"StaticRange({self.left!r} {self.dir} {self.right!r})"
+
+
+def divide(left, right):
+    # integer division truncates toward zero
+    if isinstance(left, int) and isinstance(right, int):
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    return left / right
+
+def remainder(left, right):
+    # the sign of the left operand, mod has the sign of the right one like python's %
+    return left - right * divide(left, right)
+
+def power(left, right):
+    if not isinstance(right, int) or (isinstance(left, int) and right < 0):
+        return None
+    if isinstance(left, int) and abs(left) > 1 and right * (abs(left).bit_length() - 1) >= 64:
+        return None     # beyond universal_integer, not computed
+    return left ** right
+
+# the binary operators by name, in upper case.  Concatenation and the shifts work on
+# arrays, they don't fold.
+OPERATORS = { 'AND': lambda left, right: bool(left) and bool(right),
+              'OR': lambda left, right: bool(left) or bool(right),
+              'NAND': lambda left, right: not (left and right),
+              'NOR': lambda left, right: not (left or right),
+              'XOR': lambda left, right: bool(left) != bool(right),
+              'XNOR': lambda left, right: bool(left) == bool(right),
+              '=': operator.eq, '/=': operator.ne, '<': operator.lt, '<=': operator.le,
+              '>': operator.gt, '>=': operator.ge,
+              '+': operator.add, '-': operator.sub,
+              '*': operator.mul, '/': divide, 'MOD': operator.mod, 'REM': remainder,
+              '**': power }
+
+UNARY_OPERATORS = { '-': operator.neg, '+': operator.pos, 'ABS': abs, 'NOT': operator.not_ }
+
+# the attributes of a scalar type that are its bounds
+BOUND_ATTRIBUTES = { 'LEFT': lambda bounds: bounds.left, 'RIGHT': lambda bounds: bounds.right,
+                     'LOW': lambda bounds: bounds.low, 'HIGH': lambda bounds: bounds.high,
+                     'RANGE': lambda bounds: bounds, 'REVERSE_RANGE': StaticRange.reversed }
+
+# the universal types are incomplete in standard.vhd, their ranges are its comments
+UNIVERSAL_RANGES = { '_universal_integer': StaticRange(-2 ** 63, 'to', 2 ** 63 - 1),
+                     '_universal_real': StaticRange(-3.4e38, 'to', 3.4e38) }
+UNIVERSAL_INTEGER = UNIVERSAL_RANGES['_universal_integer']
+
+
+def in_range(value, bounds):
+    # value if it is within bounds, None if it is out of them
+    if type(value) in (int, float) and bounds is not None and value not in bounds:
+        return None
+    return value
+
+def universal(value):
+    # an integer beyond universal_integer isn't static
+    return None if type(value) is int and value not in UNIVERSAL_INTEGER else value
+
+def name_symbol(name):
+    # the Symbol a name refers to, the suffix of a selected name
+    while type(name) is list and name:
+        name = name[-1]
+    return name if isinstance(name, Symbol) else None
+
+
+class ConstantFolder(Visitor):
+    """Folds expressions, keeping the value of each node and each type's range"""
+
+    def __init__(self):
+        self.values = {}        # node -> value, None if it isn't static
+        self.ranges = {}        # type Symbol -> StaticRange, None if it has none
+        self.folded = set()     # the Symbols whose value was looked for
+
+    def value(self, expr):
+        """The value of an expression, a name or a literal value, None if it isn't
+           static"""
+        if isinstance(expr, Emitter):
+            if expr not in self.values:
+                self.walk(expr)
+            return self.values.get(expr)
+        return self.operand(expr)
+
+    def operand(self, expr):
+        # the value of an operand already walked
+        if isinstance(expr, Emitter):
+            return self.values.get(expr)
+        if isinstance(expr, (int, float)):
+            return expr
+        sym = name_symbol(expr)
+        return self.symbolValue(sym) if sym is not None else None
+
+    def symbolValue(self, sym):
+        """The value of a constant, enumeration literal or physical unit"""
+        if sym.value is not None or sym in self.folded:
+            return sym.value
+        self.folded.add(sym)    # before folding, a constant that names itself isn't static
+        decl = sym.ast
+        if isinstance(decl, vhast.vhObjectDecl):
+            if str(decl.obj_class).upper() == 'CONSTANT' and decl.default is not None:
+                sym.value = in_range(self.value(decl.default), self.subtypeRange(decl.subtype))
+        elif isinstance(decl, vhast.vhPhysicalUnit) and decl.unit is sym:
+            if decl.ref_unit is None:
+                sym.value = 1   # the primary unit
+            else:
+                multiplier, unit = self.value(decl.multiplier), name_symbol(decl.ref_unit)
+                unit = self.symbolValue(unit) if unit is not None else None
+                if multiplier is not None and unit is not None:
+                    sym.value = multiplier * unit
+        return sym.value
+
+    def typeRange(self, sym):
+        """The StaticRange of a scalar type or subtype, None if it isn't static"""
+        if sym in self.ranges:
+            return self.ranges[sym]
+        self.ranges[sym] = None
+        decl = sym.ast
+        bounds = None
+        if isinstance(decl, vhast.vhEnumType):
+            if decl.literals:
+                bounds = StaticRange(0, 'to', len(decl.literals) - 1)
+        elif isinstance(decl, vhast.vhPhysicalType):
+            bounds = self.value(decl.constraint)
+        elif isinstance(decl, vhast.vhConstrainedType):
+            bounds = self.value(decl.range)
+        elif isinstance(decl, vhast.vhSubtypeDecl):
+            bounds = self.subtypeRange(decl.subtype)
+        elif isinstance(decl, vhast.vhIncompleteType):
+            bounds = UNIVERSAL_RANGES.get(sym.key)
+        bounds = bounds if isinstance(bounds, StaticRange) else None
+        self.ranges[sym] = bounds
+        return bounds
+
+    def subtypeRange(self, subtype):
+        if not isinstance(subtype, vhast.vhSubtypeIndication):
+            sym = name_symbol(subtype)
+            return self.typeRange(sym) if sym is not None else None
+        constraint = subtype.constraints
+        if constraint and type(constraint) is not list and constraint.isRange():
+            return self.value(constraint)
+        sym = name_symbol(subtype.type_mark)
+        return self.typeRange(sym) if sym is not None else None
+
+    # the walk: a node folded before isn't walked again
+    def enter(self, node):
+        if node in self.values:
+            return SKIP
+
+    def leave_vhExpr(self, node):
+        self.values[node] = None
+
+    def leave_vhAbstractLiteral(self, node):
+        # the lexer decoded the literal, a hand built node's spelling is decoded here
+        self.values[node] = intern_literal(node.literal).value if isinstance(node.literal, str) else None
+
+    def leave_vhPhysicalLiteral(self, node):
+        # the literal in units of the primary unit, a real literal rounds
+        literal, unit = self.operand(node.literal), name_symbol(node.unit)
+        unit = self.symbolValue(unit) if unit is not None else None
+        self.values[node] = round(literal * unit) if literal is not None and unit is not None else None
+
+    def leave_vhQualifiedExpr(self, node):
+        self.values[node] = self.operand(node.expr)
+
+    def leave_vhUnaryExpr(self, node):
+        value = self.operand(node.operand)
+        apply = UNARY_OPERATORS.get(str(node.op).upper())
+        value = apply(value) if value is not None and apply is not None else None
+        self.values[node] = universal(value)
+
+    def leave_vhBinaryExpr(self, node):
+        operands = node.operands
+        value = self.operand(operands[0])
+        for op, right in operands[1:]:
+            right = self.operand(right)
+            apply = OPERATORS.get(str(op).upper())
+            if value is None or right is None or apply is None:
+                value = None
+                break
+            try:
+                value = apply(value, right)
+            except (ZeroDivisionError, OverflowError, TypeError):
+                value = None
+                break
+            value = universal(value)
+        self.values[node] = value
+
+    def leave_vhRange(self, node):
+        left, right = self.operand(node.left), self.operand(node.right)
+        self.values[node] = StaticRange(left, str(node.dir), right) if left is not None and right is not None else None
+
+    def leave_vhAttributeExpr(self, node):
+        name = str(node.attr_name).upper()
+        value = None
+        if name in BOUND_ATTRIBUTES:
+            sym = name_symbol(node.pfx_name)
+            bounds = self.typeRange(sym) if sym is not None else None
+            value = BOUND_ATTRIBUTES[name](bounds) if bounds is not None else None
+        elif name in ('POS', 'VAL', 'SUCC', 'PRED'):
+            # positions are the values of a discrete type
+            arg = self.operand(node.arg)
+            if arg is not None:
+                value = arg + 1 if name == 'SUCC' else arg - 1 if name == 'PRED' else arg
+        self.values[node] = value
+
+    # a design file walk attaches the values of its constants, units and type ranges
+    def leave_vhObjectDecl(self, node):
+        for sym in node.syms:
+            if isinstance(sym, Symbol):
+                self.symbolValue(sym)
+
+    def leave_vhPhysicalUnit(self, node):
+        self.symbolValue(node.unit)
+
+    def leave_vhDecl(self, node):
+        if isinstance(node.name, Symbol):
+            self.typeRange(node.name)
+
+
+def fold_design(design, folder=None):
+    """Fold the constants, units and type ranges of a design file.  Returns the
+       folder."""
+    folder = folder or ConstantFolder()
+    folder.walk(design)
+    return folder
+
+
+# tests
+
+FOLD_SOURCE = """
+package p is
+    type state is (IDLE, RUN, STOP);
+    type small is range 0 to 15;
+    constant A : INTEGER := (1);
+    constant B : INTEGER := 2 + 3 * 4 - 1;
+    constant C : INTEGER := -B + 2 ** 3 mod 5;
+    constant D : BOOLEAN := (A < B) and not (B = 3);
+    constant E : INTEGER := abs (A - 7);
+    constant F : TIME := 5 ns * 2;
+    constant G : INTEGER := 16#FF# + 2#1010# + 1_000 + 1E3;
+    constant H : INTEGER := (-7 rem 2) * 100 + ((-7) mod 2) * 10 + 7 / (-2);
+    constant N : INTEGER := -7 mod 2;
+    constant I : INTEGER := NATURAL'HIGH - INTEGER'HIGH + small'HIGH;
+    constant J : state := state'HIGH;
+    constant K : REAL := 1.5 * 2.0 + 16#1.8#;
+    constant L : INTEGER := 1 / 0;
+    constant M : INTEGER := J;
+    constant O : INTEGER := 2 ** 64 / 4;
+    constant P : INTEGER := 2 ** 1000000000;
+    constant Q : small := 4 * 4;
+    subtype digits is INTEGER range 0 to B;
+end package p;
+"""
+
+FOLD_EXPECTED = { 'A': 1, 'B': 13, 'C': -10, 'D': True, 'E': 6, 'F': 10 ** 7,
+                  'G': 255 + 10 + 1000 + 1000, 'H': -100 + 10 - 3, 'I': 15,
+                  'J': 2, 'K': 4.5, 'L': None, 'M': 2, 'N': -1, 'O': None, 'P': None, 'Q': None }
+
+def fold_test():
+    """Fold FOLD_SOURCE and check the constants and ranges, the std type bounds, that a
+       second fold finds every value memoized, and fold the constants of corpora"""
+    import vhcorpus
+    from vhparse import VhdlParser
+    ok = True
+    for backend in ('ply', 'scanner'):
+        parser = VhdlParser(backend=backend, std=True)
+        ctx = parser.parse(FOLD_SOURCE)
+        folder = fold_design(ctx.designFile)
+        scope = ctx.designFile.units[0].scope
+        values = { name: scope.find(name).value for name in FOLD_EXPECTED }
+        wrong = { name: value for name, value in values.items() if value != FOLD_EXPECTED[name] }
+        std = { name: folder.typeRange(scope.search(name)[0]) for name in ('INTEGER', 'NATURAL', 'TIME', 'BOOLEAN') }
+        digits = folder.typeRange(scope.find('digits'))
+        nodes = len(folder.values)
+        fold_design(ctx.designFile, folder)
+        memoized = len(folder.values) == nodes
+        print(f"{backend}: {len(FOLD_EXPECTED) - len(wrong)} of {len(FOLD_EXPECTED)} constants as expected{' ' + str(wrong) if wrong else ''}, "
+              f"INTEGER {std['INTEGER']}, TIME {std['TIME']}, memoized: {memoized}")
+        ok = ok and not wrong and memoized and digits.length == 14 and \
+            std['INTEGER'].high == 2 ** 31 - 1 and std['NATURAL'] == StaticRange(0, 'to', 2 ** 31 - 1) and \
+            std['BOOLEAN'].length == 2 and std['TIME'].low == -2 ** 63
+
+    for seed in (1, 2, 3):
+        design = parser.parse(vhcorpus.corpus_text(32 * 1024, seed), path=f"corpus{seed}.vhd").designFile
+        folder = fold_design(design)
+        constants = [ sym for unit in design.units if unit for decl in unit.decls
+                      if isinstance(decl, vhast.vhObjectDecl) for sym in decl.syms ]
+        folded = [ sym for sym in constants if sym.value is not None ]
+        # a mod or rem by 0 doesn't fold, nor does an expression of a constant that didn't,
+        # and a value out of the range of the subtype is not kept
+        unfolded = [ sym.ast for sym in constants if sym.value is None ]
+        names = { str(sym) for sym in constants if sym.value is None }
+        def reason(decl):
+            value = folder.value(decl.default)
+            if value is not None:
+                return value not in folder.subtypeRange(decl.subtype)
+            text = str(decl.default)
+            return re.search(r"\b(mod|rem) 0\b", text) or not names.isdisjoint(re.findall(r"\w+", text))
+        ok = ok and len(folded) > 0.9 * len(constants) and all(reason(decl) for decl in unfolded)
+        print(f"corpus {seed}: {len(folded)} of {len(constants)} constants folded")
+    print(f"fold: constants, ranges and memoized values as expected: {ok}")
+    return ok
+
+def fold_bench(size="4M", seed=1):
+    """Print the time to fold the constants and type ranges of a parsed corpus of size
+       bytes, then again with every value memoized"""
+    import time
+    import vhcorpus
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    data = vhcorpus.corpus_text(vhcorpus.parse_size(size), seed)
+    design = parser.parse(data).designFile
+    print(f"corpus of {len(data) / 1e6:.1f} MB")
+    folder = ConstantFolder()
+    for name in ("fold", "memoized"):
+        start = time.perf_counter()
+        fold_design(design, folder)
+        elapsed = time.perf_counter() - start
+        print(f"{name:10} {elapsed * 1000.0:8.0f} ms, {len(folder.values)} nodes, {len(folder.folded)} symbols, "
+              f"{sum(1 for bounds in folder.ranges.values() if bounds)} type ranges")
+
+
+def main(argv=None):
+    from vhparse import SourceManager, VhdlParser
+    argp = argparse.ArgumentParser(description="fold the constants of vhdl sources")
+    argp.add_argument("paths", nargs="+", help="vhdl files")
+    argp.add_argument("--backend", default="scanner")
+    args = argp.parse_args(argv)
+
+    with SourceManager(args.paths) as sources:
+        design = VhdlParser(backend=args.backend, std=True).parseSources(sources).designFile
+    folder = fold_design(design)
+    for unit in design.units:
+        for decl in getattr(unit, 'decls', None) or ():
+            if isinstance(decl, vhast.vhObjectDecl):
+                for sym in decl.syms:
+                    print(f"{str(sym):30} {sym.value!r}")
+            elif isinstance(decl, vhast.vhDecl) and isinstance(decl.name, Symbol) and folder.ranges.get(decl.name):
+                print(f"{str(decl.name):30} {folder.ranges[decl.name]!r}")
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    fold_test()
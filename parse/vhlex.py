@@ -1,24 +1,185 @@
 # vhdl lexer
 
+import glob
+import math
+import os
+import random
+import re
+from array import array
+
 import ply.lex as lex
+from ply.lex import LexToken
+import ldiag
+import ltables
+import vhdiag
 import vhtokens
+from ldiag import DiagnosticSink
+from lcommon import intern_ident, name_key, symbol_key
+from lsource import LineTable
+
+
+# literal values
+
+class BitVector():
+    """The bits of a bit string literal packed into bytes, the first bit is the most
+       significant bit of the first byte"""
+    __slots__ = ('data', 'length')
+
+    def __init__(self, data, length):
+        self.data = data        # bytes
+        self.length = length    # bits
+
+    def __len__(self):
+        return self.length
+
+    def __int__(self):
+        return int.from_bytes(self.data, 'big') >> (-self.length % 8)
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("BitVector index out of range")
+        return (self.data[index >> 3] >> (7 - (index & 7))) & 1
+
+    def __eq__(self, other):
+        return isinstance(other, BitVector) and (self.length, self.data) == (other.length, other.data)
+
+    def __hash__(self):
+        return hash((self.length, self.data))
+
+    def __repr__(self):
+        bits = format(int(self), f"0{self.length}b") if self.length <= 64 else f"{self.length} bits"
+        return f"BitVector({bits})"
+
+INT_LITERAL_BITS = 64    # the widest integer literal with a value
+
+def abstract_value(spelling):
+    """The int or float of a decimal or based literal, None if it isn't one"""
+    text = spelling.replace('_', '').upper()
+    try:
+        if '#' in text or ':' in text:
+            base, digits, exponent = text.replace(':', '#').split('#')
+            base = int(base)
+            if not 2 <= base <= 16:
+                return None
+            if '.' in digits:
+                whole, fraction = digits.split('.')
+                value = int(whole, base) + int(fraction, base) / base ** len(fraction)
+            else:
+                value = int(digits, base)
+            scale = int(exponent[1:]) if exponent else 0
+        else:
+            mantissa, _, exponent = text.partition('E')
+            if '.' in mantissa:
+                return float(text)
+            value = int(mantissa)
+            scale = int(exponent) if exponent else 0
+            base = 10
+    except ValueError:
+        return None
+    if isinstance(value, float):
+        try:
+            return value * float(base) ** scale
+        except OverflowError:
+            return math.inf
+    if scale < 0:
+        return None     # an integer literal has no negative exponent
+    # an integer literal beyond 64 bits has no value, the bound is checked before the
+    # power is computed so 1E100000000 isn't built
+    if not value:
+        return 0
+    if value.bit_length() - 1 + scale * (base.bit_length() - 1) >= INT_LITERAL_BITS:
+        return None
+    value *= base ** scale
+    return value if value < 1 << INT_LITERAL_BITS else None
+
+BIT_STRING_BITS = { 'B': 1, 'O': 3, 'X': 4 }
+
+def bit_string_value(spelling):
+    """The BitVector of a bit string literal, None if it isn't one"""
+    bits = BIT_STRING_BITS.get(spelling[:1].upper())
+    digits = spelling[2:-1].replace('_', '')
+    if bits is None or not digits:
+        return None
+    try:
+        value = int(digits, 1 << bits)
+    except ValueError:
+        return None
+    length = len(digits) * bits
+    pad = -length % 8
+    return BitVector((value << pad).to_bytes((length + pad) >> 3, 'big'), length)
+
+class Literal(str):
+    """An abstract or bit string literal spelling, decoded once.  Like Idents the lexers
+       intern them, the value of each distinct spelling is kept in literalValues: an int
+       or float, a BitVector for a bit string, None if it doesn't decode.  The spelling
+       is what decompile() writes."""
+    __slots__ = ()
+
+    @property
+    def value(self):
+        return literalValues[self]
+
+    def __reduce__(self):
+        return (intern_literal, (str(self),))
+
+# the global literal intern table: spelling -> Literal, and the value of each Literal
+literalTable = {}
+literalValues = {}
+
+def intern_literal(spelling):
+    literal = literalTable.get(spelling)
+    if literal is None:
+        literal = literalTable[spelling] = Literal(spelling)
+        if spelling[:1].isdigit():
+            literalValues[literal] = abstract_value(spelling)
+        else:
+            literalValues[literal] = bit_string_value(spelling)
+    return literal
+
 
 class VhdlLexer():
-    def __init__(self, **kwargs):
+    backends = ('ply', 'scanner')
+
+    def __init__(self, cache=True, tabdir=None, debug=False, backend='ply', diag=None, intern=True, **kwargs):
+        # cache=True loads the master regexes from a generated table module, which is
+        # (re)built only when the token rules change.  cache=False always rebuilds them.
+        # backend='scanner' uses the hand written VhdlScanner instead of the ply lexer,
+        # both produce the same tokens.  diag is the DiagnosticSink for lexical errors.
+        # intern=False leaves identifier values plain strings whose key is folded at each
+        # lookup, as they were before Ident, the baseline of the idents benchmark.
+        self.diag = diag if diag is not None else DiagnosticSink(vhdiag.vh_messages)
+        self.identValue = intern_ident if intern else str
         self.tokens = vhtokens.vh_tokens + tuple(vhtokens.vh2000_reserved.values())
         self.reserved = vhtokens.vh2000_reserved
 
-        self.lexer = lex.lex(object=self, **kwargs)
-        self.lexer.lineStart = 0
+        if backend not in self.backends:
+            raise ValueError(f"Unknown lexer backend '{backend}', expected one of {self.backends}")
+        if backend == 'scanner':
+            self.lexer = VhdlScanner(self)
+        elif cache:
+            fingerprint = ltables.rules_fingerprint(self, 't_')
+            name = ltables.table_name('vhlextab', fingerprint)
+            lextab = ltables.load_table(name, tabdir)
+            if not lextab:
+                tabdir = ltables.prepare_dir('vhlextab', name, tabdir)
+                lextab = name
+            self.lexer = lex.lex(object=self, optimize=True, lextab=lextab, outputdir=tabdir,
+                                 debug=debug, **kwargs)
+        else:
+            self.lexer = lex.lex(object=self, debug=debug, **kwargs)
+        self.lexer.diag = self.diag
 
-    #multi-character token rules -- no action
-    t_BASEDLIT = r'1?[0-9][#][0-9a-fA-F](_?[0-9a-fA-F])*(\.[0-9a-fA-F](_?[0-9a-fA-F])*)?[#]([eE][+-]?[0-9](_?[0-9])*)?'
-    t_CHARLIT = r'\'.\''
+    # literals are decoded once per spelling.  As function rules BASEDLIT still comes
+    # before DECLIT, as it did as the longer string rule.
+    def t_BASEDLIT(self, t):
+        r'1?[0-9][#][0-9a-fA-F](_?[0-9a-fA-F])*(\.[0-9a-fA-F](_?[0-9a-fA-F])*)?[#]([eE][+-]?[0-9](_?[0-9])*)?'
+        t.value = intern_literal(t.value)
+        return t
 
-    t_DECLIT = r'[0-9](_?[0-9])*(\.[0-9](_?[0-9])*)?([eE][+-]?[0-9](_?[0-9])*)?'
-    t_STRLIT = r'".*?"'  
-    # todo:  this rule doesn't support embedded '"'
-    #        nor does it support the alternative quote character '%'
+    def t_DECLIT(self, t):
+        r'[0-9](_?[0-9])*(\.[0-9](_?[0-9])*)?([eE][+-]?[0-9](_?[0-9])*)?'
+        t.value = intern_literal(t.value)
+        return t
 
     # two character token rules -- no action
     t_ARROW = r'=>'
@@ -34,7 +195,7 @@ class VhdlLexer():
     literals = "&|,:/.+>[(<*+])="
     # todo: replacement characters for '|', '#'
 
-    t_ignore = " \t"
+    t_ignore = " \t\r"    # '\r' of CRLF line ends, text mode reads used to strip them
     t_TICK = r"'"
     t_SEMI = r';'
     # ';' ('SEMI') has a specific token because there are end of line actions that can be taken
@@ -56,6 +217,7 @@ class VhdlLexer():
         # match BITSTRLIT first since it starts with a letter like an IDENT
     def t_BITSTRLIT(self, t):
         r'([bB]"[0-1](_?[0-1])*?")|([oO]"[0-7](_?[0-7])*?")|([xX]"[0-9a-fA-F](_?[0-9a-fA-F])*?")'
+        t.value = intern_literal(t.value)
         return t
 
     def t_IDENT(self, t):
@@ -63,17 +225,32 @@ class VhdlLexer():
         # This rule is permissive: it allows idents with repeated and trailing underscores
         # to allow internal names in lexical analysis. Legal ident names must be checked
         # during semantic analysis.  This rule requires at least 1 letter before any number.
-        t.type = self.reserved.get(t.value.lower(), 'IDENT')
+        t.value = self.identValue(t.value)
+        t.type = self.reserved.get(name_key(t.value), 'IDENT')
+        return t
+
+    # character and string literals are interned like identifiers, they name enumeration
+    # literals and operator symbols.  No other rule matches their first character, so
+    # as function rules they match the same text as they did as string rules.
+    def t_CHARLIT(self, t):
+        r'\'.\''
+        t.value = self.identValue(t.value)
+        return t
+
+    def t_STRLIT(self, t):
+        r'".*?"'
+        # todo:  this rule doesn't support embedded '"'
+        #        nor does it support the alternative quote character '%'
+        t.value = self.identValue(t.value)
         return t
 
     # Define a rule so we can track line numbers
     def t_newline(self, t):
         r'\n+'
         t.lexer.lineno += len(t.value)
-        self.lineStart = t.lexpos + 1
 
     def t_error(self, t):
-        print("Illegal character '%s'" % t.value[0])
+        t.lexer.diag.report(vhdiag.ILLEGAL_CHAR, t.lexpos, getattr(t.lexer, 'lineTable', None), t.value[0])
         t.lexer.skip(1)
 
     # end of token rules
@@ -82,7 +259,507 @@ class VhdlLexer():
         self.lexer.input(data)
         for token in self.lexer:
             print(token)
+        self.diag.dump()
+        self.diag.clear()
+
+    def clone(self, diag):
+        """A new lexer with the rules of this one, reporting to diag.  The clones share
+           the compiled rules and can run concurrently."""
+        if isinstance(self.lexer, VhdlScanner):
+            lexer = VhdlScanner(self)
+        else:
+            lexer = self.lexer.clone()
+            lexer.lineno = 1
+        lexer.diag = diag
+        return lexer
+
+    def tokenize(self, data, fileid=-1):
+        """Tokenize all of data (str or bytes-like) into a TokenColumns, the kinds and
+           spans of the tokens without a LexToken per token.  Both backends produce
+           the same tokens, so this always uses the scanner's columnar loop."""
+        columns = TokenColumns(data, fileid)
+        VhdlScanner(self).scanColumns(data, columns)
+        return columns
+
+
+# token kinds of the columnar token stream, small ints so they fit in an array('B')
+KIND_NAMES = tuple(dict.fromkeys(vhtokens.vh_tokens + tuple(vhtokens.vh2000_reserved.values())
+                                 + tuple(VhdlLexer.literals)))
+KIND_CODES = { name: code for code, name in enumerate(KIND_NAMES) }
+# kinds whose values the lexer interns
+INTERNED_KINDS = frozenset(KIND_CODES[name] for name in
+                           ('IDENT', 'CHARLIT', 'STRLIT') + tuple(vhtokens.vh2000_reserved.values()))
+# kinds whose values are Literals
+LITERAL_KINDS = frozenset(KIND_CODES[name] for name in ('DECLIT', 'BASEDLIT', 'BITSTRLIT'))
+
+
+# VhdlScanner character classes
+_IGNORE, _NEWLINE, _ALPHA, _BITSTR, _IDENT, _DIGIT, _PUNCT = range(1, 8)
+
+# VhdlScanner punctuation kinds that need more than a lookup of the second character
+_LESS, _TICK, _QUOTE = range(1, 4)
+
+class ScanTables():
+    """Dispatch tables and regexes for VhdlScanner, for str input or, with encode=True,
+       for bytes-like input (bytes, mmap) where the tables are keyed by byte value."""
+
+    def __init__(self, encode):
+        key = ord if encode else str
+        pat = (lambda regex: regex.encode('latin-1')) if encode else (lambda regex: regex)
+        enc = (lambda text: text.encode('latin-1')) if encode else (lambda text: text)
+
+        # character classes used for the first character dispatch
+        self.charClass = {}
+        for ch in VhdlLexer.t_ignore:
+            self.charClass[key(ch)] = _IGNORE
+        self.charClass[key("\n")] = _NEWLINE
+        for ch in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ":
+            self.charClass[key(ch)] = _ALPHA
+        for ch in "bBoOxX":
+            self.charClass[key(ch)] = _BITSTR
+        for ch in "_\\":
+            self.charClass[key(ch)] = _IDENT
+        for ch in "0123456789":
+            self.charClass[key(ch)] = _DIGIT
+        for ch in VhdlLexer.literals + ";-'\"":
+            self.charClass[key(ch)] = _PUNCT
+
+        # one character tokens: (type, value, second character, two character type, two character value, kind)
+        punct = { ch: (ch, None, None) for ch in VhdlLexer.literals }
+        punct.update({ ';': ('SEMI', None, None), '-': ('MINUS', '-', None), '*': ('*', '*', 'EXP'),
+                       '=': ('=', '>', 'ARROW'), '>': ('>', '=', 'GE'), '/': ('/', '=', 'NE'),
+                       ':': (':', '=', 'VASSIGN'), "'": ('TICK', None, None), '"': (None, None, None) })
+        kinds = { '<': _LESS, "'": _TICK, '"': _QUOTE }
+        self.punct = {}
+        for ch, (ttype, second, pairType) in punct.items():
+            self.punct[key(ch)] = (ttype, ch, second and enc(second), pairType, second and ch + second,
+                                   kinds.get(ch))
+        self.lessPairs = { enc('>'): ('BOX', '<>'), enc('='): ('LE', '<=') }
+        self.newline = enc('\n')
+        self.quote = enc('"')
+
+        # the complex rules reuse the VhdlLexer regexes so the two backends can't diverge
+        self.basedRe = re.compile(pat(VhdlLexer.t_BASEDLIT.__doc__), re.VERBOSE)
+        self.decRe = re.compile(pat(VhdlLexer.t_DECLIT.__doc__), re.VERBOSE)
+        self.strRe = re.compile(pat(VhdlLexer.t_STRLIT.__doc__), re.VERBOSE)
+        self.bitStrRe = re.compile(pat(VhdlLexer.t_BITSTRLIT.__doc__), re.VERBOSE)
+        self.identRe = re.compile(pat(VhdlLexer.t_IDENT.__doc__), re.VERBOSE)
+        if encode:
+            # a character literal holds one utf-8 encoded character
+            self.charRe = re.compile(rb"'([^\n\x80-\xff]|[\xc0-\xff][\x80-\xbf]+)'")
+        else:
+            self.charRe = re.compile(VhdlLexer.t_CHARLIT.__doc__, re.VERBOSE)
+        self.alnumRe = re.compile(pat(r'[_a-zA-Z0-9]*'))
+        self.ignoreRe = re.compile(pat('[' + re.escape(VhdlLexer.t_ignore) + ']*'))
+        self.newlineRe = re.compile(pat(r'\n*'))
+
+
+class VhdlScanner():
+    """Hand written single pass scanner for VhdlLexer.  It has the same interface as
+       the ply lexer (input(), token(), iteration, lineno, lexpos) and produces the same
+       tokens, but dispatches on the first character of a token instead of trying each
+       alternative of ply's master regex, and tracks lines without a rule callback.
+
+       The input can also be bytes-like (bytes, mmap), it is then scanned in place:
+       only token values are decoded and lexpos is a byte offset."""
+
+    strTables = None
+    bytesTables = None
+
+    def __init__(self, owner):
+        self.owner = owner      # the VhdlLexer: reserved words and t_error
+        self.diag = owner.diag
+        self.identValue = owner.identValue
+        self.reserved = owner.reserved
+        self.lexdata = None
+        self.lexpos = 0
+        self.lexlen = 0
+        self.lineno = 1         # like the ply lexer, input() does not reset the line number
+        self.lineTable = None
+        self.identTypes = {}    # spelling -> (token type, value), saves the case folding of repeated names
+        self.tables = None
+        self.encoded = False
+
+    def input(self, data):
+        self.encoded = not isinstance(data, str)
+        if self.encoded:
+            if not VhdlScanner.bytesTables:
+                VhdlScanner.bytesTables = ScanTables(encode=True)
+            self.tables = VhdlScanner.bytesTables
+        else:
+            if not VhdlScanner.strTables:
+                VhdlScanner.strTables = ScanTables(encode=False)
+            self.tables = VhdlScanner.strTables
+        self.lexdata = data
+        self.lexpos = 0
+        self.lexlen = len(data)
+        self.lineTable = None   # like the ply lexer, the caller sets the LineTable of data
+
+    def skip(self, n):
+        self.lexpos += n
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t
+
+    def token(self):
+        data = self.lexdata
+        pos = self.lexpos
+        end = self.lexlen
+        tables = self.tables
+        getClass = tables.charClass.get
+        while pos < end:
+            c = data[pos]
+            cls = getClass(c)
+
+            if cls == _ALPHA:
+                epos = tables.alnumRe.match(data, pos + 1).end()
+                ident = self.identTypes.get(data[pos:epos])
+                if ident is None:
+                    ident = self.identType(data[pos:epos])
+                ttype, value = ident
+
+            elif cls == _IGNORE:
+                pos = tables.ignoreRe.match(data, pos + 1).end()
+                continue
+
+            elif cls == _PUNCT:
+                ttype, value, second, pairType, pairValue, kind = tables.punct[c]
+                epos = pos + 1
+                if second and data[epos:epos+1] == second:
+                    if pairType is None:        # '--' comment
+                        epos = data.find(tables.newline, epos)
+                        pos = end if epos < 0 else epos
+                        continue
+                    ttype = pairType
+                    value = pairValue
+                    epos += 1
+                elif kind == _LESS:
+                    pair = tables.lessPairs.get(data[epos:epos+1])
+                    if pair:
+                        ttype, value = pair
+                        epos += 1
+                elif kind == _TICK:
+                    m = tables.charRe.match(data, pos)
+                    if m:
+                        ttype = 'CHARLIT'
+                        epos = m.end()
+                        value = self.identValue(self.decode(m.group()))
+                elif kind == _QUOTE:
+                    m = tables.strRe.match(data, pos)
+                    if not m:
+                        self.error(pos)
+                        pos = self.lexpos
+                        continue
+                    ttype = 'STRLIT'
+                    epos = m.end()
+                    value = self.identValue(self.decode(m.group()))
+
+            elif cls == _NEWLINE:
+                epos = tables.newlineRe.match(data, pos + 1).end()
+                self.lineno += epos - pos
+                pos = epos
+                continue
 
+            elif cls == _BITSTR:
+                m = None
+                if data[pos+1:pos+2] == tables.quote:
+                    m = tables.bitStrRe.match(data, pos)
+                if m:
+                    ttype = 'BITSTRLIT'
+                    epos = m.end()
+                    value = intern_literal(self.decode(m.group()))
+                else:
+                    epos = tables.alnumRe.match(data, pos + 1).end()
+                    ident = self.identTypes.get(data[pos:epos])
+                    if ident is None:
+                        ident = self.identType(data[pos:epos])
+                    ttype, value = ident
+
+            elif cls == _DIGIT:
+                m = tables.basedRe.match(data, pos)
+                ttype = 'BASEDLIT'
+                if not m:
+                    m = tables.decRe.match(data, pos)
+                    ttype = 'DECLIT'
+                epos = m.end()
+                value = intern_literal(self.decode(m.group()))
+
+            elif cls == _IDENT:
+                m = tables.identRe.match(data, pos)
+                if not m:
+                    self.error(pos)
+                    pos = self.lexpos
+                    continue
+                epos = m.end()
+                ident = self.identTypes.get(m.group())
+                if ident is None:
+                    ident = self.identType(m.group())
+                ttype, value = ident
+
+            else:
+                self.error(pos)
+                pos = self.lexpos
+                continue
+
+            tok = LexToken()
+            tok.type = ttype
+            tok.value = value
+            tok.lineno = self.lineno
+            tok.lexpos = pos
+            self.lexpos = epos
+            return tok
+
+        self.lexpos = pos
+        return None
+
+    def scanColumns(self, data, columns):
+        """Append the tokens of data to columns: the same tokens as token() returns,
+           but only their kinds and spans, values are left to TokenColumns.value()."""
+        self.input(data)
+        self.lineTable = columns.lineTable
+        self.lineno = 1
+        tables = self.tables
+        getClass = tables.charClass.get
+        codes = KIND_CODES
+        identCode = codes['IDENT']
+        identKinds = {}     # spelling -> kind code
+        kinds = columns.kinds.append
+        starts = columns.starts.append
+        lengths = columns.lengths.append
+        lines = columns.lines.append
+        lineno = 1
+        pos = 0
+        end = self.lexlen
+        while pos < end:
+            c = data[pos]
+            cls = getClass(c)
+
+            if cls == _ALPHA:
+                epos = tables.alnumRe.match(data, pos + 1).end()
+                code = identKinds.get(data[pos:epos])
+                if code is None:
+                    code = self.identKind(data[pos:epos], identKinds)
+
+            elif cls == _IGNORE:
+                pos = tables.ignoreRe.match(data, pos + 1).end()
+                continue
+
+            elif cls == _PUNCT:
+                ttype, value, second, pairType, pairValue, kind = tables.punct[c]
+                epos = pos + 1
+                if second and data[epos:epos+1] == second:
+                    if pairType is None:        # '--' comment
+                        epos = data.find(tables.newline, epos)
+                        pos = end if epos < 0 else epos
+                        continue
+                    ttype = pairType
+                    epos += 1
+                elif kind == _LESS:
+                    pair = tables.lessPairs.get(data[epos:epos+1])
+                    if pair:
+                        ttype = pair[0]
+                        epos += 1
+                elif kind == _TICK:
+                    m = tables.charRe.match(data, pos)
+                    if m:
+                        ttype = 'CHARLIT'
+                        epos = m.end()
+                elif kind == _QUOTE:
+                    m = tables.strRe.match(data, pos)
+                    if not m:
+                        self.lineno = lineno
+                        self.error(pos)
+                        pos = self.lexpos
+                        continue
+                    ttype = 'STRLIT'
+                    epos = m.end()
+                code = codes[ttype]
+
+            elif cls == _NEWLINE:
+                epos = tables.newlineRe.match(data, pos + 1).end()
+                lineno += epos - pos
+                pos = epos
+                continue
+
+            elif cls == _BITSTR:
+                m = None
+                if data[pos+1:pos+2] == tables.quote:
+                    m = tables.bitStrRe.match(data, pos)
+                if m:
+                    code = codes['BITSTRLIT']
+                    epos = m.end()
+                else:
+                    epos = tables.alnumRe.match(data, pos + 1).end()
+                    code = identKinds.get(data[pos:epos])
+                    if code is None:
+                        code = self.identKind(data[pos:epos], identKinds)
+
+            elif cls == _DIGIT:
+                m = tables.basedRe.match(data, pos)
+                code = codes['BASEDLIT']
+                if not m:
+                    m = tables.decRe.match(data, pos)
+                    code = codes['DECLIT']
+                epos = m.end()
+
+            elif cls == _IDENT:
+                m = tables.identRe.match(data, pos)
+                if not m:
+                    self.lineno = lineno
+                    self.error(pos)
+                    pos = self.lexpos
+                    continue
+                epos = m.end()
+                code = identKinds.get(m.group())
+                if code is None:
+                    code = self.identKind(m.group(), identKinds)
+
+            else:
+                self.lineno = lineno
+                self.error(pos)
+                pos = self.lexpos
+                continue
+
+            kinds(code)
+            starts(pos)
+            lengths(epos - pos)
+            lines(lineno)
+            pos = epos
+
+        self.lineno = lineno
+        self.lexpos = pos
+
+    def identKind(self, spelling, identKinds):
+        code = KIND_CODES[self.reserved.get(symbol_key(self.decode(spelling)), 'IDENT')]
+        identKinds[spelling] = code
+        return code
+
+    def decode(self, value):
+        if self.encoded:
+            return value.decode('utf-8', errors='ignore')
+        return value
+
+    def identType(self, spelling):
+        value = self.identValue(self.decode(spelling))
+        ident = (self.reserved.get(name_key(value), 'IDENT'), value)
+        # a str spelling is keyed by its value, which is equal, the slice isn't kept
+        self.identTypes[spelling if self.encoded else value] = ident
+        return ident
+
+    def error(self, pos):
+        # no rule matched, report it the same way the ply lexer does
+        data = self.lexdata
+        size = 1
+        c = data[pos]
+        if self.encoded:
+            # report (and skip) a whole utf-8 encoded character
+            while size < 4 and pos + size < self.lexlen and 0x80 <= data[pos+size] < 0xc0 and c >= 0xc0:
+                size += 1
+            c = data[pos:pos+size].decode('utf-8', errors='replace')
+        tok = LexToken()
+        tok.type = 'error'
+        tok.value = c
+        tok.lineno = self.lineno
+        tok.lexpos = pos
+        tok.lexer = self
+        self.lexpos = pos
+        self.owner.t_error(tok)
+        if self.lexpos == pos:
+            raise lex.LexError(f"Scanning error. Illegal character '{c}'", data[pos:])
+        if self.lexpos == pos + 1:
+            self.lexpos = pos + size
+
+
+class TokenColumns():
+    """The tokens of one source buffer in columns: kind codes (see KIND_NAMES), start
+       offsets, lengths and line numbers.  Values are sliced from the source on demand,
+       for bytes-like sources the offsets and lengths are in bytes.  The offsets are 64
+       bit, a mapped source can be larger than 2 GB."""
+
+    def __init__(self, data, fileid=-1):
+        self.data = data
+        self.fileid = fileid
+        self.encoded = not isinstance(data, str)
+        self.lineTable = LineTable(data)
+        self.kinds = array('B')
+        self.starts = array('q')
+        self.lengths = array('i')
+        self.lines = array('i')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __repr__(self):
+        return f"TokenColumns(tokens={len(self.kinds)}, fileid={self.fileid})"
+
+    def kind(self, idx):
+        return KIND_NAMES[self.kinds[idx]]
+
+    def text(self, idx):
+        start = self.starts[idx]
+        text = self.data[start:start + self.lengths[idx]]
+        if self.encoded:
+            return text.decode('utf-8', errors='ignore')
+        return text
+
+    def value(self, idx):
+        # the value the lexers give the token
+        if self.kinds[idx] in INTERNED_KINDS:
+            return intern_ident(self.text(idx))
+        if self.kinds[idx] in LITERAL_KINDS:
+            return intern_literal(self.text(idx))
+        return self.text(idx)
+
+    def lexer(self):
+        return ColumnLexer(self)
+
+
+class ColumnLexer():
+    """Presents a TokenColumns to the parser (or anything else expecting a ply lexer)
+       one LexToken at a time.  Each ColumnLexer is an independent cursor, so one
+       tokenization can be consumed several times."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.index = 0
+        self.lineno = 1
+        self.lexpos = 0
+        self.lineTable = columns.lineTable
+
+    def input(self, data):
+        raise TypeError("ColumnLexer reads its input from a TokenColumns")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t
+
+    def token(self):
+        columns = self.columns
+        idx = self.index
+        if idx >= len(columns.kinds):
+            return None
+        self.index = idx + 1
+        tok = LexToken()
+        tok.type = KIND_NAMES[columns.kinds[idx]]
+        tok.value = columns.value(idx)
+        tok.lexpos = columns.starts[idx]
+        tok.lineno = columns.lines[idx]
+        if columns.fileid >= 0:
+            tok.fileid = columns.fileid
+        self.lineno = tok.lineno
+        self.lexpos = tok.lexpos + columns.lengths[idx]
+        return tok
 
 
 def tokens_to_test():
@@ -107,6 +784,261 @@ def tokens_test(data):
     lexer = VhdlLexer()
     lexer.test(data)
 
+def token_stream(data, backend, positions=True):
+    lexer = VhdlLexer(backend=backend)
+    lexer.lexer.input(data)
+    if positions:
+        stream = [ (tok.type, tok.value, tok.lineno, tok.lexpos) for tok in lexer.lexer ]
+    else:
+        stream = [ (tok.type, tok.value, tok.lineno) for tok in lexer.lexer ]
+    return stream, diagnostics(lexer.diag, positions)
+
+def diagnostics(diag, positions=True):
+    if positions:
+        return [ (record.code, record.args, record.offset) for record in diag ]
+    return [ (record.code, record.args) for record in diag ]
+
+def fuzzed_source(rnd, ntokens=400):
+    # a random mix of well formed, malformed and partial tokens
+    pieces = [ 'package', 'END', 'Is', 'ident_1', '_x', '__a_b__', '_9', 'x', 'b', 'O',
+               r'\ext id\ ', '\\unterminated', '12', '1_000', '3.14', '6.02E+23', '1e-3', '1__0',
+               '16#FF#', '2#1010_1010#E2', '12#a.b#', '22#1#', '1#', 'x"0F_a"', 'B"101"', 'o"78"',
+               'b"1_"', 'X"', "'a'", "'''", "''", "'", '"str"', '""', '"open', '=>', '<>', '<=',
+               '>=', '/=', ':=', '**', '--comment', '-', '--', ';', '&', '|', ',', ':', '/',
+               '.', '+', '>', '[', '(', '<', '*', ']', ')', '=', '#', '$', '%', '?', '@', '!',
+               '\r', '\x0c', 'é', ' ', '∂' ]
+    seps = [ '', ' ', ' ', '  ', '\t', '\n', '\n\n', ' \n ' ]
+    result = []
+    for ii in range(ntokens):
+        if rnd.random() < 0.1:
+            result.append(chr(rnd.randrange(1, 256)))
+        else:
+            result.append(rnd.choice(pieces))
+        result.append(rnd.choice(seps))
+    return "".join(result)
+
+def report_difference(name, expected, actual, expName, actName):
+    for ii, (exp, act) in enumerate(zip(expected[0] + [None], actual[0] + [None])):
+        if exp != act:
+            print(f"{name}: token {ii} differs, {expName} {exp} {actName} {act}")
+            return
+    print(f"{name}: error reports differ")
+
+def backends_diff_test(nfuzz=500, seed=1):
+    """Check that the ply and scanner backends produce identical token streams (and
+       error reports) on the std library sources and on a fuzzed corpus.  Also check
+       that the scanner gives the same tokens for the utf-8 encoded sources, where
+       lexpos is a byte offset."""
+    sources = []
+    stddir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib/vhdl/std")
+    for path in sorted(glob.glob(os.path.join(stddir, "*.vhd"))):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as src:
+            sources.append((path, src.read()))
+    rnd = random.Random(seed)
+    for ii in range(nfuzz):
+        sources.append((f"fuzz #{ii} (seed {seed})", fuzzed_source(rnd)))
+
+    failures = 0
+    for name, data in sources:
+        expected = token_stream(data, 'ply')
+        actual = token_stream(data, 'scanner')
+        if expected != actual:
+            failures += 1
+            report_difference(name, expected, actual, 'ply', 'scanner')
+        expected = token_stream(data, 'scanner', positions=False)
+        actual = token_stream(data.encode('utf-8'), 'scanner', positions=False)
+        if expected != actual:
+            failures += 1
+            report_difference(name, expected, actual, 'str', 'bytes')
+    print(f"{len(sources)} sources compared, {failures} differences")
+    return failures == 0
+
+def columns_diff_test(nfuzz=200, seed=2):
+    """Check that tokenize() gives the tokens of the scanner, through the columns and
+       through a ColumnLexer, for str and utf-8 encoded sources"""
+    rnd = random.Random(seed)
+    sources = [ ("tokens_to_test", tokens_to_test()) ]
+    sources += [ (f"fuzz #{ii} (seed {seed})", fuzzed_source(rnd)) for ii in range(nfuzz) ]
+    failures = 0
+    for name, text in sources:
+        for data in (text, text.encode('utf-8')):
+            expected = token_stream(data, 'scanner')
+            lexer = VhdlLexer(backend='scanner')
+            columns = lexer.tokenize(data)
+            actual = ([ (columns.kind(ii), columns.value(ii), columns.lines[ii], columns.starts[ii])
+                        for ii in range(len(columns)) ], diagnostics(lexer.diag))
+            adapted = ([ (tok.type, tok.value, tok.lineno, tok.lexpos) for tok in columns.lexer() ],
+                       expected[1])
+            for result, resultName in ((actual, 'columns'), (adapted, 'ColumnLexer')):
+                if expected != result:
+                    failures += 1
+                    report_difference(name, expected, result, 'scanner', resultName)
+    print(f"{len(sources)} sources tokenized, {failures} differences")
+    return failures == 0
+
+def lex_throughput(data, backend, runs=3):
+    """Best of runs (tokens, seconds) to tokenize data with the given VhdlLexer backend,
+       'columns' for VhdlLexer.tokenize() into a TokenColumns"""
+    import contextlib
+    import io
+    import time
+    best = None
+    for ii in range(runs):
+        if backend == 'columns':
+            lexer = VhdlLexer(backend='scanner')
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                ntokens = len(lexer.tokenize(data))
+                elapsed = time.perf_counter() - start
+        else:
+            lexer = VhdlLexer(backend=backend).lexer
+            lexer.input(data)
+            token = lexer.token
+            ntokens = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                while token():
+                    ntokens += 1
+                elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[1]:
+            best = (ntokens, elapsed)
+    return best
+
+def lex_bench(data, backends=('ply', 'scanner', 'columns'), runs=3):
+    """Print the tokens per second of each backend on data"""
+    print(f"input: {len(data) / 1e6:.2f} MB")
+    for backend in backends:
+        ntokens, elapsed = lex_throughput(data, backend, runs)
+        print(f"{backend:8}: {ntokens} tokens in {elapsed:7.3f} s, {ntokens / elapsed:12,.0f} tokens/s, "
+              f"{len(data) / elapsed / 1e6:6.2f} MB/s")
+
+def line_table_test(nfuzz=200, seed=3):
+    """Check that the LineTable of a source gives the lexer's line number for every
+       token, for str and utf-8 encoded sources"""
+    rnd = random.Random(seed)
+    sources = [ (f"fuzz #{ii} (seed {seed})", fuzzed_source(rnd)) for ii in range(nfuzz) ]
+    failures = 0
+    for name, text in sources:
+        for data in (text, text.encode('utf-8')):
+            lines = LineTable(data)
+            tokens, errors = token_stream(data, 'scanner')
+            for ttype, value, lineno, lexpos in tokens:
+                if lines.line(lexpos) != lineno:
+                    failures += 1
+                    print(f"{name}: {ttype} at {lexpos} is on line {lineno}, the line table says {lines.line(lexpos)}")
+                    break
+    print(f"{len(sources)} sources checked, {failures} differences")
+    return failures == 0
+
+LITERAL_VALUES = { '1_000': 1000, '12.2': 12.2, '1004.987654E12': 1004.987654e12, '1E3': 1000, '1e-3': None,
+                   '2#1010#E10': 10 << 10, '16#9Ac7#': 0x9ac7, '16#1.8#': 1.5, '8:17:': 15, '22#1#': None,
+                   'x"189AbDdF"': BitVector(bytes.fromhex("189abddf"), 32), 'b"1010"': BitVector(b"\xa0", 4),
+                   'O"0_7"': BitVector(b"\x1c", 6), '16#1.8#E400': math.inf, '1E100000000': None,
+                   '0E100000000': 0 }
+
+def literals_test(rom_digits=40000):
+    """Check the decoded values of literals, that each spelling is decoded once and that
+       both backends and the columns give the same Literals, and decode a ROM sized bit
+       string"""
+    import time
+    values = { spelling: intern_literal(spelling).value for spelling in LITERAL_VALUES }
+    ok = values == LITERAL_VALUES and intern_literal('1_000') is intern_literal('1_000')
+    data = " ".join(LITERAL_VALUES) + ' 16#FF#'
+    for backend in ('ply', 'scanner'):
+        stream = token_stream(data, backend)[0]
+        ok = ok and all(type(value) is Literal for ttype, value, lineno, lexpos in stream
+                        if ttype in ('DECLIT', 'BASEDLIT', 'BITSTRLIT'))
+        ok = ok and stream[-1][1].value == 255
+    # literals out of range leave the parse alone
+    from vhparse import VhdlParser
+    huge = "package p is constant c : REAL := 16#1.8#E400; constant d : INTEGER := 1E100000000; end package;"
+    for backend in ('ply', 'scanner'):
+        ctx = VhdlParser(backend=backend, std=True).parse(huge)
+        scope = ctx.designFile.units[0].scope
+        values = [ scope.find(name).ast.default.literal.value for name in ('c', 'd') ]
+        ok = ok and ctx.diag.count(ldiag.ERROR) == 0 and values == [ math.inf, None ]
+    columns = VhdlLexer(backend='scanner').tokenize(data.encode('utf-8'))
+    ok = ok and all(columns.value(ii) is intern_literal(columns.text(ii)) for ii in range(len(columns))
+                    if columns.kind(ii) in ('DECLIT', 'BASEDLIT', 'BITSTRLIT'))
+
+    rnd = random.Random(4)
+    digits = "".join(rnd.choice("0123456789abcdef") for ii in range(rom_digits))
+    rom = f'constant ROM : BIT_VECTOR := x"{digits}";'
+    start = time.perf_counter()
+    tokens = token_stream(rom, 'scanner')[0]
+    elapsed = time.perf_counter() - start
+    literal = [ value for ttype, value, lineno, lexpos in tokens if ttype == 'BITSTRLIT' ][0]
+    ok = ok and literal.value.data == bytes.fromhex(digits) and len(literal.value) == 4 * rom_digits and \
+        literal.value[3] == int(digits[0], 16) & 1 and str(literal) == f'x"{digits}"'
+    print(f"literals: {len(LITERAL_VALUES)} decoded, a {rom_digits} digit bit string lexed and decoded in "
+          f"{elapsed * 1000.0:.1f} ms, as expected: {ok}")
+    return ok
+
+def ident_source(nrefs, nnames, seed=1):
+    # nrefs references to nnames distinct identifiers, in mixed case
+    rnd = random.Random(seed)
+    names = [ f"sig_{ii}" for ii in range(nnames) ]
+    lines = []
+    for ii in range(0, nrefs, 10):
+        words = []
+        for jj in range(min(10, nrefs - ii)):
+            name = rnd.choice(names)
+            words.append(name.upper() if rnd.random() < 0.3 else name)
+        lines.append(" ".join(words))
+    return "\n".join(lines) + "\n", names
+
+def ident_scopes(names):
+    # root <- package (with 4 enum like public subscopes) <- subprogram interface
+    from lcommon import Scope, Symbol, SymbolTable
+    root = Scope(Symbol("_root"))
+    pkg = Scope(Symbol("pkg"), root)
+    subscopes = [ Scope(Symbol(f"enum_{ii}"), pkg) for ii in range(4) ]
+    pkg.addSubscopes(subscopes)
+    tables = [ root, pkg ] + subscopes
+    for ii, name in enumerate(names):
+        tables[ii % len(tables)].add(Symbol(name))
+    return SymbolTable(pkg)
+
+def idents_bench(nrefs=1000000, nnames=5000, backend='ply', runs=3, intern=True):
+    """Print the memory the token values of nrefs identifier references retain and the
+       Scope.search lookups per second of the values"""
+    import gc
+    import sys
+    import time
+    import tracemalloc
+    data, names = ident_source(nrefs, nnames)
+    # the values list holds 8 bytes per reference whatever the values are, the rest is
+    # the strings, Idents and intern tables the lexer made for the references.  The
+    # spellings of the names are made before tracing starts.
+    lexer = VhdlLexer(backend=backend, intern=intern).lexer
+    lexer.input(data)
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    values = [ tok.value for tok in lexer if tok.type == 'IDENT' ]
+    retained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    listed = sys.getsizeof(values)
+    mode = "interned" if intern else "plain strings"
+    print(f"{len(values)} identifier references to {nnames} names, {backend} lexer, {mode}")
+    print(f"token values retained: {retained / 1e6:8.2f} MB, {(retained - listed) / 1e6:8.2f} MB besides the list, "
+          f"{retained / len(values):6.1f} bytes/reference")
+
+    inner = ident_scopes(names)
+    best = None
+    for ii in range(runs):
+        search = inner.search
+        start = time.perf_counter()
+        for value in values:
+            search(value)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"Scope.search: {len(values) / best:12,.0f} lookups/s")
+
 if __name__ == '__main__':
     tokens_test(tokens_to_test())
     tokens_test(tokens_to_test2())
+    backends_diff_test()
+    columns_diff_test()
+    line_table_test()
+    literals_test()
@@ -0,0 +1,194 @@
+# analyzed library cache
+#
+# The design units of a library directory (the std library) are parsed once and
+# stored, with their Scope and Symbol tables, in a binary file next to the directory
+# (lib/vhdl/std -> lib/vhdl/std.vhlib).  Later runs load that file instead of
+# reparsing, as long as the library sources and the parser are unchanged.
+#
+# file layout:  MAGIC, header size (4 bytes little endian), json header, pickled AnalyzedLibrary
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import struct
+import sys
+import tempfile
+
+import lcommon
+import lsource
+import ltables
+import vhast
+from lcommon import symbol_key
+
+MAGIC = b"VHLIB\0"
+CACHE_FORMAT = 1
+CACHE_EXTENSION = ".vhlib"
+
+# the modules whose classes are pickled, a change to them invalidates the caches
+PICKLED_MODULES = (lcommon, lsource, vhast)
+# the modules of the lexer and parser, a change to the rule actions also invalidates them
+PARSER_MODULES = ('vhlex', 'vhparse')
+
+STD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib/vhdl/std")
+
+
+def parser_version():
+    """Fingerprint of everything that shapes an analyzed library: the lexer and parser
+       sources, the classes that are pickled and the cache format"""
+    from vhlex import VhdlLexer
+    from vhparse import VhdlParseContext
+    sha = hashlib.sha256()
+    sha.update(str(CACHE_FORMAT).encode())
+    sha.update(ltables.rules_fingerprint(VhdlLexer, 't_').encode())
+    sha.update(ltables.rules_fingerprint(VhdlParseContext, 'p_').encode())
+    for module in PICKLED_MODULES + tuple(sys.modules[name] for name in PARSER_MODULES):
+        with open(module.__file__, 'rb') as src:
+            sha.update(src.read())
+    return sha.hexdigest()[:16]
+
+def source_hash(paths):
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as src:
+            sha.update(hashlib.sha256(src.read()).digest())
+    return sha.hexdigest()
+
+def library_sources(libdir):
+    # the package standard first, everything else depends on it
+    paths = glob.glob(os.path.join(libdir, "*.vhd")) + glob.glob(os.path.join(libdir, "*.vhdl"))
+    return sorted(paths, key=lambda path: (os.path.basename(path).lower() != "standard.vhd", path))
+
+def cache_path(libdir):
+    return os.path.normpath(libdir) + CACHE_EXTENSION
+
+
+class AnalyzedLibrary():
+    """The design units of a library directory with their scopes, and the diagnostics
+       of the parse that produced them"""
+
+    def __init__(self, name, libdir, designFile, messages):
+        self.name = name
+        self.libdir = libdir
+        self.designFile = designFile
+        self.units = [ unit for unit in designFile.units if unit ]
+        self.messages = messages    # formatted diagnostics
+        self.loaded = False         # True when it came from the cache file
+
+    def __repr__(self):
+        names = ", ".join(str(unit.sym) for unit in self.units)
+        return f"AnalyzedLibrary(name={self.name}, units=[{names}], loaded={self.loaded})"
+
+    def unit(self, name):
+        key = symbol_key(name)
+        for unit in self.units:
+            if unit.sym.key == key:
+                return unit
+        return None
+
+
+def analyze(libdir, parser=None, name=None):
+    """Parse the sources of libdir into an AnalyzedLibrary"""
+    from vhparse import VhdlParser
+    parser = parser or VhdlParser(backend='scanner')
+    name = name or os.path.basename(os.path.normpath(libdir))
+    with lsource.SourceManager(library_sources(libdir)) as sources:
+        ctx = parser.parseSources(sources)
+        ctx.designFile.sources = None   # the mapped files are closed below
+        return AnalyzedLibrary(name, libdir, ctx.designFile, list(ctx.diag.formatted()))
+
+def read_header(path):
+    with open(path, 'rb') as src:
+        if src.read(len(MAGIC)) != MAGIC:
+            return None, None
+        size = struct.unpack('<I', src.read(4))[0]
+        header = json.loads(src.read(size).decode('utf-8'))
+        return header, src.read()
+
+def write_cache(path, header, library):
+    """Write the cache file atomically, returns False if it can't be written"""
+    data = json.dumps(header).encode('utf-8')
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=CACHE_EXTENSION)
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            dst.write(MAGIC)
+            dst.write(struct.pack('<I', len(data)))
+            dst.write(data)
+            pickle.dump(library, dst, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        os.remove(tmp)
+        return False
+
+def load_library(libdir, parser=None, name=None, cache=True):
+    """The AnalyzedLibrary of libdir, loaded from its cache file when the file is
+       current, otherwise parsed and written to the cache file"""
+    sources = library_sources(libdir)
+    header = { 'format': CACHE_FORMAT, 'parser': parser_version(), 'sources': source_hash(sources),
+               'name': name or os.path.basename(os.path.normpath(libdir)) }
+    path = cache_path(libdir)
+    if cache and os.path.exists(path):
+        try:
+            found, payload = read_header(path)
+            if found == header:
+                library = pickle.loads(payload)
+                library.loaded = True
+                return library
+        except Exception:
+            pass    # unreadable or stale, it is rebuilt
+
+    library = analyze(libdir, parser, header['name'])
+    if cache:
+        write_cache(path, header, library)
+    return library
+
+
+# benchmarks
+
+# a small user package that only needs the std library
+STD_USER_SOURCE = """
+library STD;
+use STD.standard.all;
+package user_pkg is
+    constant WIDTH : INTEGER := 8;
+    signal ready : BOOLEAN := FALSE;
+    type state is (IDLE, RUN);
+    function next_state(s : state) return state;
+end package user_pkg;
+"""
+
+def std_time(data, cached, runs=3):
+    """Best of runs seconds to analyze data with the std library: parsed from source
+       together with data, or loaded from its cache file"""
+    import time
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner')
+    stdData = ""
+    for path in library_sources(STD_DIR):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as src:
+            stdData += src.read()
+    load_library(STD_DIR, parser)     # make sure the cache file is current
+    best = None
+    for ii in range(runs):
+        start = time.perf_counter()
+        if cached:
+            parser.libraries = [ load_library(STD_DIR, parser) ]
+            parser.parse(data)
+        else:
+            parser.parse(stdData + data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def std_bench(data=STD_USER_SOURCE, runs=3):
+    """Print the analysis time of data with the std library from source and from its cache"""
+    source = std_time(data, False, runs)
+    cached = std_time(data, True, runs)
+    print(f"std from source: {source * 1000.0:8.1f} ms")
+    print(f"std from cache : {cached * 1000.0:8.1f} ms, {source / cached:.1f}x")
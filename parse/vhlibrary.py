@@ -0,0 +1,317 @@
+# logical vhdl libraries loaded on demand
+#
+# A LibraryManager maps logical library names to directories.  Each Library keeps an
+# index of its design units (unit name -> file, byte range and position) in a file next
+# to the directory (lib/vhdl/std -> lib/vhdl/std.vhidx), and reads and parses a unit
+# only when a use clause or a selected name first refers to it.  A library costs an
+# index lookup until one of its units is used.
+#
+# index file:  json { format, files: { relative path: { size, mtime, units } } }, each
+# unit is [ kind, name, start, end, line, column ], start and end are byte offsets
+
+import json
+import os
+import tempfile
+import threading
+
+from lcommon import symbol_key
+from lsource import LineTable
+
+INDEX_FORMAT = 1
+INDEX_EXTENSION = ".vhidx"
+
+# the units a use clause can name
+PRIMARY_KINDS = ('package', 'entity', 'configuration')
+
+
+def index_path(libdir):
+    return os.path.normpath(libdir) + INDEX_EXTENSION
+
+def index_file(lexer, path):
+    """The index entries of the design units of a file"""
+    import vhunits
+    with open(path, 'rb') as src:
+        data = src.read()
+    columns = lexer.tokenize(data)
+    entries = []
+    for span in vhunits.split_units(columns):
+        kind, name = vhunits.unit_header(columns, span)
+        if name:
+            entries.append([ kind, str(name), span.start, span.end, span.line, span.column ])
+    return entries
+
+def read_index(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as src:
+            stored = json.load(src)
+        if stored.get('format') == INDEX_FORMAT:
+            return stored['files']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass    # missing or unreadable, it is rebuilt
+    return {}
+
+def write_index(path, files):
+    """Write the index atomically, returns False if it can't be written"""
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=INDEX_EXTENSION)
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as dst:
+            json.dump({ 'format': INDEX_FORMAT, 'files': files }, dst)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        os.remove(tmp)
+        return False
+
+
+class Library():
+    """A logical library: the design units of a directory, each parsed the first time
+       it is asked for"""
+
+    def __init__(self, manager, name, libdir):
+        self.manager = manager
+        self.name = name
+        self.libdir = libdir
+        self.index = None       # unit key -> (path, index entry), read on first use
+        self.units = {}         # unit key -> the parsed unit, None if it isn't in the library
+        self.loading = set()    # the units being parsed, a unit that uses itself gets None
+
+    def __repr__(self):
+        return f"Library(name={self.name}, libdir={self.libdir}, loaded={sorted(self.units)})"
+
+    def __reduce__(self):
+        # the design files of a parse refer to the libraries it sees, a library pickles as
+        # its name and directory, detached from its manager and the units it loaded
+        return (Library, (None, self.name, self.libdir))
+
+    def unitNames(self):
+        return sorted(self.indexed())
+
+    def unit(self, name):
+        """The primary unit name, parsed the first time it is asked for, None if the
+           library doesn't have it"""
+        key = symbol_key(name)
+        if key in self.units or self.manager is None:
+            return self.units.get(key)
+        with self.manager.lock:
+            if key in self.units:
+                return self.units[key]
+            if key in self.loading:
+                return None
+            entry = self.indexed().get(key)
+            if entry is None:
+                self.units[key] = None
+                return None
+            self.loading.add(key)
+            try:
+                unit = self.manager.parseUnit(self, key, *entry)
+            finally:
+                self.loading.discard(key)
+            self.units[key] = unit
+            return unit
+
+    def indexed(self):
+        if self.index is None:
+            self.index = self.buildIndex()
+        return self.index
+
+    def buildIndex(self):
+        """Read the index file, index the files that are new or changed since it was
+           written, and write it back if anything changed"""
+        import vhanalyze
+        path = index_path(self.libdir)
+        stored = read_index(path)
+        files = {}
+        for source in vhanalyze.library_files([ self.libdir ]):
+            rel = os.path.relpath(source, self.libdir)
+            stat = os.stat(source)
+            info = stored.get(rel)
+            if not info or info.get('size') != stat.st_size or info.get('mtime') != stat.st_mtime_ns:
+                info = { 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                         'units': index_file(self.manager.lexer(), source) }
+            files[rel] = info
+        if files != stored:
+            write_index(path, files)
+
+        index = {}
+        for rel, info in sorted(files.items()):
+            for entry in info['units']:
+                if entry[0] in PRIMARY_KINDS:
+                    index.setdefault(symbol_key(entry[1]), (os.path.join(self.libdir, rel), entry))
+        return index
+
+
+class WorkLibrary():
+    """'work' in the units of a library, the library itself"""
+
+    def __init__(self, library):
+        self.name = "work"
+        self.library = library
+
+    def unit(self, name):
+        return self.library.unit(name)
+
+
+class LibraryManager():
+    """Maps logical library names to directories.  The Library of each name loads its
+       design units when they are first used, parsed by a VhdlParser which sees all
+       the libraries of the manager (and 'work', the library of the unit).  std maps
+       to lib/vhdl/std unless mapping maps it elsewhere.  The libraries can be used
+       from any number of parses and threads, loading is serialized by one lock."""
+
+    def __init__(self, mapping=None, backend='scanner', cache=True):
+        import vhlibcache
+        self.backend = backend
+        self.cache = cache
+        self.lock = threading.RLock()
+        self.libraries = {}     # name key -> Library
+        self.parsers = {}       # name key -> the VhdlParser for the units of the library
+        self.tokenizer = None
+        self.messages = []      # the formatted diagnostics of the loaded units
+        self.map('std', vhlibcache.STD_DIR)
+        for name, libdir in (mapping or {}).items():
+            self.map(name, libdir)
+
+    def __iter__(self):
+        return iter(self.libraries.values())
+
+    def map(self, name, libdir):
+        library = Library(self, name, libdir)
+        self.libraries[symbol_key(name)] = library
+        return library
+
+    def library(self, name):
+        return self.libraries.get(symbol_key(name))
+
+    def lexer(self):
+        if self.tokenizer is None:
+            from vhlex import VhdlLexer
+            self.tokenizer = VhdlLexer(cache=self.cache, backend='scanner')
+        return self.tokenizer
+
+    def parser(self, library):
+        key = symbol_key(library.name)
+        parser = self.parsers.get(key)
+        if parser is None:
+            from vhparse import VhdlParser
+            parser = VhdlParser(cache=self.cache, backend=self.backend,
+                                libraries=[ WorkLibrary(library) ] + list(self))
+            self.parsers[key] = parser
+        return parser
+
+    def parseUnit(self, library, key, path, entry):
+        """Parse the design unit of an index entry, with its context clause"""
+        kind, name, start, end, line, column = entry
+        with open(path, 'rb') as src:
+            src.seek(start)
+            data = src.read(end - start)
+        text = data.decode('utf-8', errors='ignore')
+        ctx = self.parser(library).parse(text, path=path, lines=LineTable(text, path, (line, column)))
+        self.messages.extend(ctx.diag.formatted())
+        units = ctx.designFile.units if isinstance(ctx.designFile.units, list) else []
+        for unit in units:
+            if unit and unit.sym.key == key:
+                return unit
+        return None
+
+
+# tests
+
+USER_SOURCE = """
+library vendor;
+use vendor.pkg7.all;
+use std.textio.all;
+package user is
+    constant X : INTEGER := C7;
+    constant Z : INTEGER := D7;
+    variable L : LINE;
+    constant Y : INTEGER := MISSING;
+end package user;
+use vendor.nosuch.all;
+package other is end package other;
+"""
+
+def vendor_library(libdir, nfiles, npackages):
+    """A library of nfiles files of npackages packages each, package pkg<n> uses
+       package pkg<n/2> of its own library"""
+    os.makedirs(libdir, exist_ok=True)
+    for ff in range(nfiles):
+        text = ""
+        for ii in range(ff * npackages, (ff + 1) * npackages):
+            if ii:
+                text += f"use work.pkg{ii // 2}.all;\n"
+            text += f"package pkg{ii} is\n    constant C{ii} : INTEGER := {ii};\n"
+            text += f"    constant D{ii} : INTEGER := {ii};\n"
+            text += f"    function f{ii}(x : INTEGER) return INTEGER;\nend package pkg{ii};\n\n"
+        with open(os.path.join(libdir, f"vendor{ff}.vhd"), 'w') as dst:
+            dst.write(text)
+
+def library_test():
+    """Parse USER_SOURCE against a vendor library and check that only the packages it
+       uses, and the ones they use in turn, are loaded, and that their declarations are
+       visible"""
+    import shutil
+    from vhparse import VhdlParser
+    libdir = tempfile.mkdtemp(suffix="vendor")
+    try:
+        vendor_library(libdir, 4, 5)
+        ok = True
+        for run in ("index", "indexed"):
+            manager = LibraryManager({ 'vendor': libdir })
+            parser = VhdlParser(backend='scanner', libraries=list(manager))
+            ctx = parser.parse(USER_SOURCE, path="user.vhd")
+            missing = [ str(record.args[0]) for record in ctx.diag ]
+            loaded = sorted(key for key, unit in manager.library('vendor').units.items() if unit)
+            std = sorted(manager.library('std').units)
+            print(f"{run}: loaded vendor {loaded}, std {std}, diagnostics {missing}")
+            ok = (ok and loaded == [ 'pkg0', 'pkg1', 'pkg3', 'pkg7' ] and std == [ 'standard', 'textio' ]
+                  and missing == [ 'MISSING', 'nosuch' ] and not manager.messages)
+        ok = ok and os.path.exists(index_path(libdir))
+    finally:
+        shutil.rmtree(libdir)
+        if os.path.exists(index_path(libdir)):
+            os.remove(index_path(libdir))
+    return ok
+
+def library_bench(nfiles=20, npackages=100):
+    """Print the time to parse a whole vendor_library() with a user package against
+       loading the units the package uses, building the index and with the index on disk"""
+    import glob
+    import shutil
+    import time
+    from vhparse import VhdlParser
+    libdir = tempfile.mkdtemp(suffix="vendor")
+    try:
+        vendor_library(libdir, nfiles, npackages)
+        used = nfiles * npackages - 1
+        user = (f"library vendor;\nuse vendor.pkg{used}.all;\n"
+                f"package user is\n    constant X : INTEGER := C{used};\nend package user;\n")
+        sources = sorted(glob.glob(os.path.join(libdir, "*.vhd")))
+        print(f"library of {nfiles * npackages} packages, "
+              f"{sum(os.path.getsize(path) for path in sources) / 1024:.0f} KB")
+        data = ""
+        for path in sources:
+            with open(path, 'r') as src:
+                data += src.read()
+
+        parser = VhdlParser(backend='scanner')
+        start = time.perf_counter()
+        parser.parse(data + user)
+        print(f"parse the library with the source: {(time.perf_counter() - start) * 1000.0:8.1f} ms")
+
+        for run in ("build the index", "index on disk"):
+            start = time.perf_counter()
+            manager = LibraryManager({ 'vendor': libdir })
+            VhdlParser(backend='scanner', libraries=list(manager)).parse(user)
+            loaded = sum(1 for unit in manager.library('vendor').units.values() if unit)
+            print(f"{run + ', load on use:':34} {(time.perf_counter() - start) * 1000.0:8.1f} ms, "
+                  f"{loaded} packages loaded")
+    finally:
+        shutil.rmtree(libdir)
+        if os.path.exists(index_path(libdir)):
+            os.remove(index_path(libdir))
+
+if __name__ == "__main__":
+    library_test()
@@ -1,29 +1,44 @@
 # vhdl parser
 
+import concurrent.futures
+import copy
+import threading
+
 import ply.lex as lex
 import ply.yacc as yacc
-from vhlex import VhdlLexer
+import ltables
+import vhdiag
+import vhlibcache
+import vhtokens
+import vhunits
+from ldiag import DiagnosticSink
+from lsource import LineTable, LocationTable, SourceLexer, SourceManager
+from vhlex import VhdlLexer, VhdlScanner
 
 # import all ast classes
 from lcommon import *
 from vhast import * 
 
-class VhdlParser():
+class VhdlParseContext():
+    """The state of one parse: the scopes, the design file and the diagnostics.  The
+       production rules run as methods of the context, VhdlParser binds a copy of the
+       shared LALR parser to a new context for each parse."""
 
-    instance = None
+    tokens = vhtokens.vh_tokens + tuple(vhtokens.vh2000_reserved.values())
 
-    def getVhdlParser():
-        if VhdlParser.instance:
-            return VhdlParser.instance
-        VhdlParser.instance = VhdlParser()
-        return VhdlParser.instance
+    def __init__(self, diag=None, libraries=(), scope=None):
+        # libraries are the libraries visible to the parse, an AnalyzedLibrary (vhlibcache)
+        # or a vhlibrary.Library.  scope is the root scope of an earlier parse to add the
+        # design units to (vhunits), it already has the keywords and the libraries.
+        self.diag = diag if diag is not None else DiagnosticSink(vhdiag.vh_messages)
+        self.error = 0
+        self.pendingUses = []   # scopes the context clause makes visible to the next unit
+        self.locations = LocationTable()    # the locations of the symbols of the parse
 
-    def __init__(self):
-        # check singleton
-        if self.instance:
-            raise Exception("Singleton violation: VhdlParser")
-        # set singleton
-        self.instance = self
+        if scope is not None:
+            self.rootScope = self.curScope = scope
+            self.designFile = vhDesignFile(scope)
+            return
 
         self.rootScope = Scope(Symbol("_root"))
         self.curScope = self.rootScope
@@ -38,15 +53,31 @@ class VhdlParser():
         self.designFile = vhDesignFile(self.curScope)
         self.curScope.name.ast = self.designFile
 
-        self.lexer = VhdlLexer()
-        self.tokens = self.lexer.tokens
-        self.parser = yacc.yacc(module=self, debug=True)
+        for library in libraries:
+            self.addLibrary(library)
 
-        self.error = 0
+    def addLibrary(self, library):
+        # the library name is visible, and for STD the declarations of package standard
+        # (every design unit implicitly uses STD.standard.all).  The library is shared
+        # with other parses and isn't changed.
+        if self.rootScope.find(library.name):
+            return      # std from an AnalyzedLibrary and from a vhlibrary.Library
+        sym = Symbol(library.name)
+        sym.ast = library
+        self.rootScope.add(sym)
+        standard = library.unit('standard') if sym.key == 'std' else None
+        if standard:
+            self.rootScope.addSubscopes([ standard.scope ] + standard.scope.public_subscopes)
+
+    # the symbol lookups of the rules in the current scope, a profiled parse times them
+    def find(self, name):
+        return self.curScope.find(name)
+
+    def search(self, name):
+        return self.curScope.search(name)
 
-    def __del__(self):
-        VhdlParser.instance = None
-        del self.lexer
+    def pget(self, p, idx):
+        return self.curScope.pget(p, idx)
 
     def p_design_file_1(self, p):
         "design_file                    : design_units"
@@ -119,6 +150,8 @@ class VhdlParser():
         "start_package_decl             : IS"
         p[0] = vhPackageDecl(p[-1], self.curScope)     # creates a scope
         self.curScope = p[0].scope
+        self.curScope.use(self.pendingUses)
+        self.pendingUses = []
         self.curScope.name.ast = p[0]
 
     def p_end_package_decl_1(self, p):
@@ -135,8 +168,6 @@ class VhdlParser():
         #todo check the package simple name against the name of the package
         p[0] = None
 
-        p[0] = p[2]
-
     def p_end_scope(self, p):
         "end_scope                      : END"
         if self.curScope.outer:
@@ -196,7 +227,13 @@ class VhdlParser():
         p[0] = []
         for selected in p[2]:
             use = vhUse(selected)
+            use.setLoc(p, 1)
             p[0].append(use)       
+            scopes = self.useScopes(use)
+            if self.curScope is self.rootScope:
+                self.pendingUses.extend(scopes)     # a context clause, for the unit after it
+            else:
+                self.curScope.use(scopes)
 
     def p_selected_names_1(self, p):
         "selected_names                 : selected_names ',' selected_name "
@@ -245,17 +282,17 @@ class VhdlParser():
         p[0] = vhSubtypeDecl(p[2], p[4])
 
     def p_const_decl(self, p):
-        "const_decl                     : CONSTANT symbols ':' subtype_indication opt_assign_rhs SEMI"
-        p[0] = [ p[1], p[2], p[4], p[5] ]
+        "const_decl                     : CONSTANT symbols ':' subtype_indication opt_vassign_rhs SEMI"
+        p[0] = vhObjectDecl(p[1], p[2], p[4], p[5])
 
     def p_signal_decl(self, p):
         "signal_decl                    : SIGNAL symbols ':' subtype_indication opt_sig_kind_kw opt_vassign_rhs SEMI"
-        p[0] = [ p[1], p[2], p[4], p[5], p[6] ]
+        p[0] = vhObjectDecl(p[1], p[2], p[4], p[6], kind=p[5])
 
     def p_var_decl(self, p):
         "var_decl                       : var_decl_start subtype_indication opt_vassign_rhs SEMI"
-        p[0] = p[1]
-        p[0].extend( [ p[2], p[3] ] )
+        obj_class, shared, syms = p[1]
+        p[0] = vhObjectDecl(obj_class, syms, p[2], p[3], shared=shared)
 
     def p_var_decl_start_1(self, p):
         "var_decl_start                 : VARIABLE symbols ':'"
@@ -267,7 +304,7 @@ class VhdlParser():
 
     def p_file_decl(self, p):
         "file_decl                      : FILE symbols ':' subtype_indication file_open_info SEMI"
-        p[0] = [ p[1], p[2], p[4], p[5] ]
+        p[0] = vhObjectDecl(p[1], p[2], p[4], open_info=p[5])
 
     def p_alias_decl(self, p):
         "alias_decl                     : alias_decl_start name signature SEMI"
@@ -510,10 +547,10 @@ class VhdlParser():
         p[0] = p[1]
 
     def p_opt_vassign_rhs_1(self, p):
-        "opt_assign_rhs                 : VASSIGN expr"
+        "opt_vassign_rhs                : VASSIGN expr"
         p[0] = p[2]
 
-    def p_opt_vassign_rhs(sefl, p):
+    def p_opt_vassign_rhs(self, p):
         "opt_vassign_rhs                : empty"
         p[0] = p[1]
     
@@ -571,7 +608,8 @@ class VhdlParser():
         #todo check end name vs type name
         p[0] = p[1]
         p[0].addElements(p[2])
-        p[0].setName(p[3])
+        if p[3]:
+            p[0].setName(p[3])
 
     def p_protected_type_decl(self, p):
         "protected_type_decl            : start_protected protected_type_list end_protected"
@@ -598,7 +636,7 @@ class VhdlParser():
 
     def p_protected_body(self, p):
         "start_protected_body           : PROTECTED BODY"
-        p[0] = self.curScope.search(p[-2].name)
+        p[0] = self.search(p[-2].name)
         if p[0]:
             self.curScope = p[0].scope
         #todo raise error protected type symbols is not found, continue
@@ -728,7 +766,7 @@ class VhdlParser():
 
     def p_enum_lit_decl_2(self, p):
         "enum_lit_decl                  : CHARLIT"
-        p[0] = self.curScope.pget(p, 1)
+        p[0] = self.pget(p, 1)
 
     #these two handle integer, real, and physical ranges
     def p_constrained_type_def_1(self, p):
@@ -868,13 +906,21 @@ class VhdlParser():
 
     def p_symbol(self, p):    # simple_name for declarations
         "symbol                         : IDENT"
-        p[0] = self.curScope.find(p[1])     # search the local scope
-        if p[0]:        
-            print(f"Symbol '{p[0].name}' already exists in {self.curScope.name}, continuing..")
-            return
-
-        p[0] = Symbol(p[1])
-        self.curScope.add(p[0])
+        p[0] = self.declare(p, 1)
+
+    def declare(self, p, idx, overloadable=False):
+        # the Symbol declared by the token idx in the current scope.  A name declared
+        # there already is reported, unless it is overloadable and has an overload set.
+        sym = self.find(p[idx])     # search the local scope
+        if sym:
+            overloads = self.curScope.overloads
+            if not overloadable or not overloads or sym.key not in overloads:
+                self.diag.report(vhdiag.SYMBOL_EXISTS, p.lexpos(idx), line_table(p, idx), sym.name, self.curScope.name)
+            return sym
+
+        sym = Symbol(p[idx])
+        self.curScope.add(sym)
+        return sym
 
     def p_symbols_1(self, p):
         "symbols                        : symbols ',' symbol"
@@ -887,34 +933,30 @@ class VhdlParser():
 
     def p_simple_name(self, p):   # for references
         "simple_name                    : IDENT"
-        syms = self.curScope.search(p[1])   # search all the Scope in the current stack
+        syms = self.search(p[1])   # search all the Scope in the current stack
         if not syms:
-            p[0] = self.curScope.pget(p, 1)
-            print(f"Symbol '{p[0]}' at line {p[0].loc.sline}(column {p[0].loc.scol}) " +
-                  "not found, creating and continuing.. ")
+            p[0] = self.pget(p, 1)
+            self.diag.report(vhdiag.SYMBOL_NOT_FOUND, p.lexpos(1), line_table(p, 1), p[0])
             return
     
         if len(syms) > 1:
             p[0] = syms[0]
-            print(f"Ambiguous Symbol '{p[1]}' at line {p.lineno(1)}(column {start_column(p, 1)}), " +
-                  "using the Symbol from the nearest scope.  This will error during semantic analysis.")
+            self.diag.report(vhdiag.SYMBOL_AMBIGUOUS, p.lexpos(1), line_table(p, 1), p[1])
             return
     
         p[0] = syms[0]      # if we get here there is only 1 symbol in tuple, return it
 
     def p_operator_string(self, p):
         "operator_string                : STRLIT"
-        syms = self.curScope.search(p[1])
+        syms = self.search(p[1])
         if not syms:
-            p[0] = self.curScope.pget(p, 1)
-            print(f"Symbol '{p[0]}' at line {p[0].loc.sline}(column {p[0].loc.scol}) " +
-                  "not found, creating and continuing.. ")
+            p[0] = self.pget(p, 1)
+            self.diag.report(vhdiag.SYMBOL_NOT_FOUND, p.lexpos(1), line_table(p, 1), p[0])
             return
     
         if len(syms) > 1:
             p[0] = syms[0]
-            print(f"Ambiguous Symbol '{p[1]}' at line {p[0].loc.sline}(column {p[0].loc.scol}), " +
-                  "using the Symbol from the nearest scope.  This will error during semantic analysis.")
+            self.diag.report(vhdiag.SYMBOL_AMBIGUOUS, p.lexpos(1), line_table(p, 1), p[1])
             return
     
         p[0] = syms[0]      # if we get here there is only 1 symbol in tuple, return it
@@ -922,13 +964,7 @@ class VhdlParser():
 
     def p_operator_symbol(self, p):
         "operator_symbol                : STRLIT"
-        p[0] = self.curScope.find(p[1])
-        if p[0]:
-            print(f"Symbol '{p[0].name}' already exists in {self.curScope.name}, continuing..")
-            return
-        
-        p[0] = Symbol(p[1])
-        self.curScope.add(p[0])
+        p[0] = self.declare(p, 1)
 
     def p_selected_name(self, p):
         "selected_name                  : prefix suffix"
@@ -936,6 +972,8 @@ class VhdlParser():
         p[0] = []
         p[0].append(p[1])
         p[0].append(p[2])
+        if isinstance(p[1], Symbol) and p[1].ast is not None and hasattr(p[1].ast, 'unit'):
+            p[1].ast.unit(p[2])     # library.unit, a lazy library loads the unit on first reference
         #todo, revert the curScope
 
     def p_prefix(self, p):
@@ -968,7 +1006,7 @@ class VhdlParser():
     def p_logicals_1(self, p):
         "logicals                      : logicals logical_op relation"
         p[0] = p[1]
-        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.precedence.get(p[2], -1):
+        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.level(p[2]):
             p[0] = vhBinaryExpr(p[1])
         p[0].addOperand(p[2], p[3])
 
@@ -1019,18 +1057,14 @@ class VhdlParser():
                                         | ROR"""
         p[0] = p[1]
 
-    def p_simple_expr_1(self, p):
-        "simple_expr                    : MINUS adding_exprs"
-        p[0] = vhUnaryExpr(p[1], p[2])
-
-    def p_simple_expr_2(self, p):
+    def p_simple_expr(self, p):
         "simple_expr                    : adding_exprs"
         p[0] = p[1]
     
     def p_adding_exprs_1(sefl, p):
         "adding_exprs                   : adding_exprs adding_op term"
         p[0] = p[1]
-        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.precedence.get(p[2], -1):
+        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.level(p[2]):
             p[0] = vhBinaryExpr(p[1])
         p[0].addOperand(p[2], p[3])
 
@@ -1038,6 +1072,12 @@ class VhdlParser():
         "adding_exprs                   : term"
         p[0] = p[1]
 
+    def p_adding_exprs_3(self, p):
+        """adding_exprs                 : MINUS term
+                                        | '+' term"""
+        # the sign applies to the first term, -a + b is (-a) + b
+        p[0] = vhUnaryExpr(p[1], p[2])
+
     def p_adding_op(self, p):
         """adding_op                    : '+'
                                         | MINUS
@@ -1051,7 +1091,7 @@ class VhdlParser():
     def p_multiplying_exprs_1(self, p):
         "multiplying_exprs              : multiplying_exprs multiplying_op factor"
         p[0] = p[1]
-        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.precedence.get(p[2], -1):
+        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.level(p[2]):
             p[0] = vhBinaryExpr(p[1])
         p[0].addOperand(p[2], p[3])
 
@@ -1074,7 +1114,7 @@ class VhdlParser():
     def p_exponent_exprs_1(self, p):
         "exponent_exprs                 : exponent_exprs EXP primary"
         p[0] = p[1]
-        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != VhBinaryExpr.precedence.get(p[2], -1):
+        if type(p[1]) is not vhBinaryExpr or p[1].precedence_level != vhBinaryExpr.level(p[2]):
             p[0] = vhBinaryExpr(p[1])
         p[0].addOperand(p[2], p[3])
 
@@ -1126,7 +1166,8 @@ class VhdlParser():
 
     def p_aggregate(self, p):
         "aggregate                      : '(' aggregate_elements ')'"
-        p[0] = p[1]
+        # one positional element is a parenthesized expression
+        p[0] = p[2][0] if len(p[2]) == 1 and not isinstance(p[2][0], list) else p[2]
 
     def p_qualified(self, p):
         "qualified                      : name_tick aggregate"
@@ -1241,6 +1282,9 @@ class VhdlParser():
     def p_subprogram_decl_1(self, p):
         "subprogram_decl                : subprogram_decl_start SEMI"
         p[0] = p[1]
+        if self.curScope.outer:
+            self.curScope = self.curScope.outer
+        self.addOverload(p, p[0], 2)
 
     def p_subprogram_decl_2(self, p):
         "subprogram_decl               : subprogram_decl_start subprogram_interface SEMI"
@@ -1250,6 +1294,14 @@ class VhdlParser():
             p[0].setReturnType(p[2][1])
         if self.curScope.outer:
             self.curScope = self.curScope.outer
+        self.addOverload(p, p[0], 3)
+
+    def addOverload(self, p, decl, idx):
+        # the declaring scope is the outer one of the interface, a homograph is reported
+        # at the token idx
+        scope = decl.ifc_symbols.outer
+        if scope is not None and scope.overload(decl) is not None:
+            self.diag.report(vhdiag.SYMBOL_EXISTS, p.lexpos(idx), line_table(p, idx), decl.name, scope.name)
 
     def p_subprogram_interface_1(self, p):
         "subprogram_interface           : formal_parameter_list return_type"
@@ -1291,9 +1343,11 @@ class VhdlParser():
         p[0] = p[1]
     
     def p_designator(self, p):
-        """designator_symbol            : symbol
-                                        | operator_symbol"""
-        p[0] = p[1]
+        """designator_symbol            : IDENT
+                                        | STRLIT"""
+        # the symbol and operator_symbol rules, but a subprogram name may be declared
+        # again with another signature, an overload
+        p[0] = self.declare(p, 1, overloadable=True)
    
     def p_subprogram_body(self, p):
         "subprogram_body                : FUNCTION IS SEMI"
@@ -1321,31 +1375,320 @@ class VhdlParser():
 
     def p_error(self, t):
         if not t:
-            print("There was a syntax error at the end of the file")
+            self.diag.report(vhdiag.SYNTAX_ERROR_EOF)
             return
-        print(f"there was an error with '{t.value}' at {t.lineno}")
+        self.diag.report(vhdiag.SYNTAX_ERROR, t.lexpos, token_line_table(t.lexer, t), t.value)
 
 # end of production rules
 
-    def parse(self, data):
-        self.parser.parse(data, lexer=self.lexer.lexer)
+    def useScopes(self, use):
+        """The scopes a use clause of a library unit makes visible: the scope of the unit
+           for lib.unit.all, a scope with only the item for lib.unit.item"""
+        names = use.names()
+        lib = self.rootScope.find(names[0]) if len(names) > 2 else None
+        if lib is None or not hasattr(lib.ast, 'unit'):
+            return []
+        unit = lib.ast.unit(names[1])
+        if unit is None:
+            loc = use.loc
+            self.diag.report(vhdiag.UNIT_NOT_FOUND, loc.spos, loc.lineTable, names[1], lib.name)
+            return []
+        if names[2] == 'all':
+            return [ unit.scope ] + unit.scope.public_subscopes
+        sym = unit.scope.find(names[2])
+        if sym is None:
+            return []
+        scope = Scope(unit.sym)
+        scope.add(sym)
+        return [ scope ]
 
     def popScope(self):
         if not self.curScope.outer:
             raise 
 
 
-def parser_test():
-    with open("../lib/vhdl/std/standard.vhd", 'r', encoding='utf-8', errors='ignore') as parse_std:
-        parse_str = parse_std.read()
-
-    with open("../lib/vhdl/std/textio.vhd", 'r', encoding='utf-8', errors='ignore') as parse_txtio:
-        parse_str += parse_txtio.read()
+class VhdlParser():
+    """Parses vhdl sources.  The lexer rules and the LALR tables are built once per
+       process and are read-only after that.  Every parse gets its own lexer and a
+       VhdlParseContext, so a VhdlParser can run many parses at once, from any
+       number of threads.  The parse methods return the context of the parse."""
+
+    tableLock = threading.Lock()
+    tables = {}         # (cache, tabdir) -> the shared ply LRParser
+
+    def __init__(self, cache=True, tabdir=None, debug=False, backend='ply', std=False, libraries=(), profile=None):
+        # cache=True loads the LALR tables from a generated table module which is rebuilt only
+        # when the grammar changes.  debug=True writes parser.out and reports grammar warnings.
+        # backend selects the VhdlLexer engine: 'ply' or the hand written 'scanner'.
+        # std=True makes the STD library visible to every parse, loaded from its analyzed
+        # library cache (std may also be the library directory or an AnalyzedLibrary).
+        # libraries are more libraries visible to every parse, like the vhlibrary.Library
+        # of a LibraryManager which load their units when a use clause names them.
+        self.libraries = []
+        if std:
+            if not isinstance(std, vhlibcache.AnalyzedLibrary):
+                std = vhlibcache.load_library(vhlibcache.STD_DIR if std is True else std, cache=cache)
+            self.libraries.append(std)
+        self.libraries.extend(libraries)
+        # profile is a vhprofile.ParseProfile that counts and times the rules, tokens and
+        # phases of every parse, without one nothing is wrapped
+        self.profile = profile
+        self.lexer = VhdlLexer(cache=cache, tabdir=tabdir, backend=backend)
+        self.tokens = self.lexer.tokens
+        with VhdlParser.tableLock:
+            key = (cache, tabdir)
+            if debug or key not in VhdlParser.tables:
+                VhdlParser.tables[key] = self.buildParser(cache, tabdir, debug)
+            self.parser = VhdlParser.tables[key]
+        self.spare = threading.local()  # a bound parser per thread, reused by the next parse
+
+    def buildParser(self, cache, tabdir, debug):
+        errorlog = None if debug else yacc.NullLogger()
+        module = VhdlParseContext()     # only provides the rules, the parses bind their own context
+        if not cache:
+            return yacc.yacc(module=module, debug=debug, write_tables=False, errorlog=errorlog)
+
+        fingerprint = ltables.rules_fingerprint(module, 'p_')
+        name = ltables.table_name('vhparsetab', fingerprint)
+        tabmodule = ltables.load_table(name, tabdir)
+        if tabmodule:
+            # the fingerprint guarantees the tables match the grammar, skip ply's validation
+            return yacc.yacc(module=module, debug=False, optimize=True, tabmodule=tabmodule,
+                             outputdir=tabdir or ltables.TABLE_DIR, errorlog=errorlog)
+
+        tabdir = ltables.prepare_dir('vhparsetab', name, tabdir)
+        return yacc.yacc(module=module, debug=debug, tabmodule=name, outputdir=tabdir, errorlog=errorlog)
+
+    def bind(self, ctx):
+        """A copy of the shared LRParser that runs the production rules of ctx.  ply keeps
+           the parse stacks in the LRParser, the copy shares only the read-only tables.
+           The copy of the last finished parse of the thread is rebound rather than copying
+           the productions again, which matters when many small units are parsed."""
+        parser = getattr(self.spare, 'parser', None)
+        if parser is None:
+            parser = copy.copy(self.parser)
+            parser.productions = [ yacc.MiniProduction(prod.str, prod.name, prod.len, prod.func, prod.file, prod.line)
+                                   for prod in self.parser.productions ]
+        else:
+            self.spare.parser = None    # a parse started from a rule action gets its own
+        for bound in parser.productions:
+            if bound.func:
+                bound.callable = getattr(ctx, bound.func)
+                if self.profile:
+                    bound.callable = self.profile.production(bound.func, bound.callable)
+        if self.profile:
+            self.profile.lookups(ctx)
+        parser.errorfunc = ctx.p_error
+        return parser
+
+    def run(self, ctx, lexer):
+        parser = self.bind(ctx)
+        lexer.locations = ctx.locations     # where Located.setLoc() adds the locations
+        if self.profile:
+            with self.profile.parsing():
+                parser.parse(lexer=self.profile.lexer(lexer))
+        else:
+            parser.parse(lexer=lexer)
+        parser.errorfunc = None         # don't keep the context alive
+        for bound in parser.productions:
+            bound.callable = None
+        self.spare.parser = parser
+
+    def parse(self, data, diag=None, path=None, lines=None, scope=None):
+        # data is str, or bytes-like which the scanner lexes in place and the ply backend
+        # gets decoded like parseSources.  path is the file data was read from, for the
+        # design file and the diagnostics.  lines is the LineTable of data when data is a
+        # part of a larger source, scope a root scope to parse into (see VhdlParseContext).
+        ctx = VhdlParseContext(diag, self.libraries, scope)
+        ctx.designFile.filepath = path or ""
+        lexer = self.lexer.clone(ctx.diag)
+        if not isinstance(data, str) and not isinstance(lexer, VhdlScanner):
+            data = bytes(data).decode('utf-8', errors='ignore')
+        lexer.input(data)
+        lexer.lineTable = lines if lines is not None else LineTable(data, path)
+        self.run(ctx, lexer=lexer)
+        return ctx
+
+    def parseUnits(self, data, diag=None, path=None, window=1 << 20):
+        """Parse data one design unit at a time and yield (unit, UnitSpan) as soon as the
+           unit is parsed, the span gives its offsets, line and column in data.  Each unit
+           is parsed on its own, like a unit analyzed into a library: it sees the libraries
+           but not the units before it, and nothing of its parse is kept once it is
+           yielded.  diag collects the diagnostics of all the units."""
+        return vhunits.stream_units(self, data, diag, path, window)
+
+    def parseSources(self, sources, diag=None):
+        """Parse all the files of a SourceManager as one design file.  The scanner
+           backend lexes the mapped files in place, the ply backend gets decoded text."""
+        ctx = VhdlParseContext(diag, self.libraries)
+        ctx.designFile.sources = sources
+        lexer = self.lexer.clone(ctx.diag)
+        self.run(ctx, lexer=SourceLexer(lexer, sources, inplace=isinstance(lexer, VhdlScanner)))
+        return ctx
+
+    def parseColumns(self, columns, diag=None):
+        """Parse the tokens of a TokenColumns (VhdlLexer.tokenize()), the columns can
+           be shared with other consumers"""
+        ctx = VhdlParseContext(diag, self.libraries)
+        self.run(ctx, lexer=columns.lexer())
+        return ctx
+
+
+STD_SOURCES = [ "../lib/vhdl/std/standard.vhd", "../lib/vhdl/std/textio.vhd" ]
 
-    parser = VhdlParser.getVhdlParser()
-    parser.parse(parse_str)
+def parser_test():
+    with SourceManager(STD_SOURCES) as sources:
+        parser = VhdlParser()
+        ctx = parser.parseSources(sources)
+
+        ctx.diag.dump()
+        print(ctx.designFile)
+
+# measured in a fresh interpreter so nothing is already imported or compiled
+COLD_START_SCRIPT = r'''
+import sys, time
+t0 = time.perf_counter()
+import vhparse
+parser = vhparse.VhdlParser(cache={cache}, tabdir={tabdir!r})
+lexer = parser.lexer.lexer
+lexer.input("package standard is end package standard;")
+tok = lexer.token()
+t1 = time.perf_counter()
+assert tok.type == 'PACKAGE'
+print((t1 - t0) * 1000.0)
+'''
+
+def cold_start(runs=5, cache=True, tabdir=None):
+    """Milliseconds from 'import vhparse' to the first token, in fresh processes.
+       The first run builds the tables if they don't exist yet and is reported separately."""
+    import os
+    import subprocess
+    import sys
+    script = COLD_START_SCRIPT.format(cache=cache, tabdir=tabdir)
+    times = []
+    for ii in range(runs + 1):
+        out = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times[0], times[1:]
+
+def cold_start_bench(runs=5, fresh=False):
+    """Print the cold start without and with the cached tables, from an empty table
+       directory if fresh"""
+    import shutil
+    import statistics
+    import tempfile
+    tabdir = None
+    if fresh:
+        tabdir = tempfile.mkdtemp(prefix="vhtables")
+    try:
+        for cache in (False, True):
+            first, times = cold_start(runs, cache, tabdir)
+            mode = "cached tables" if cache else "no cache"
+            print(f"{mode:14}: first run {first:8.1f} ms, "
+                  f"min {min(times):8.1f} ms, median {statistics.median(times):8.1f} ms ({len(times)} runs)")
+    finally:
+        if tabdir:
+            shutil.rmtree(tabdir, ignore_errors=True)
+
+def parse_time(data, diag, runs=3):
+    """Best of runs seconds to parse data, reporting to the DiagnosticSink made by diag()"""
+    import time
+    best = None
+    parser = VhdlParser()
+    for ii in range(runs):
+        sink = diag()
+        start = time.perf_counter()
+        parser.parse(data, sink)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sink
+
+def diag_bench(data, limit=10, runs=3):
+    """Print the parse time of data with each DiagnosticSink mode.  The std package
+       concatenated with itself redeclares everything after the first copy."""
+    import os
+    import time
+    import ldiag
+    modes = {
+        "record + dump": lambda: DiagnosticSink(vhdiag.vh_messages),
+        "record": lambda: DiagnosticSink(vhdiag.vh_messages),
+        f"limit {limit}": lambda: DiagnosticSink(vhdiag.vh_messages, limit=limit),
+        "count only": lambda: DiagnosticSink(vhdiag.vh_messages, countOnly=True),
+        "errors only": lambda: DiagnosticSink(vhdiag.vh_messages, severity=ldiag.ERROR),
+    }
+    for mode, diag in modes.items():
+        elapsed, sink = parse_time(data, diag, runs)
+        if mode == "record + dump":
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull:
+                sink.dump(devnull)
+            elapsed += time.perf_counter() - start
+        print(f"{mode:14}: {elapsed:7.3f} s, {sink.count()} diagnostics, {len(sink)} recorded")
+
+def parse_result(parser, sources):
+    # everything a parse produces, as text
+    ctx = parser.parseSources(sources)
+    return str(ctx.designFile), repr(ctx.rootScope), list(ctx.diag.formatted())
+
+def threads_test(nthreads=16, nparses=64):
+    """Parse the std library nparses times from nthreads threads with one shared VhdlParser
+       and check that every parse gives the same result as a parse on its own"""
+    for backend in VhdlLexer.backends:
+        parser = VhdlParser(backend=backend)
+        with SourceManager(STD_SOURCES) as sources:
+            expected = parse_result(parser, sources)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as pool:
+                results = list(pool.map(lambda ii: parse_result(parser, sources), range(nparses)))
+        failures = sum(1 for result in results if result != expected)
+        print(f"{backend}: {nparses} parses in {nthreads} threads, {failures} differ")
+        if failures:
+            return False
+    return True
+
+OVERLOAD_SOURCE = """
+package p is
+    function f(x : INTEGER) return INTEGER;
+    function f(x : INTEGER) return BOOLEAN;
+    function f(x : BOOLEAN; y : INTEGER := 0) return INTEGER;
+    procedure f(x : INTEGER);
+    function f(x : INTEGER) return INTEGER;
+end package p;
+"""
+
+def overload_test():
+    """Check the overload sets of textio and of OVERLOAD_SOURCE: every overload is kept,
+       the indexed candidates are those a scan of the members finds, and only the
+       homograph is reported"""
+    parser = VhdlParser()
+    with SourceManager(STD_SOURCES) as sources:
+        ctx = parser.parseSources(sources)
+    textio = [ unit for unit in ctx.designFile.units if unit and unit.sym.key == 'textio' ][0]
+    ok = not [ record for record in ctx.diag if record.code == vhdiag.SYMBOL_EXISTS ]
+    for name, count in (('read', 16), ('write', 8)):
+        overloads = textio.scope.overloads[name]
+        ok = ok and len(overloads) == count
+        for decl in overloads.members:
+            params, result = decl.signature()
+            scanned = [ other for other in overloads.members if other.signature()[0] == params ]
+            ok = ok and overloads.candidates(params=params) == scanned
+            for arity in range(5):
+                scanned = [ other for other in overloads.members
+                            if other.required() <= arity <= len(other.signature()[0]) ]
+                ok = ok and overloads.candidates(arity) == scanned
+    ok = ok and len(textio.scope.resolve('READ', 3)) == 8 and len(textio.scope.resolve('WRITE', 2)) == 8
+
+    ctx = parser.parse(OVERLOAD_SOURCE)
+    scope = ctx.designFile.units[0].scope
+    exists = [ record for record in ctx.diag if record.code == vhdiag.SYMBOL_EXISTS ]
+    ok = (ok and len(exists) == 1 and len(scope.resolve('f')) == 4 and len(scope.resolve('f', 2)) == 1
+          and len(scope.resolve('f', params=('integer',))) == 3
+          and len(scope.resolve('f', params=('integer',), result='boolean')) == 1
+          and len(scope.resolve('f', 1, result='integer')) == 2)
+    print(f"overload: READ and WRITE overloads kept and indexed, the homograph reported: {ok}")
+    return ok
 
-    print(parser.designFile)
-    
 if __name__ == "__main__":
     parser_test()
+    threads_test()
+    overload_test()
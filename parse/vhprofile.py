@@ -0,0 +1,248 @@
+# parser profiling
+#
+# A ParseProfile given to a VhdlParser counts the reductions of each production rule
+# and the tokens of each kind, and times the rules and the phases of a parse:
+#
+#   read        reading the sources (the caller times it with phase())
+#   lex         the lexer producing the tokens the parser pulls
+#   parse       the LR parser and the rule actions, less lex and scope
+#   scope       the symbol lookups of the rules (VhdlParseContext.find/search/pget)
+#   decompile   decompiling the design file (the caller times it with phase())
+#
+# Nothing is wrapped unless the parser has a profile, and then only the rules and the
+# lookups of its own parses: the classes aren't patched, other parsers running at the
+# same time parse exactly as before.  Run from the parse directory:
+#
+#   python vhprofile.py <files> [--backend scanner] [--top N] [--json file]
+
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+PHASES = ('read', 'lex', 'parse', 'scope', 'decompile')
+
+# the scope lookups of a VhdlParseContext timed as the scope phase
+SCOPE_LOOKUPS = ('find', 'search', 'pget')
+
+clock = time.perf_counter
+
+
+class ParseProfile():
+    """The counts and times of the parses of the VhdlParsers it is given to.  It is
+       updated without a lock, profile one parse at a time."""
+
+    def __init__(self):
+        self.productions = {}   # rule function name -> [reductions, seconds]
+        self.tokens = {}        # token type -> count
+        self.seconds = dict.fromkeys(PHASES, 0.0)   # 'parse' includes lex and scope
+        self.parses = 0
+
+    def __repr__(self):
+        return f"ParseProfile(parses={self.parses}, reductions={sum(n for n, s in self.productions.values())})"
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.seconds[name] += clock() - start
+
+    def production(self, name, action):
+        """action, counted and timed as the production name"""
+        stats = self.productions.setdefault(name, [ 0, 0.0 ])
+        def timed(p):
+            start = clock()
+            action(p)
+            stats[0] += 1
+            stats[1] += clock() - start
+        return timed
+
+    def lookups(self, ctx):
+        """Time the scope lookups of the rules of the parse context ctx as the scope
+           phase, the wrappers are attributes of ctx alone"""
+        for name in SCOPE_LOOKUPS:
+            setattr(ctx, name, self.lookup(getattr(ctx, name)))
+
+    def lookup(self, method):
+        seconds = self.seconds
+        def timed(*args):
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                seconds['scope'] += clock() - start
+        return timed
+
+    def lexer(self, lexer):
+        return ProfiledLexer(self, lexer)
+
+    @contextlib.contextmanager
+    def parsing(self):
+        self.parses += 1
+        with self.phase('parse'):
+            yield
+
+    def phases(self):
+        # seconds of each phase, each excludes the others
+        phases = dict(self.seconds)
+        phases['parse'] -= phases['lex'] + phases['scope']
+        return phases
+
+    def report(self):
+        """The profile as a dict of plain values, for json"""
+        productions = sorted(self.productions.items(), key=lambda item: item[1][1], reverse=True)
+        return { 'parses': self.parses,
+                 'phases': self.phases(),
+                 'productions': { name: { 'reductions': count, 'seconds': seconds }
+                                  for name, (count, seconds) in productions if count },
+                 'tokens': dict(sorted(self.tokens.items(), key=lambda item: item[1], reverse=True)) }
+
+    def json(self):
+        return json.dumps(self.report(), indent=1)
+
+    def table(self, file=None, top=None):
+        """Print the phases, the productions by time and the tokens by count"""
+        file = file or sys.stdout
+        report = self.report()
+        total = sum(report['phases'].values()) or 1.0
+        print(f"{'phase':12} {'ms':>10} {'%':>6}", file=file)
+        for name, seconds in report['phases'].items():
+            print(f"{name:12} {seconds * 1000.0:10.1f} {100.0 * seconds / total:6.1f}", file=file)
+
+        productions = list(report['productions'].items())[:top]
+        print(f"\n{'reductions':>10} {'ms':>10} {'us each':>8}  production", file=file)
+        for name, stats in productions:
+            count, seconds = stats['reductions'], stats['seconds']
+            print(f"{count:10} {seconds * 1000.0:10.1f} {seconds * 1e6 / count:8.2f}  {name}", file=file)
+
+        tokens = list(report['tokens'].items())[:top]
+        print(f"\n{'tokens':>10}  type", file=file)
+        for name, count in tokens:
+            print(f"{count:10}  {name}", file=file)
+
+
+class ProfiledLexer():
+    """A lexer whose tokens are counted and timed, everything else is the lexer's"""
+
+    def __init__(self, profile, lexer):
+        self.profile = profile
+        self.lexer = lexer
+
+    def __getattr__(self, name):
+        return getattr(self.lexer, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        tok = self.token()
+        if tok is None:
+            raise StopIteration
+        return tok
+
+    def token(self):
+        start = clock()
+        tok = self.lexer.token()
+        self.profile.seconds['lex'] += clock() - start
+        if tok is not None:
+            self.profile.tokens[tok.type] = self.profile.tokens.get(tok.type, 0) + 1
+        return tok
+
+
+def profile_files(paths, backend='scanner', profile=None):
+    """Read, parse and decompile each file with a profiled VhdlParser"""
+    from vhparse import VhdlParser
+    profile = profile or ParseProfile()
+    parser = VhdlParser(backend=backend, std=True, profile=profile)
+    for path in paths:
+        with profile.phase('read'):
+            with open(path, 'r', encoding='utf-8', errors='ignore') as src:
+                data = src.read()
+        ctx = parser.parse(data, path=path)
+        with profile.phase('decompile'):
+            str(ctx.designFile)
+    return profile
+
+
+# tests
+
+PROFILE_SOURCE = """
+package p is
+    type state is (IDLE, RUN);
+    constant C : INTEGER := 1;
+    constant D : INTEGER := C;
+    function f(x : INTEGER) return INTEGER;
+end package p;
+"""
+
+def profile_test():
+    """Parse PROFILE_SOURCE with and without a profile and check that the results are
+       the same, that the counts are those of the source and that only the profiled
+       context's lookups are wrapped"""
+    from vhparse import VhdlParser
+    ok = True
+    for backend in ('ply', 'scanner'):
+        plain = VhdlParser(backend=backend, std=True)
+        profile = ParseProfile()
+        profiled = VhdlParser(backend=backend, std=True, profile=profile)
+        ctx = plain.parse(PROFILE_SOURCE)
+        expected = str(ctx.designFile)
+        wrapped = [ name for name in SCOPE_LOOKUPS if name in vars(ctx) ]
+        ctx = profiled.parse(PROFILE_SOURCE)
+        result = str(ctx.designFile)
+        timed = [ name for name in SCOPE_LOOKUPS if getattr(ctx, name).__name__ == 'timed' ]
+        report = json.loads(profile.json())
+        reductions = report['productions']
+        phases = report['phases']
+        print(f"{backend}: {sum(report['tokens'].values())} tokens, "
+              f"{sum(stats['reductions'] for stats in reductions.values())} reductions, "
+              f"{', '.join(f'{name} {seconds * 1000.0:.2f} ms' for name, seconds in phases.items())}")
+        ok = (ok and result == expected and report['parses'] == 1
+              and report['tokens'].get('CONSTANT') == 2 and report['tokens'].get('IDENT') == 14
+              and reductions['p_package_decl']['reductions'] == 1
+              and phases['lex'] > 0 and phases['scope'] > 0 and phases['parse'] > 0
+              and not wrapped and timed == list(SCOPE_LOOKUPS))
+    print(f"profile: counts as expected, same result as without a profile, only the profiled lookups wrapped: {ok}")
+    return ok
+
+def profile_bench(npackages=500, backend='scanner', runs=3, top=10):
+    """Print the parse time of a source of npackages packages without and with a
+       ParseProfile, and the profile"""
+    from vhparse import VhdlParser
+    from vhunits import test_source
+    data = test_source(npackages)
+    print(f"{npackages} packages, {len(data) / 1024:.0f} KB")
+    for name, profile in (("no profile", None), ("profile", ParseProfile())):
+        parser = VhdlParser(backend=backend, std=True, profile=profile)
+        best = None
+        for ii in range(runs):
+            start = time.perf_counter()
+            parser.parse(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:10}: {best * 1000.0:8.1f} ms")
+    profile.table(top=top)
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description="profile the vhdl parser on some sources")
+    argp.add_argument("paths", nargs="+", help="vhdl files")
+    argp.add_argument("--backend", default="scanner")
+    argp.add_argument("--top", type=int, default=30, help="print this many productions and token types")
+    argp.add_argument("--json", help="write the profile to this file as json")
+    args = argp.parse_args(argv)
+
+    profile = profile_files(args.paths, args.backend)
+    profile.table(top=args.top)
+    if args.json:
+        with open(args.json, 'w') as dst:
+            dst.write(profile.json())
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    profile_test()
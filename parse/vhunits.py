@@ -0,0 +1,589 @@
+# design unit spans and incremental parsing
+#
+# split_units() cuts the tokens of a source into its design units (context clause and
+# library unit) without parsing, and fingerprints the source text of each unit.  An
+# IncrementalParser keeps the units of a file between updates and reparses only the
+# units whose fingerprint changed, and stream_units() parses a source one unit at a time.
+# Run from the parse directory:
+#
+#   python vhunits.py
+
+import hashlib
+from bisect import bisect_left
+from collections import namedtuple
+
+import ldiag
+import vhdiag
+from ldiag import DiagnosticSink
+from lsource import LineTable
+from vhlex import KIND_CODES, VhdlScanner
+
+# start and end are source offsets (end just past the last token), line and column
+# the position of start, fingerprint a digest of the source text of the unit
+UnitSpan = namedtuple('UnitSpan', 'start end line column fingerprint')
+
+_SEMI = KIND_CODES['SEMI']
+_END = KIND_CODES['END']
+_IS = KIND_CODES['IS']
+_NEW = KIND_CODES['NEW']
+_COLON = KIND_CODES[':']
+_LPAREN = KIND_CODES['(']
+_RPAREN = KIND_CODES[')']
+_PACKAGE = KIND_CODES['PACKAGE']
+_BODY = KIND_CODES['BODY']
+_IDENT = KIND_CODES['IDENT']
+
+# the keywords that start a library unit
+UNIT_KINDS = frozenset(KIND_CODES[name] for name in ('ENTITY', 'ARCHITECTURE', 'PACKAGE', 'CONFIGURATION'))
+# the constructs whose END always names them (end if, end record, ..), they can't end a unit
+NAMED_END_KINDS = frozenset(KIND_CODES[name] for name in ('IF', 'LOOP', 'CASE', 'PROCESS', 'BLOCK', 'GENERATE',
+                                                          'RECORD', 'UNITS', 'PROTECTED', 'COMPONENT', 'FOR'))
+# the nested regions whose END may be a bare 'end;' like the END of a unit
+REGION_KINDS = frozenset(KIND_CODES[name] for name in ('FUNCTION', 'PROCEDURE', 'PACKAGE'))
+# what follows the optional 'end [label];' of a generate statement body
+GENERATE_BODY_FOLLOW = frozenset(KIND_CODES[name] for name in ('END', 'ELSIF', 'ELSE', 'WHEN'))
+
+
+def fingerprint(text):
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return hashlib.blake2b(text, digest_size=16).digest()
+
+def next_semi(kinds, idx):
+    # index of the first SEMI at or after idx, the last token if there is none
+    while idx < len(kinds) and kinds[idx] != _SEMI:
+        idx += 1
+    return min(idx, len(kinds) - 1)
+
+def has_body(kinds, idx):
+    """True if the subprogram or package header at idx is followed by IS and a body,
+       False if by a SEMI (a declaration) or by IS NEW (an instantiation), None if the
+       tokens end first"""
+    parens = 0
+    for jj in range(idx + 1, len(kinds)):
+        kind = kinds[jj]
+        if kind == _LPAREN:
+            parens += 1
+        elif kind == _RPAREN:
+            parens -= 1
+        elif parens == 0:
+            if kind == _SEMI:
+                return False
+            if kind == _IS:
+                return kinds[jj + 1] != _NEW if jj + 1 < len(kinds) else None
+    return None
+
+def unit_end(kinds, idx):
+    """Index of the SEMI that ends the library unit starting at idx, -1 if the tokens
+       end first.  Only the nested regions that can end with a bare 'end;' are counted,
+       every other END names what it ends."""
+    body = has_body(kinds, idx)
+    if body is None:
+        return -1
+    if not body:
+        return next_semi(kinds, idx)        # package instantiation
+    regions = 0
+    parens = 0
+    jj = idx + 1
+    while jj < len(kinds):
+        kind = kinds[jj]
+        if kind == _END:
+            if jj + 1 < len(kinds) and kinds[jj + 1] in NAMED_END_KINDS:
+                jj += 2
+                continue
+            semi = next_semi(kinds, jj)
+            if kinds[semi] != _SEMI:
+                return -1
+            if regions:
+                regions -= 1
+            elif semi + 1 >= len(kinds) or kinds[semi + 1] not in GENERATE_BODY_FOLLOW:
+                return semi
+            jj = semi + 1
+            continue
+        if kind == _LPAREN:
+            parens += 1
+        elif kind == _RPAREN:
+            parens -= 1
+        elif kind in REGION_KINDS and parens == 0 and kinds[jj - 1] != _COLON:
+            # not an interface subprogram, or an entity class in an attribute spec
+            body = has_body(kinds, jj)
+            if body is None:
+                return -1
+            regions += body
+        jj += 1
+    return -1
+
+def scan_units(columns, base=0, lines=None):
+    """Yields (UnitSpan, complete) for the design units in a TokenColumns.  complete is
+       False for a unit the tokens end in, and for tokens after the last library unit.
+       The columns may hold a part of a source that starts at offset base, lines is
+       then the LineTable of the whole source."""
+    kinds = columns.kinds
+    lines = lines or columns.lineTable
+    idx = 0
+    while idx < len(kinds):
+        first = idx
+        while idx < len(kinds) and kinds[idx] not in UNIT_KINDS:
+            idx = next_semi(kinds, idx) + 1     # context items
+        last = unit_end(kinds, idx) if idx < len(kinds) else -1
+        complete = last >= 0
+        if not complete:
+            last = len(kinds) - 1
+        start = columns.starts[first]
+        end = columns.starts[last] + columns.lengths[last]
+        line, column = lines.position(base + start)
+        yield UnitSpan(base + start, base + end, line, column, fingerprint(columns.data[start:end])), complete
+        idx = last + 1
+
+def split_units(columns):
+    """The UnitSpans of the design units in a TokenColumns (VhdlLexer.tokenize()).
+       Tokens after the last library unit are a span of their own."""
+    return [ span for span, complete in scan_units(columns) ]
+
+def unit_header(columns, span):
+    """(kind, name) of the library unit of a span: kind is the unit keyword in lower case
+       ('package body' for a package body), name the Ident after it.  (None, None) for a
+       span without a library unit."""
+    kinds = columns.kinds
+    idx = bisect_left(columns.starts, span.start)
+    while idx < len(kinds) and columns.starts[idx] < span.end and kinds[idx] not in UNIT_KINDS:
+        idx = next_semi(kinds, idx) + 1     # context items
+    if idx >= len(kinds) or columns.starts[idx] >= span.end:
+        return None, None
+    kind = columns.text(idx).lower()
+    if kinds[idx] == _PACKAGE and idx + 1 < len(kinds) and kinds[idx + 1] == _BODY:
+        kind = "package body"
+        idx += 1
+    if idx + 1 < len(kinds) and kinds[idx + 1] == _IDENT:
+        return kind, columns.value(idx + 1)
+    return kind, None
+
+def common_prefix(a, b):
+    # length of the common prefix of two str, by comparing ever smaller slices
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def common_suffix(a, b, limit):
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def stream_units(parser, data, diag=None, path=None, window=1 << 20):
+    """Yields (unit, UnitSpan) for the library units of data (str or bytes-like) as soon
+       as each is parsed, see VhdlParser.parseUnits().  data is split in windows of about
+       window characters or bytes, so only one window and one unit are held at a time."""
+    inplace = isinstance(parser.lexer.lexer, VhdlScanner)
+    pos, line, column = 0, 1, 0     # where the next window starts
+    while pos < len(data):
+        chunk = data[pos:pos + window]
+        final = pos + len(chunk) >= len(data)
+        columns = parser.lexer.tokenize(chunk)
+        accepted = []
+        for span, complete in scan_units(columns):
+            # the end of a unit is decided by the token after it, which must not be cut
+            # off by the end of the window
+            if not final and (not complete or len(columns) - bisect_left(columns.starts, span.end) < 2):
+                break
+            accepted.append(span)
+        if not accepted:
+            if final:
+                return      # nothing but comments left
+            window *= 2     # a unit larger than the window
+            continue
+
+        for span in accepted:
+            text = chunk[span.start:span.end]
+            if not inplace and not isinstance(text, str):
+                text = bytes(text).decode('utf-8', errors='ignore')
+            start = (pos + span.start, line + span.line - 1, span.column + (column if span.line == 1 else 0))
+            ctx = parser.parse(text, diag, path, LineTable(text, path, start[1:]))
+            span = UnitSpan(start[0], pos + span.end, start[1], start[2], span.fingerprint)
+            units = ctx.designFile.units if isinstance(ctx.designFile.units, list) else []
+            for unit in units:
+                if unit:
+                    yield unit, span
+
+        consumed = accepted[-1].end
+        newline = "\n" if isinstance(chunk, str) else b"\n"
+        lines = chunk.count(newline, 0, consumed)
+        if lines:
+            line += lines
+            column = 0
+        tail = chunk[chunk.rfind(newline, 0, consumed) + 1:consumed]
+        column += len(tail) if isinstance(tail, str) else len(bytes(tail).decode('utf-8', errors='ignore'))
+        pos += consumed
+
+
+class ParsedUnit():
+    """A design unit of an IncrementalParser: its span, the library units its parse
+       produced (one unless the split was off), its LineTable and its diagnostics"""
+
+    def __init__(self, span, lines, units, diag, symbols):
+        self.span = span
+        self.lines = lines
+        self.units = units
+        self.diag = diag
+        self.symbols = symbols      # the Symbols the parse added to the root scope
+
+    def __repr__(self):
+        return f"ParsedUnit(names={self.names()}, line={self.span.line})"
+
+    def names(self):
+        return [ str(unit.sym.name) for unit in self.units if unit ]
+
+    def move(self, span, path):
+        # the same text at another place, the locations follow the LineTable
+        self.span = span
+        self.lines.setOrigin(span.line, span.column)
+        self.lines.path = path
+
+    def release(self, scope):
+        for sym in self.symbols:
+            scope.remove(sym)
+
+
+class UnitChanges():
+    """What an IncrementalParser.update() did, as lists of ParsedUnit: the units parsed
+       for the first time (added), reparsed because their text changed (changed, the
+       ones they replace are in replaced), gone from the source (removed) and reused
+       as they were (unchanged, possibly moved)"""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.replaced = []
+        self.removed = []
+        self.unchanged = []
+
+    def __repr__(self):
+        return (f"UnitChanges(added={self.names(self.added)}, changed={self.names(self.changed)}, "
+                f"removed={self.names(self.removed)}, unchanged={len(self.unchanged)})")
+
+    @staticmethod
+    def names(entries):
+        return [ name for entry in entries for name in entry.names() ]
+
+    def invalidated(self):
+        """The names of the design units downstream stages have to redo"""
+        return self.names(self.added + self.changed + self.removed)
+
+
+class IncrementalParser():
+    """Parses a file at design unit granularity.  update() splits the new text into
+       units and reparses only the units whose fingerprint isn't one of the previous
+       units, the others keep their library unit objects, scopes and diagnostics.
+
+       Every unit is parsed on its own into one root scope that lives as long as the
+       IncrementalParser.  A reused unit still refers to the Symbols of the units it
+       found there, the UnitChanges tell which of them were replaced."""
+
+    def __init__(self, parser, path=None):
+        self.parser = parser    # a VhdlParser
+        self.path = path
+        self.scope = None
+        self.designFile = None
+        self.entries = []
+        self.text = None        # the source of the entries
+
+    def update(self, data, path=None):
+        """Bring the design file up to date with data, returns the UnitChanges"""
+        self.path = path or self.path
+        if self.scope is None:
+            ctx = self.parser.parse("", path=self.path)     # a root scope with the keywords and libraries
+            self.scope = ctx.rootScope
+            self.designFile = ctx.designFile
+        self.designFile.filepath = self.path or ""
+
+        old = {}
+        for entry in self.entries:
+            old.setdefault(entry.span.fingerprint, []).append(entry)
+        changes = UnitChanges()
+        entries = []
+        for span in self.split(data):
+            reused = old.get(span.fingerprint)
+            if reused:
+                entry = reused.pop(0)
+                entry.move(span, self.path)
+                changes.unchanged.append(entry)
+            else:
+                entry = span    # parsed below, once the replaced units are out of the scope
+            entries.append(entry)
+
+        replaced = [ entry for same in old.values() for entry in same ]
+        for entry in replaced:
+            entry.release(self.scope)
+        oldNames = set(UnitChanges.names(replaced))
+        for idx, entry in enumerate(entries):
+            if isinstance(entry, UnitSpan):
+                entry = entries[idx] = self.parseUnit(data, entry)
+                changed = any(name in oldNames for name in entry.names())
+                (changes.changed if changed else changes.added).append(entry)
+        newNames = set(UnitChanges.names(changes.changed))
+        for entry in replaced:
+            if any(name in newNames for name in entry.names()):
+                changes.replaced.append(entry)
+            else:
+                changes.removed.append(entry)
+
+        self.entries = entries
+        self.text = data
+        self.designFile.units = [ unit for entry in entries for unit in entry.units ]
+        return changes
+
+    def split(self, data):
+        """The UnitSpans of data.  Only the text between the parts data has in common with
+           the previous text is tokenized, the units before and after keep their spans."""
+        lexer = self.parser.lexer
+        old = self.text
+        if old is None or type(old) is not type(data) or not self.entries:
+            return split_units(lexer.tokenize(data))
+        prefix = common_prefix(old, data)
+        suffix = common_suffix(old, data, min(len(old), len(data)) - prefix)
+        delta = len(data) - len(old)
+        spans = [ entry.span for entry in self.entries ]
+        # the last unit before the edit is split again, its end depends on the token after it,
+        # and so is the first unit after it, the edit may change how its first line lexes
+        head = [ span for span in spans if span.end < prefix ][:-1]
+        tail = [ span for span in spans if span.start >= len(old) - suffix ]
+        start = head[-1].end if head else 0
+        end = tail[1].start + delta if len(tail) > 1 else len(data)
+
+        lines = LineTable(data)
+        middle = list(scan_units(lexer.tokenize(data[start:end]), start, lines))
+        if len(tail) > 1 and (not middle or not middle[-1][1] or middle[-1][0].end != tail[0].end + delta):
+            return split_units(lexer.tokenize(data))     # the edit moved the start of the tail
+        spans = head + [ span for span, complete in middle ]
+        for span in tail[1:]:
+            line, column = lines.position(span.start + delta)
+            spans.append(UnitSpan(span.start + delta, span.end + delta, line, column, span.fingerprint))
+        return spans
+
+    def parseUnit(self, data, span):
+        lines = LineTable(data[span.start:span.end], self.path, (span.line, span.column))
+        before = set(self.scope.symbols)
+        ctx = self.parser.parse(lines.data, DiagnosticSink(vhdiag.vh_messages), self.path, lines, self.scope)
+        symbols = [ sym for key, sym in self.scope.symbols.items() if key not in before ]
+        units = ctx.designFile.units if isinstance(ctx.designFile.units, list) else []
+        return ParsedUnit(span, lines, units, ctx.diag, symbols)
+
+    def messages(self):
+        for entry in self.entries:
+            yield from entry.diag.formatted()
+
+    def errors(self):
+        return sum(entry.diag.count(ldiag.ERROR) for entry in self.entries)
+
+
+# tests
+
+def test_source(npackages, edited=-1):
+    """npackages small packages, the one at index edited gets one more declaration"""
+    text = "library STD;\nuse STD.standard.all;\n\n"
+    for ii in range(npackages):
+        text += f"-- package {ii}\npackage pkg{ii} is\n"
+        text += f"    constant C{ii} : INTEGER := {ii};\n"
+        text += f"    constant D{ii} : INTEGER := undeclared{ii};\n"       # a diagnostic with a position
+        if ii == edited:
+            text += f"    constant EXTRA{ii} : BOOLEAN := TRUE;\n"
+        text += f"    type state{ii} is (IDLE{ii}, RUN{ii});\n"
+        text += f"    function f{ii}(x : INTEGER) return INTEGER;\n"
+        text += f"end package pkg{ii};\n\n"
+    return text
+
+def unit_locations(units):
+    return [ (str(unit.sym.name), unit.sym.loc.sline, unit.sym.loc.scol, unit.sym.loc.eline, unit.sym.loc.ecol)
+             for unit in units ]
+
+SPLIT_SOURCE = """
+library ieee; use ieee.std_logic_1164.all;
+package p is
+    function f(x : integer) return integer;
+    attribute a : integer;
+    attribute a of f : function is 1;
+end;
+package body p is
+    function f(x : integer) return integer is
+        type r is record v : integer; end record;
+    begin
+        if x > 0 then return x; end if;
+        return 0;
+    end;
+    procedure q is begin null; end procedure q;
+end package body;
+package i is new work.g generic map (n => 1);
+entity e is
+    generic (function h return integer is <>);
+end entity e;
+architecture a of e is
+begin
+    g1: if true generate
+        signal s : bit;
+    begin
+        s <= '1';
+    end;
+    else generate
+    end generate;
+    process begin wait; end process;
+end a;
+configuration c of e is for a end for; end c;
+"""
+
+def split_test():
+    """Check the unit boundaries split_units() finds in SPLIT_SOURCE"""
+    from vhlex import VhdlLexer
+    lexer = VhdlLexer()
+    spans = split_units(lexer.tokenize(SPLIT_SOURCE))
+    lasts = [ SPLIT_SOURCE[span.start:span.end].split()[-1] for span in spans ]
+    print(f"{len(spans)} design units: {lasts}")
+    return lasts == [ "end;", "body;", "1);", "e;", "a;", "c;" ]
+
+def region_split_test(nedits=300, seed=1):
+    """Random edits, including ones that break units apart, and check that the spans
+       IncrementalParser.split() finds equal the spans of a split of the whole text"""
+    import random
+    from vhlex import VhdlLexer
+    rand = random.Random(seed)
+    lexer = VhdlLexer()
+    incr = IncrementalParser(None)
+    incr.parser = type('parser', (), { 'lexer': lexer })    # split() only needs the lexer
+    pieces = [ "end;", "end package;", " is ", "package x is\n", "-- ", "\n", "function f is begin\n", ";", "" ]
+    text = test_source(8) + SPLIT_SOURCE
+    failures = 0
+    for ii in range(nedits):
+        pos = rand.randrange(len(text) + 1)
+        cut = rand.choice([ 0, 0, 1, 5, 20 ])
+        text = text[:pos] + rand.choice(pieces) + text[pos + cut:]
+        spans = incr.split(text)
+        if spans != split_units(lexer.tokenize(text)):
+            failures += 1
+        incr.entries = [ ParsedUnit(span, None, [], None, []) for span in spans ]
+        incr.text = text
+    print(f"{nedits} edits, {failures} splits differ")
+    return failures == 0
+
+def incremental_test(npackages=20):
+    """Edit one package, then remove one, and check that the IncrementalParser reparses
+       only those and ends up with what a full parse of the new text gives"""
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    incr = IncrementalParser(parser, "incremental.vhd")
+    ok = True
+    steps = [ ("parse", test_source(npackages), npackages, 0),
+              ("edit", test_source(npackages, npackages // 2), 0, 1),
+              ("same", test_source(npackages, npackages // 2), 0, 0) ]
+    removed = test_source(npackages, npackages // 2)
+    removed = removed.replace(removed[removed.index("-- package 3\n"):removed.index("-- package 4\n")], "")
+    steps.append(("remove", removed, 0, 0))
+    for step, text, nadded, nchanged in steps:
+        previous = list(incr.designFile.units) if incr.designFile else []
+        changes = incr.update(text)
+        full = parser.parse(text, path="incremental.vhd")
+        same = (unit_locations(incr.designFile.units) == unit_locations(full.designFile.units)
+                and str(incr.designFile) == str(full.designFile)
+                and sorted(incr.messages()) == sorted(full.diag.formatted()))
+        reused = sum(1 for unit in incr.designFile.units if any(unit is old for old in previous))
+        print(f"{step:6}: {changes}, {reused} units reused, same as a full parse: {same}")
+        ok = ok and same and len(changes.added) == nadded and len(changes.changed) == nchanged
+    return ok
+
+def incremental_bench(npackages=2500, backend='scanner'):
+    """Print the time of a full parse against an incremental update of a source of
+       npackages packages after editing the one in the middle"""
+    import time
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend=backend, std=True)
+    text = test_source(npackages)
+    edited = test_source(npackages, npackages // 2)
+    print(f"{npackages} packages, {text.count(chr(10))} lines")
+
+    start = time.perf_counter()
+    parser.parse(edited)
+    full = time.perf_counter() - start
+    incr = IncrementalParser(parser)
+    incr.update(text)
+    start = time.perf_counter()
+    changes = incr.update(edited)
+    update = time.perf_counter() - start
+    print(f"full parse        : {full * 1000.0:8.1f} ms")
+    print(f"incremental update: {update * 1000.0:8.1f} ms, {full / update:.1f}x, {changes}")
+
+def stream_test(npackages=40):
+    """Stream test_source() as str and as bytes with windows from smaller than a unit to
+       larger than the source, and check that the units, their spans and the diagnostics
+       are those of a full parse"""
+    from vhparse import VhdlParser
+    text = test_source(npackages, 3) + "\n-- the end\n"
+    ok = True
+    for backend in ('ply', 'scanner'):
+        parser = VhdlParser(backend=backend, std=True)
+        full = parser.parse(text, path="stream.vhd")
+        expected = (unit_locations(full.designFile.units), [ str(unit) for unit in full.designFile.units ],
+                    list(full.diag.formatted()))
+        for data in (text, text.encode('utf-8')):
+            for window in (64, 1000, 1 << 20):
+                diag = DiagnosticSink(vhdiag.vh_messages)
+                streamed = list(parser.parseUnits(data, diag, "stream.vhd", window))
+                units = [ unit for unit, span in streamed ]
+                spans = all(text[span.start:span.end].endswith(f"end package pkg{ii};")
+                            and span.line == text.count("\n", 0, span.start) + 1 for ii, (unit, span) in enumerate(streamed))
+                result = (unit_locations(units), [ str(unit) for unit in units ], list(diag.formatted()))
+                if result != expected or not spans:
+                    print(f"{backend} {type(data).__name__} window {window}: streamed units differ")
+                    ok = False
+    print(f"stream: {npackages} packages streamed in windows, same as a full parse: {ok}")
+    return ok
+
+def stream_run(units, traced):
+    """(seconds, seconds to the first unit, peak traced bytes) to consume units(), the
+       times of an untraced run, tracemalloc slows the parse down several times"""
+    import gc
+    import time
+    import tracemalloc
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    for unit in units():
+        if first is None:
+            first = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, first, peak
+
+def stream_bench(npackages=5000, window=1 << 16, backend='scanner'):
+    """Print the time to the first unit and the peak memory of a full parse and of
+       streaming a source of npackages packages"""
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend=backend, std=True)
+    data = test_source(npackages).encode('utf-8')
+    print(f"{npackages} packages, {len(data) / 1024:.0f} KB")
+
+    runs = (("full parse", lambda: parser.parse(data.decode('utf-8')).designFile.units),
+            ("streaming ", lambda: parser.parseUnits(data, window=window)))
+    for name, units in runs:
+        elapsed, first, _ = stream_run(units, False)
+        peak = stream_run(units, True)[2]
+        print(f"{name}: {elapsed * 1000.0:8.1f} ms, first unit after {first * 1000.0:8.1f} ms, "
+              f"peak memory {peak / (1 << 20):6.1f} MB")
+
+if __name__ == "__main__":
+    split_test()
+    region_split_test()
+    incremental_test()
+    stream_test()
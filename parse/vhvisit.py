@@ -0,0 +1,303 @@
+# AST visitors and transformers
+#
+# A pass subclasses Visitor and defines the hooks of the node classes it cares about:
+#
+#   enter_<class>(node)   pre-order, before the children; return SKIP to prune them
+#   leave_<class>(node)   post-order, after the children
+#   enter(node), leave(node)   the hooks of the classes without their own
+#
+# A hook of a base class is the hook of its subclasses, enter_vhExpr sees every
+# expression.  The hooks of each node class are looked up once per pass class and
+# kept in its dispatch table.  walk() keeps its own stack, the depth of the tree isn't
+# limited by the recursion limit.
+#
+# The children of a node are the AST nodes in its slots, directly or in lists and
+# tuples (the operands of a vhBinaryExpr, selected names).  Symbols and scopes aren't
+# walked, a Symbol's ast is reached from the node that declares it.
+#
+# A Transformer rewrites the tree in place: what leave returns replaces the node in
+# its parent's slot or list, None removes it from a list.  A tuple that holds a
+# replaced node is rebuilt.  Run from the parse directory:
+#
+#   python vhvisit.py <vhdl files>
+
+import argparse
+import sys
+
+from lcommon import Emitter
+
+SKIP = object()         # returned by enter: don't walk the children of the node
+REMOVED = object()      # a list item a Transformer removed, dropped when the list is left
+
+# node class -> the names of its slots, in MRO order
+nodeSlots = {}
+
+def node_slots(cls):
+    slots = nodeSlots.get(cls)
+    if slots is None:
+        slots = nodeSlots[cls] = tuple(name for base in reversed(cls.__mro__)
+                                       for name in base.__dict__.get('__slots__', ()))
+    return slots
+
+def children(node):
+    """The AST nodes directly below node, in slot order"""
+    found = []
+    pending = [ getattr(node, name, None) for name in reversed(node_slots(type(node))) ]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, Emitter):
+            found.append(value)
+        elif type(value) is list or type(value) is tuple:
+            pending.extend(reversed(value))
+    return found
+
+
+class Visitor():
+    """Walks an AST calling the hooks of each node class, pre-order and post-order"""
+
+    rewrite = False     # what leave returns replaces the node
+    dispatch = {}       # node class -> (enter, leave), each pass class has its own
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = {}
+
+    def hooks(self, cls):
+        """The enter and leave functions of node class cls, None where the pass has
+           neither a hook of the class or its bases nor a generic one"""
+        hooks = self.dispatch.get(cls)
+        if hooks is None:
+            hooks = self.dispatch[cls] = (self.lookup('enter', cls), self.lookup('leave', cls))
+        return hooks
+
+    def lookup(self, prefix, cls):
+        passcls = type(self)
+        for base in cls.__mro__:
+            hook = getattr(passcls, f"{prefix}_{base.__name__}", None)
+            if hook is not None:
+                return hook
+        return getattr(passcls, prefix, None)
+
+    def walk(self, root):
+        """Walk the tree below root, root included.  Returns root, or for a Transformer
+           what replaced it."""
+        rewrite = self.rewrite
+        dispatch = self.dispatch
+        # a frame is [node, its slot names, next child, None] for a node and [list or
+        # tuple, None, next item, items] for a container, the items are those of a tuple
+        # or list with replaced or removed items
+        stack = []
+        value = root
+        while True:
+            # value is a node, a list or a tuple not walked yet
+            if type(value) is list or type(value) is tuple:
+                stack.append([ value, None, 0, None ])
+            else:
+                enter, leave = dispatch.get(type(value)) or self.hooks(type(value))
+                if enter is None or enter(self, value) is not SKIP:
+                    stack.append([ value, node_slots(type(value)), 0, None ])
+                else:
+                    # pruned, left without walking its children
+                    result = leave(self, value) if leave is not None else value
+                    if not stack:
+                        return result if rewrite else root
+                    if rewrite and result is not value:
+                        self.replace(stack[-1], result)
+
+            # the next child of the frame on top, leaving the frames that have no more
+            while True:
+                frame = stack[-1]
+                obj, slots, index = frame[0], frame[1], frame[2]
+                child = None
+                if slots is not None:
+                    while index < len(slots):
+                        item = getattr(obj, slots[index], None)
+                        index += 1
+                        if isinstance(item, Emitter) or type(item) is list or type(item) is tuple:
+                            child = item
+                            break
+                else:
+                    while index < len(obj):
+                        item = obj[index]
+                        index += 1
+                        if isinstance(item, Emitter) or type(item) is list or type(item) is tuple:
+                            child = item
+                            break
+                frame[2] = index
+                if child is not None:
+                    value = child
+                    break
+
+                stack.pop()
+                if slots is not None:
+                    leave = (dispatch.get(type(obj)) or self.hooks(type(obj)))[1]
+                    result = leave(self, obj) if leave is not None else obj
+                elif frame[3] is not None:
+                    items = [ item for item in frame[3] if item is not REMOVED ]
+                    if type(obj) is list:
+                        obj[:] = items
+                        result = obj
+                    else:
+                        result = tuple(items)
+                else:
+                    result = obj
+                if not stack:
+                    return result if rewrite else root
+                if rewrite and result is not obj:
+                    self.replace(stack[-1], result)
+
+    def replace(self, frame, result):
+        # result takes the place of the child of frame just walked
+        obj, slots, index = frame[0], frame[1], frame[2] - 1
+        if slots is not None:
+            setattr(obj, slots[index], result)
+            return
+        if result is None:
+            result = REMOVED
+        if type(obj) is list:
+            obj[index] = result
+            if result is REMOVED:
+                frame[3] = obj
+            return
+        if frame[3] is None:
+            frame[3] = list(obj)
+        frame[3][index] = result
+
+
+class Transformer(Visitor):
+    """A Visitor whose leave hooks return what takes the place of their node: the node
+       itself, another node, or None to remove it from its list.  A node without a
+       leave hook stays."""
+    rewrite = True
+
+
+class NodeCounter(Visitor):
+    """Counts the nodes of each class"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def enter(self, node):
+        name = type(node).__name__
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def count_nodes(root):
+    counter = NodeCounter()
+    counter.walk(root)
+    return counter.counts
+
+
+# tests
+
+def recursive_count(node, counts):
+    # the walk written the usual way, recursion bounded by the recursion limit
+    name = type(node).__name__
+    counts[name] = counts.get(name, 0) + 1
+    for child in children(node):
+        recursive_count(child, counts)
+    return counts
+
+def visit_test():
+    """Walk std and a corpus and check the counts against a recursive walk, walk an
+       expression deeper than the recursion limit, prune, and rewrite literals, remove
+       constants and replace a node inside a tuple"""
+    import vhast
+    import vhcorpus
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    ok = True
+
+    text = vhcorpus.corpus_text(64 * 1024)
+    design = parser.parse(text, path="corpus.vhd").designFile
+    counts = count_nodes(design)
+    same = counts == recursive_count(design, {})
+    print(f"corpus: {sum(counts.values())} nodes, the same as a recursive walk: {same}")
+    ok = ok and same
+
+    # a chain of unary expressions far deeper than the recursion limit
+    depth = 10 * sys.getrecursionlimit()
+    expr = vhast.vhAbstractLiteral("1")
+    for ii in range(depth):
+        expr = vhast.vhUnaryExpr("-", expr)
+    deep = count_nodes(expr)
+    print(f"deep: {sum(deep.values())} nodes walked, the recursion limit is {sys.getrecursionlimit()}")
+    ok = ok and deep == { 'vhUnaryExpr': depth, 'vhAbstractLiteral': 1 }
+
+    class Pruned(NodeCounter):
+        def enter_vhSubprogram(self, node):
+            NodeCounter.enter(self, node)
+            return SKIP
+    pruned = Pruned()
+    pruned.walk(design)
+    ok = ok and counts.get('vhIfcElem') and 'vhIfcElem' not in pruned.counts and \
+        pruned.counts['vhFunction'] == counts['vhFunction']
+
+    class Decimal(Transformer):
+        def leave_vhAbstractLiteral(self, node):
+            # a physical literal's literal is an abstract literal
+            if not isinstance(node.literal, str) or '#' not in node.literal:
+                return node
+            base, digits = node.literal.split('#')[:2]
+            return vhast.vhAbstractLiteral(str(int(digits, int(base))))
+    Decimal().walk(design)
+    rewritten = str(design) == str(parser.parse(text.replace("16#1#", "1").replace("2#1#", "1"), path="corpus.vhd").designFile)
+
+    class NoConstants(Transformer):
+        def leave_vhObjectDecl(self, node):
+            return None
+    NoConstants().walk(design)
+    removed = 'constant' not in str(design) and 'vhObjectDecl' not in count_nodes(design)
+
+    one, two = vhast.vhAbstractLiteral("1"), vhast.vhAbstractLiteral("2")
+    binary = vhast.vhBinaryExpr.__new__(vhast.vhBinaryExpr)
+    binary.operands, binary.precedence_level = [ one, ('+', one) ], 3
+    class Two(Transformer):
+        def leave_vhAbstractLiteral(self, node):
+            return two
+    root = Two().walk(vhast.vhUnaryExpr("-", binary))
+    replaced = binary.operands == [ two, ('+', two) ] and root.operand is binary
+    print(f"transform: literals rewritten: {rewritten}, constants removed: {removed}, tuple rebuilt: {replaced}")
+    ok = ok and rewritten and removed and replaced
+    print(f"visit: counts, pruning and rewrites as expected: {ok}")
+    return ok
+
+def visit_bench(size="4M", seed=1, runs=3):
+    """Print the time to walk a parsed corpus of size bytes with a Visitor against the
+       recursive walk a pass writes by hand, both counting the nodes of each class"""
+    import time
+    import vhcorpus
+    from vhparse import VhdlParser
+    parser = VhdlParser(backend='scanner', std=True)
+    data = vhcorpus.corpus_text(vhcorpus.parse_size(size), seed)
+    design = parser.parse(data).designFile
+    print(f"corpus of {len(data) / 1e6:.1f} MB")
+    for name, walk in (("recursive", lambda: recursive_count(design, {})),
+                       ("Visitor", lambda: count_nodes(design))):
+        times = []
+        for run in range(runs):
+            start = time.perf_counter()
+            counts = walk()
+            times.append(time.perf_counter() - start)
+        print(f"{name:10} {min(times) * 1000.0:8.0f} ms, {sum(counts.values())} nodes")
+
+
+def main(argv=None):
+    from vhparse import SourceManager, VhdlParser
+    argp = argparse.ArgumentParser(description="count the AST nodes of vhdl sources by class")
+    argp.add_argument("paths", nargs="+", help="vhdl files")
+    argp.add_argument("--backend", default="scanner")
+    args = argp.parse_args(argv)
+
+    with SourceManager(args.paths) as sources:
+        design = VhdlParser(backend=args.backend, std=True).parseSources(sources).designFile
+    counts = count_nodes(design)
+    for name, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        print(f"{count:10}  {name}")
+    print(f"{sum(counts.values()):10}  nodes")
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    visit_test()